@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from .config import env_flag
+
+logger = logging.getLogger("sinabung.iot")
+
+EWMA_ALPHA = float(os.environ.get("IOT_ANOMALY_EWMA_ALPHA", "0.05"))
+WINDOW_SIZE = int(os.environ.get("IOT_ANOMALY_WINDOW", "120"))
+MIN_SAMPLES = int(os.environ.get("IOT_ANOMALY_MIN_SAMPLES", "10"))
+# Lonjakan: nilai > max(baseline * faktor, baseline + k*sigma, minimum absolut).
+SPIKE_FACTOR = float(os.environ.get("IOT_ANOMALY_SPIKE_FACTOR", "2.5"))
+SPIKE_SIGMA = float(os.environ.get("IOT_ANOMALY_SPIKE_SIGMA", "4"))
+SPIKE_MIN_PM25 = float(os.environ.get("IOT_ANOMALY_SPIKE_MIN_PM25", "35"))
+SUSTAIN_SECONDS = float(os.environ.get("IOT_ANOMALY_SUSTAIN_SECONDS", "300"))
+ROC_PER_MIN = float(os.environ.get("IOT_ANOMALY_ROC_PER_MIN", "40"))
+STUCK_COUNT = int(os.environ.get("IOT_ANOMALY_STUCK_COUNT", "30"))
+SILENT_SECONDS = float(os.environ.get("IOT_DEVICE_SILENT_SECONDS", "900"))
+
+IOT_AUTO_EMERGENCY = env_flag("IOT_AUTO_EMERGENCY", "0")
+AUTO_EMERGENCY_PM25 = float(os.environ.get("IOT_AUTO_EMERGENCY_PM25", os.environ.get("IOT_PM25_MODERATE_MAX", "65")))
+AUTO_EMERGENCY_MIN_DEVICES = int(os.environ.get("IOT_AUTO_EMERGENCY_MIN_DEVICES", "1"))
+AUTO_EMERGENCY_COOLDOWN_SECONDS = float(os.environ.get("IOT_AUTO_EMERGENCY_COOLDOWN_SECONDS", "1800"))
+
+# Histogram bergulir untuk persentil: tambah/buang O(1), query O(jumlah bin).
+_BIN_WIDTH = float(os.environ.get("IOT_ANOMALY_BIN_WIDTH", "2"))
+_BINS = 512
+
+FLAGS = ("spike", "sustained_spike", "rate_of_change", "stuck", "silent")
+# Flag yang bisa berkedip tiap bacaan (data berisik) tidak di-log sebagai warning.
+_QUIET_FLAGS = {"spike", "rate_of_change"}
+
+
+def _bin(value: float) -> int:
+    return min(_BINS - 1, max(0, int(value / _BIN_WIDTH)))
+
+
+@dataclass
+class _DeviceStats:
+    count: int = 0
+    ewma: Optional[float] = None
+    ewvar: float = 0.0
+    last_value: Optional[float] = None
+    last_ts: Optional[datetime] = None
+    rate_per_min: Optional[float] = None
+    window: Deque[int] = field(default_factory=deque)
+    hist: List[int] = field(default_factory=lambda: [0] * _BINS)
+    spike_since: Optional[datetime] = None
+    same_count: int = 0
+    flags: Dict[str, str] = field(default_factory=dict)
+
+    def percentile(self, q: float) -> Optional[float]:
+        n = len(self.window)
+        if not n:
+            return None
+        target = max(1, math.ceil(q * n))
+        seen = 0
+        for i, c in enumerate(self.hist):
+            seen += c
+            if seen >= target:
+                return (i + 0.5) * _BIN_WIDTH
+        return None
+
+
+class AirAnomalyEngine:
+    """
+    Deteksi anomali PM2.5 per device secara streaming, O(1) per bacaan:
+    EWMA (mean + varian), persentil jendela bergulir (histogram), laju perubahan,
+    lonjakan yang bertahan, sensor macet (nilai sama berulang), dan sensor diam.
+    State hanya di memori worker yang menerima bacaan; tidak ada scan riwayat.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._devices: Dict[str, _DeviceStats] = {}
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=200)
+        self._last_escalation: Optional[float] = None
+        self._listeners: List[Any] = []
+
+    def add_listener(self, fn) -> None:
+        """fn(events) dipanggil setelah ada flag yang berubah (di luar lock)."""
+        self._listeners.append(fn)
+
+    # -- flag --------------------------------------------------------------
+    def _set_flag(self, device_id: str, st: _DeviceStats, flag: str, active: bool,
+                  ts: datetime, detail: Optional[str], out: List[Dict[str, Any]]) -> None:
+        if active == (flag in st.flags):
+            return
+        if active:
+            st.flags[flag] = ts.isoformat()
+        else:
+            st.flags.pop(flag, None)
+        event = {"device_id": device_id, "flag": flag, "active": active, "ts": ts.isoformat(), "detail": detail}
+        self.events.append(event)
+        out.append(event)
+
+    # -- bacaan ------------------------------------------------------------
+    def _observe(self, device_id: str, ts: datetime, value: float, out: List[Dict[str, Any]]) -> None:
+        st = self._devices.get(device_id)
+        if st is None:
+            st = self._devices[device_id] = _DeviceStats()
+        if st.last_ts is not None and ts < st.last_ts:
+            return  # bacaan susulan yang lebih tua tidak mengubah state streaming
+        self._set_flag(device_id, st, "silent", False, ts, None, out)
+
+        # Laju perubahan (ug/m3 per menit) terhadap bacaan sebelumnya.
+        if st.last_value is not None and st.last_ts is not None:
+            dt_min = (ts - st.last_ts).total_seconds() / 60
+            st.rate_per_min = (value - st.last_value) / dt_min if dt_min > 0 else None
+            jump = st.rate_per_min is not None and abs(st.rate_per_min) >= ROC_PER_MIN
+            detail = f"{st.rate_per_min:+.1f} ug/m3/menit" if jump else None
+            self._set_flag(device_id, st, "rate_of_change", jump, ts, detail, out)
+
+            st.same_count = st.same_count + 1 if value == st.last_value else 1
+            self._set_flag(device_id, st, "stuck", st.same_count >= STUCK_COUNT, ts,
+                           f"nilai {value} berulang {st.same_count}x", out)
+        else:
+            st.same_count = 1
+
+        # Lonjakan terhadap baseline EWMA (baseline dibekukan selama lonjakan).
+        spike = value >= AUTO_EMERGENCY_PM25
+        if not spike and st.count >= MIN_SAMPLES and st.ewma is not None:
+            sigma = math.sqrt(st.ewvar)
+            threshold = max(st.ewma * SPIKE_FACTOR, st.ewma + SPIKE_SIGMA * sigma, SPIKE_MIN_PM25)
+            # Persentil hanya dihitung untuk kandidat lonjakan.
+            if value > threshold:
+                p95 = st.percentile(0.95)
+                spike = p95 is None or value > p95
+        if spike:
+            if st.spike_since is None:
+                st.spike_since = ts
+            sustained = (ts - st.spike_since).total_seconds() >= SUSTAIN_SECONDS
+        else:
+            st.spike_since = None
+            sustained = False
+        self._set_flag(device_id, st, "spike", spike, ts, f"PM2.5 {value}" if spike else None, out)
+        self._set_flag(device_id, st, "sustained_spike", sustained, ts,
+                       f"PM2.5 {value} sejak {st.spike_since.isoformat()}" if sustained else None, out)
+
+        if not spike:
+            if st.ewma is None:
+                st.ewma = value
+            else:
+                diff = value - st.ewma
+                incr = EWMA_ALPHA * diff
+                st.ewma += incr
+                st.ewvar = (1 - EWMA_ALPHA) * (st.ewvar + diff * incr)
+
+        b = _bin(value)
+        st.window.append(b)
+        st.hist[b] += 1
+        if len(st.window) > WINDOW_SIZE:
+            st.hist[st.window.popleft()] -= 1
+
+        st.count += 1
+        st.last_value = value
+        st.last_ts = ts
+
+    def observe_many(self, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """rows: dict device_id/ts/pm25 (lihat air_history.normalize_reading)."""
+        events: List[Dict[str, Any]] = []
+        with self._lock:
+            for row in sorted(rows, key=lambda r: r["ts"]):
+                self._observe(row["device_id"], row["ts"], row["pm25"], events)
+        if events:
+            self._after_events(events)
+        return events
+
+    def check_silent(self, states: Iterable[Dict[str, Any]], now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Tandai device yang tidak mengirim bacaan lebih dari IOT_DEVICE_SILENT_SECONDS."""
+        now = now or datetime.now(timezone.utc)
+        events: List[Dict[str, Any]] = []
+        with self._lock:
+            for state in states:
+                try:
+                    last = datetime.fromisoformat(state["updated_at"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                silent_for = (now - last).total_seconds()
+                st = self._devices.get(state["device_id"])
+                if st is None:
+                    st = self._devices[state["device_id"]] = _DeviceStats(last_ts=last)
+                self._set_flag(state["device_id"], st, "silent", silent_for >= SILENT_SECONDS, now,
+                               f"tidak ada data {int(silent_for)} detik", events)
+        if events:
+            self._after_events(events)
+        return events
+
+    # -- eskalasi ----------------------------------------------------------
+    def _after_events(self, events: List[Dict[str, Any]]) -> None:
+        for event in events:
+            if event["active"] and event["flag"] not in _QUIET_FLAGS:
+                logger.warning("Air anomaly %s device=%s %s", event["flag"], event["device_id"], event["detail"] or "")
+        for fn in self._listeners:
+            try:
+                fn(events)
+            except Exception:
+                logger.exception("Air anomaly listener failed.")
+        if IOT_AUTO_EMERGENCY and any(e["flag"] == "sustained_spike" and e["active"] for e in events):
+            self._maybe_escalate()
+
+    def _maybe_escalate(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._last_escalation is not None and now - self._last_escalation < AUTO_EMERGENCY_COOLDOWN_SECONDS:
+                return
+            hot = sorted(
+                ((st.last_value, device_id) for device_id, st in self._devices.items()
+                 if "sustained_spike" in st.flags and (st.last_value or 0) >= AUTO_EMERGENCY_PM25),
+                reverse=True,
+            )
+            if len(hot) < AUTO_EMERGENCY_MIN_DEVICES:
+                return
+            self._last_escalation = now
+
+        worst_value, worst_device = hot[0]
+        message = (
+            f"Kualitas udara berbahaya: PM2.5 {worst_value:g} ug/m3 di sensor {worst_device}"
+            f" ({len(hot)} sensor) bertahan lebih dari {int(SUSTAIN_SECONDS // 60)} menit. Gunakan masker dan kurangi aktivitas luar."
+        )
+        try:
+            from .emergency_api import activate_emergency
+
+            _, changed = activate_emergency("ABU VULKANIK", message, title="PERINGATAN KUALITAS UDARA", only_if_inactive=True)
+            logger.warning("Air auto-emergency %s: %s", "triggered" if changed else "skipped (already active)", message)
+        except Exception:
+            logger.exception("Air auto-emergency failed.")
+
+    # -- baca --------------------------------------------------------------
+    def snapshot(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            items = self._devices.items() if device_id is None else [
+                (device_id, self._devices[device_id])
+            ] if device_id in self._devices else []
+            devices = {
+                did: {
+                    "flags": dict(st.flags),
+                    "last_value": st.last_value,
+                    "last_ts": st.last_ts.isoformat() if st.last_ts else None,
+                    "ewma": round(st.ewma, 3) if st.ewma is not None else None,
+                    "stddev": round(math.sqrt(st.ewvar), 3),
+                    "p50": st.percentile(0.5),
+                    "p95": st.percentile(0.95),
+                    "rate_per_min": round(st.rate_per_min, 3) if st.rate_per_min is not None else None,
+                    "samples": st.count,
+                }
+                for did, st in items
+            }
+            events = [e for e in self.events if device_id is None or e["device_id"] == device_id]
+        return {"auto_emergency": IOT_AUTO_EMERGENCY, "devices": devices, "events": events[-50:]}
+
+
+anomaly_engine = AirAnomalyEngine()
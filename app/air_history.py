@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, delete, insert, select
+
+from .db import dialect_insert, engine
+from .models import AirReading, AirRollup, as_utc
+
+logger = logging.getLogger("sinabung.iot")
+
+METRICS = ("pm25", "pm10", "pm1")
+DEFAULT_DEVICE_ID = "unknown"
+
+# Resolusi rollup yang dijaga saat ingest (detik per bucket), dari yang paling halus.
+RESOLUTIONS: Dict[str, int] = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# Retensi dalam hari; 0 = simpan selamanya. Rollup dihitung saat ingest, jadi
+# menghapus titik mentah tidak mengubah hasil query di resolusi >= 1 menit.
+RAW_RETENTION_DAYS = float(os.environ.get("IOT_RAW_RETENTION_DAYS", "7"))
+ROLLUP_RETENTION_DAYS: Dict[str, float] = {
+    "1m": float(os.environ.get("IOT_ROLLUP_1M_RETENTION_DAYS", "30")),
+    "1h": float(os.environ.get("IOT_ROLLUP_1H_RETENTION_DAYS", "400")),
+    "1d": float(os.environ.get("IOT_ROLLUP_1D_RETENTION_DAYS", "0")),
+}
+HISTORY_MAX_POINTS = int(os.environ.get("IOT_HISTORY_MAX_POINTS", "1000"))
+# Target jumlah titik kalau step tidak diminta.
+HISTORY_DEFAULT_POINTS = int(os.environ.get("IOT_HISTORY_DEFAULT_POINTS", "300"))
+
+# Step "rapi" untuk pilihan otomatis saat step tidak diminta / terlalu halus.
+_NICE_STEPS = (10, 30, 60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 7 * 86400)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat()
+
+
+def bucket_start(ts: datetime, seconds: int) -> datetime:
+    offset = int((ts - _EPOCH).total_seconds()) // seconds * seconds
+    return _EPOCH + timedelta(seconds=offset)
+
+
+def parse_step(value: Optional[str]) -> Optional[int]:
+    """'90', '30s', '5m', '1h', '1d' -> detik. None/'' -> None (pilih otomatis)."""
+    if value is None or not str(value).strip():
+        return None
+    text = str(value).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    factor = 1
+    if text[-1] in units:
+        factor = units[text[-1]]
+        text = text[:-1]
+    try:
+        seconds = int(float(text) * factor)
+    except ValueError:
+        raise ValueError(f"step tidak valid: {value!r}")
+    if seconds <= 0:
+        raise ValueError(f"step harus > 0: {value!r}")
+    return seconds
+
+
+def normalize_reading(item: Dict[str, Any]) -> Dict[str, Any]:
+    ts = item.get("ts") or datetime.now(timezone.utc)
+    return {
+        "device_id": item.get("device_id") or DEFAULT_DEVICE_ID,
+        "ts": as_utc(ts),
+        "pm25": float(item["pm25"]),
+        "pm10": float(item["pm10"]) if item.get("pm10") is not None else None,
+        "pm1": float(item["pm1"]) if item.get("pm1") is not None else None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Agregat (n/min/max/sum per metrik) — dipakai untuk ingest dan query
+# ---------------------------------------------------------------------------
+def _empty_agg() -> Dict[str, Any]:
+    agg: Dict[str, Any] = {}
+    for m in METRICS:
+        agg[f"{m}_n"] = 0
+        agg[f"{m}_min"] = None
+        agg[f"{m}_max"] = None
+        agg[f"{m}_sum"] = 0.0
+    return agg
+
+
+def _add_value(agg: Dict[str, Any], metric: str, value: Optional[float]) -> None:
+    if value is None:
+        return
+    agg[f"{metric}_n"] += 1
+    agg[f"{metric}_sum"] += value
+    lo, hi = agg[f"{metric}_min"], agg[f"{metric}_max"]
+    agg[f"{metric}_min"] = value if lo is None or value < lo else lo
+    agg[f"{metric}_max"] = value if hi is None or value > hi else hi
+
+
+def _merge_agg(agg: Dict[str, Any], other: Dict[str, Any]) -> None:
+    for m in METRICS:
+        n = other.get(f"{m}_n") or 0
+        if not n:
+            continue
+        agg[f"{m}_n"] += n
+        agg[f"{m}_sum"] += other[f"{m}_sum"] or 0.0
+        lo, hi = other[f"{m}_min"], other[f"{m}_max"]
+        if lo is not None and (agg[f"{m}_min"] is None or lo < agg[f"{m}_min"]):
+            agg[f"{m}_min"] = lo
+        if hi is not None and (agg[f"{m}_max"] is None or hi > agg[f"{m}_max"]):
+            agg[f"{m}_max"] = hi
+
+
+def aggregate_rollups(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Kelompokkan titik mentah ke baris rollup (device, resolution, bucket), satu baris per kunci."""
+    groups: Dict[Tuple[str, str, datetime], Dict[str, Any]] = {}
+    for row in rows:
+        for res, seconds in RESOLUTIONS.items():
+            key = (row["device_id"], res, bucket_start(row["ts"], seconds))
+            agg = groups.get(key)
+            if agg is None:
+                agg = groups[key] = _empty_agg()
+            for m in METRICS:
+                _add_value(agg, m, row[m])
+    return [
+        {"device_id": device_id, "resolution": res, "bucket": bucket, **agg}
+        for (device_id, res, bucket), agg in groups.items()
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Tulis
+# ---------------------------------------------------------------------------
+def _least(col, new):
+    return case((col.is_(None), new), (new.is_(None), col), (new < col, new), else_=col)
+
+
+def _greatest(col, new):
+    return case((col.is_(None), new), (new.is_(None), col), (new > col, new), else_=col)
+
+
+def _upsert_rollups(conn, rollups: Sequence[Dict[str, Any]]) -> None:
+    table = AirRollup.__table__
+    upsert_insert = dialect_insert()
+    if upsert_insert is None:
+        _upsert_rollups_generic(conn, rollups)
+        return
+
+    # Satu statement ter-cache dijalankan executemany; rollup sudah satu baris per kunci.
+    stmt = upsert_insert(table)
+    ex = stmt.excluded
+    set_: Dict[str, Any] = {}
+    for m in METRICS:
+        set_[f"{m}_n"] = table.c[f"{m}_n"] + ex[f"{m}_n"]
+        set_[f"{m}_sum"] = table.c[f"{m}_sum"] + ex[f"{m}_sum"]
+        set_[f"{m}_min"] = _least(table.c[f"{m}_min"], ex[f"{m}_min"])
+        set_[f"{m}_max"] = _greatest(table.c[f"{m}_max"], ex[f"{m}_max"])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.device_id, table.c.resolution, table.c.bucket],
+        set_=set_,
+    )
+    conn.execute(stmt, list(rollups))
+
+
+def _upsert_rollups_generic(conn, rollups: Sequence[Dict[str, Any]]) -> None:
+    table = AirRollup.__table__
+    for row in rollups:
+        where = (
+            (table.c.device_id == row["device_id"])
+            & (table.c.resolution == row["resolution"])
+            & (table.c.bucket == row["bucket"])
+        )
+        current = conn.execute(select(table).where(where)).mappings().first()
+        if current is None:
+            conn.execute(insert(table).values(**row))
+            continue
+        merged = {k: current[k] for k in _empty_agg()}
+        _merge_agg(merged, row)
+        conn.execute(table.update().where(where).values(**merged))
+
+
+def record_readings(readings: Sequence[Dict[str, Any]]) -> int:
+    """
+    Simpan titik mentah (satu INSERT multi-row) dan perbarui rollup 1m/1h/1d
+    secara inkremental dalam transaksi yang sama.
+    `readings` sudah dinormalisasi lewat normalize_reading().
+    """
+    if not readings:
+        return 0
+    rollups = aggregate_rollups(readings)
+    with engine.begin() as conn:
+        conn.execute(insert(AirReading.__table__), list(readings))
+        _upsert_rollups(conn, rollups)
+    return len(readings)
+
+
+# ---------------------------------------------------------------------------
+# Query
+# ---------------------------------------------------------------------------
+def _auto_step(span_seconds: float, requested: Optional[int], max_points: int) -> int:
+    minimum = span_seconds / max(1, max_points)
+    if requested is not None and requested >= minimum:
+        return requested
+    floor = max(minimum, requested or 0)
+    for step in _NICE_STEPS:
+        if step >= floor:
+            return step
+    return _NICE_STEPS[-1] * int(floor // _NICE_STEPS[-1] + 1)
+
+
+def _retained_since(days: float, now: datetime) -> Optional[datetime]:
+    if days <= 0:
+        return None
+    return now - timedelta(days=days)
+
+
+def _pick_source(step: int, start: datetime, now: datetime) -> str:
+    """Rollup paling kasar yang masih membagi step dan datanya belum dibuang retensi."""
+    for res in ("1d", "1h", "1m"):
+        seconds = RESOLUTIONS[res]
+        if step >= seconds and step % seconds == 0:
+            return res
+    cutoff = _retained_since(RAW_RETENTION_DAYS, now)
+    if cutoff is not None and start < cutoff:
+        return "1m"
+    return "raw"
+
+
+def _point(bucket: datetime, agg: Dict[str, Any]) -> Dict[str, Any]:
+    point: Dict[str, Any] = {"ts": _iso(bucket), "count": agg["pm25_n"]}
+    for m in METRICS:
+        n = agg[f"{m}_n"]
+        point[m] = None if not n else {
+            "min": agg[f"{m}_min"],
+            "max": agg[f"{m}_max"],
+            "mean": round(agg[f"{m}_sum"] / n, 3),
+            "count": n,
+        }
+    return point
+
+
+def query_history(
+    device_id: Optional[str],
+    start: datetime,
+    end: datetime,
+    step_seconds: Optional[int] = None,
+    max_points: int = HISTORY_MAX_POINTS,
+) -> Dict[str, Any]:
+    """
+    Riwayat PM per bucket `step` antara [start, end). Dijawab dari rollup paling
+    kasar yang cocok (1d/1h/1m), titik mentah hanya untuk step < 1 menit.
+    Tanpa device_id: gabungan semua device.
+    """
+    now = _utcnow()
+    start, end = as_utc(start), as_utc(end)
+    if end <= start:
+        raise ValueError("end harus setelah start")
+
+    span = (end - start).total_seconds()
+    if step_seconds is None:
+        step = _auto_step(span, None, min(max_points, HISTORY_DEFAULT_POINTS))
+    else:
+        step = _auto_step(span, step_seconds, max_points)
+    source = _pick_source(step, start, now)
+    if source == "1m" and step % 60:
+        step = max(60, (step // 60 + 1) * 60)
+
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    with engine.connect() as conn:
+        if source == "raw":
+            t = AirReading.__table__
+            stmt = select(t.c.ts, t.c.pm25, t.c.pm10, t.c.pm1).where(t.c.ts >= start, t.c.ts < end)
+            if device_id:
+                stmt = stmt.where(t.c.device_id == device_id)
+            for row in conn.execute(stmt.order_by(t.c.ts)):
+                key = bucket_start(row.ts, step)
+                agg = buckets.get(key)
+                if agg is None:
+                    agg = buckets[key] = _empty_agg()
+                for m in METRICS:
+                    _add_value(agg, m, getattr(row, m))
+        else:
+            t = AirRollup.__table__
+            # Bucket rollup pertama bisa mulai sebelum `start`; ambil mulai batas bucket-nya.
+            stmt = select(t).where(
+                t.c.resolution == source,
+                t.c.bucket >= bucket_start(start, RESOLUTIONS[source]),
+                t.c.bucket < end,
+            )
+            if device_id:
+                stmt = stmt.where(t.c.device_id == device_id)
+            for row in conn.execute(stmt.order_by(t.c.bucket)).mappings():
+                key = bucket_start(row["bucket"], step)
+                agg = buckets.get(key)
+                if agg is None:
+                    agg = buckets[key] = _empty_agg()
+                _merge_agg(agg, row)
+
+    return {
+        "device_id": device_id,
+        "start": _iso(start),
+        "end": _iso(end),
+        "step_seconds": step,
+        "source": source,
+        "points": [_point(bucket, buckets[bucket]) for bucket in sorted(buckets)],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Retensi
+# ---------------------------------------------------------------------------
+def compact(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Buang titik mentah dan rollup halus yang melewati masa retensi.
+    Rollup yang lebih kasar sudah berisi ringkasannya sejak ingest.
+    """
+    now = as_utc(now) if now else _utcnow()
+    removed: Dict[str, int] = {}
+    with engine.begin() as conn:
+        cutoff = _retained_since(RAW_RETENTION_DAYS, now)
+        if cutoff is not None:
+            t = AirReading.__table__
+            removed["raw"] = conn.execute(delete(t).where(t.c.ts < cutoff)).rowcount or 0
+        for res, days in ROLLUP_RETENTION_DAYS.items():
+            cutoff = _retained_since(days, now)
+            if cutoff is None:
+                continue
+            t = AirRollup.__table__
+            removed[res] = conn.execute(
+                delete(t).where(t.c.resolution == res, t.c.bucket < cutoff)
+            ).rowcount or 0
+    if any(removed.values()):
+        logger.info("Air history compacted: %s", removed)
+    return removed
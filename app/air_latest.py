@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, or_, select
+from sqlmodel import Session
+
+from .db import dialect_insert, engine, fetch_all
+from .models import AirDevice, as_utc
+
+logger = logging.getLogger("sinabung.iot")
+
+IOT_LATEST_POLL_SECONDS = float(os.environ.get("IOT_LATEST_POLL_SECONDS", "2"))
+NO_ZONE = "tanpa-zona"
+_META_FIELDS = ("nama", "zona", "lat", "lng", "keterangan")
+_POLL_OVERLAP = timedelta(seconds=5)
+
+
+def _row_state(row: Any) -> Dict[str, Any]:
+    last_ts = as_utc(row.last_ts)
+    return {
+        "device_id": row.device_id,
+        "nama": row.nama,
+        "zona": row.zona,
+        "lat": row.lat,
+        "lng": row.lng,
+        "keterangan": row.keterangan,
+        "pm25": row.last_pm25,
+        "pm10": row.last_pm10,
+        "pm1": row.last_pm1,
+        "status": row.last_status or "unknown",
+        "label": row.last_label or "tidak diketahui",
+        "updated_at": last_ts.isoformat() if last_ts else None,
+        "is_mock": False,
+        "source": "sensor",
+    }
+
+
+def _ts(state: Dict[str, Any]) -> Optional[datetime]:
+    value = state.get("updated_at")
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _median(ranked: List[Tuple[float, str]]) -> Optional[float]:
+    n = len(ranked)
+    if not n:
+        return None
+    mid = n // 2
+    if n % 2:
+        return ranked[mid][0]
+    return round((ranked[mid - 1][0] + ranked[mid][0]) / 2, 3)
+
+
+class AirLatestIndex:
+    """
+    Bacaan terakhir per device + ringkasan agregat (terburuk, median, per zona).
+    - Ingest memperbarui index secara inkremental (list terurut per pm25, bisect),
+      ringkasan dihitung ulang dari list itu, bukan dari scan riwayat.
+    - Persisten di tabel AirDevice (satu baris per device).
+    - Worker lain menyusul lewat polling kolom changed_at, paling sering tiap
+      IOT_LATEST_POLL_SECONDS.
+    """
+
+    def __init__(self, poll_seconds: float) -> None:
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._ranked: List[Tuple[float, str]] = []
+        self._zones: Dict[str, List[Tuple[float, str]]] = {}
+        self._summary: Dict[str, Any] = self._build_summary()
+        self._loaded = False
+        self._last_poll = 0.0
+        self._poll_since: Optional[datetime] = None
+        # Naik setiap kali isi index berubah.
+        self.version = 0
+
+    # -- index -------------------------------------------------------------
+    def _unrank(self, state: Dict[str, Any]) -> None:
+        if state.get("pm25") is None:
+            return
+        key = (state["pm25"], state["device_id"])
+        for ranked in (self._ranked, self._zones.get(state.get("zona") or NO_ZONE)):
+            if ranked is None:
+                continue
+            i = bisect.bisect_left(ranked, key)
+            if i < len(ranked) and ranked[i] == key:
+                del ranked[i]
+        zone = state.get("zona") or NO_ZONE
+        if zone in self._zones and not self._zones[zone]:
+            del self._zones[zone]
+
+    def _rank(self, state: Dict[str, Any]) -> None:
+        if state.get("pm25") is None:
+            return
+        key = (state["pm25"], state["device_id"])
+        bisect.insort(self._ranked, key)
+        bisect.insort(self._zones.setdefault(state.get("zona") or NO_ZONE, []), key)
+
+    def _put_locked(self, state: Dict[str, Any], meta_only: bool = False) -> bool:
+        device_id = state["device_id"]
+        current = self._states.get(device_id)
+        if current is not None:
+            incoming_ts, current_ts = _ts(state), _ts(current)
+            newer = incoming_ts is not None and (current_ts is None or incoming_ts >= current_ts)
+            merged = dict(current)
+            for field in _META_FIELDS:
+                if field in state:
+                    merged[field] = state[field]
+            if newer and not meta_only:
+                merged.update({k: v for k, v in state.items() if k not in _META_FIELDS})
+            if merged == current:
+                return False
+            self._unrank(current)
+        else:
+            merged = {**dict.fromkeys(_META_FIELDS), **state}
+        self._states[device_id] = merged
+        self._rank(merged)
+        return True
+
+    def _worst(self, ranked: List[Tuple[float, str]]) -> Optional[Dict[str, Any]]:
+        if not ranked:
+            return None
+        state = self._states[ranked[-1][1]]
+        return {k: state.get(k) for k in ("device_id", "nama", "zona", "pm25", "status", "label", "updated_at")}
+
+    def _build_summary(self) -> Dict[str, Any]:
+        zones = {}
+        for zone, ranked in sorted(self._zones.items()):
+            worst = self._worst(ranked)
+            zones[zone] = {
+                "devices": len(ranked),
+                "median_pm25": _median(ranked),
+                "worst": worst,
+                "status": worst["status"] if worst else "unknown",
+            }
+        worst = self._worst(self._ranked)
+        return {
+            "devices": len(self._ranked),
+            "median_pm25": _median(self._ranked),
+            "worst": worst,
+            "status": worst["status"] if worst else "unknown",
+            "zones": zones,
+        }
+
+    def apply(self, states: Sequence[Dict[str, Any]], meta_only: bool = False) -> None:
+        with self._lock:
+            changed = False
+            for state in states:
+                changed = self._put_locked(state, meta_only=meta_only) or changed
+            if changed:
+                self._summary = self._build_summary()
+                self.version += 1
+
+    # -- baca --------------------------------------------------------------
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._summary
+
+    def worst_state(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if not self._ranked:
+                return None
+            return dict(self._states[self._ranked[-1][1]])
+
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._states.get(device_id)
+            return dict(state) if state is not None else None
+
+    def list(self, zona: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            states = [dict(s) for s in self._states.values()]
+        if zona:
+            states = [s for s in states if (s.get("zona") or NO_ZONE) == zona]
+        return sorted(states, key=lambda s: s["device_id"])
+
+    # -- sinkron DB --------------------------------------------------------
+    def _sync_query(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded and (self.poll_seconds <= 0 or now - self._last_poll < self.poll_seconds):
+                return None
+            self._last_poll = now
+            since = self._poll_since if self._loaded else None
+
+        table = AirDevice.__table__
+        query = select(table)
+        if since is not None:
+            query = query.where(table.c.changed_at > since - _POLL_OVERLAP)
+        return query
+
+    def sync(self) -> None:
+        """Muat semua device saat pertama dipakai, lalu ambil yang berubah di worker lain."""
+        query = self._sync_query()
+        if query is None:
+            return
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(query).all()
+        except Exception as e:
+            logger.warning("Air latest sync failed: %s: %s", type(e).__name__, e)
+            return
+        self._apply_rows(rows)
+
+    async def sync_async(self) -> None:
+        query = self._sync_query()
+        if query is None:
+            return
+        try:
+            rows = await fetch_all(query)
+        except Exception as e:
+            logger.warning("Air latest sync failed: %s: %s", type(e).__name__, e)
+            return
+        self._apply_rows(rows)
+
+    def _apply_rows(self, rows: Any) -> None:
+        with self._lock:
+            changed = False
+            for row in rows:
+                changed = self._put_locked(_row_state(row)) or changed
+                changed_at = as_utc(row.changed_at)
+                if changed_at is not None and (self._poll_since is None or changed_at > self._poll_since):
+                    self._poll_since = changed_at
+            if self._poll_since is None:
+                self._poll_since = datetime.now(timezone.utc)
+            self._loaded = True
+            if changed:
+                self._summary = self._build_summary()
+                self.version += 1
+
+
+latest_index = AirLatestIndex(IOT_LATEST_POLL_SECONDS)
+
+
+def record_latest(states: Sequence[Dict[str, Any]]) -> None:
+    """
+    Simpan bacaan terakhir beberapa device (satu state per device) lalu
+    perbarui index in-memory. Bacaan yang lebih tua dari yang tersimpan diabaikan.
+    """
+    if not states:
+        return
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "device_id": s["device_id"],
+            "created_at": now,
+            "updated_at": now,
+            "changed_at": now,
+            "last_ts": datetime.fromisoformat(s["updated_at"]),
+            "last_pm25": s.get("pm25"),
+            "last_pm10": s.get("pm10"),
+            "last_pm1": s.get("pm1"),
+            "last_status": s.get("status"),
+            "last_label": s.get("label"),
+        }
+        for s in states
+    ]
+    table = AirDevice.__table__
+    upsert_insert = dialect_insert()
+    with engine.begin() as conn:
+        if upsert_insert is None:
+            for row in rows:
+                current = conn.execute(select(table.c.last_ts).where(table.c.device_id == row["device_id"])).first()
+                if current is None:
+                    conn.execute(insert(table).values(**row))
+                elif current.last_ts is None or row["last_ts"] >= as_utc(current.last_ts):
+                    values = {k: v for k, v in row.items() if k.startswith("last_") or k == "changed_at"}
+                    conn.execute(table.update().where(table.c.device_id == row["device_id"]).values(**values))
+        else:
+            stmt = upsert_insert(table)
+            ex = stmt.excluded
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.device_id],
+                set_={
+                    "last_ts": ex.last_ts,
+                    "last_pm25": ex.last_pm25,
+                    "last_pm10": ex.last_pm10,
+                    "last_pm1": ex.last_pm1,
+                    "last_status": ex.last_status,
+                    "last_label": ex.last_label,
+                    "changed_at": ex.changed_at,
+                },
+                where=or_(table.c.last_ts.is_(None), ex.last_ts >= table.c.last_ts),
+            )
+            conn.execute(stmt, rows)
+
+    # Pastikan index sudah termuat sebelum menimpa, supaya data device lain ikut terlihat.
+    latest_index.sync()
+    latest_index.apply([{k: v for k, v in s.items() if k not in _META_FIELDS} for s in states])
+
+
+def update_device(device_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Buat/ubah data registry (nama, zona, lokasi) sebuah device."""
+    now = datetime.now(timezone.utc)
+    with Session(engine) as session:
+        item = session.get(AirDevice, device_id)
+        if item is None:
+            item = AirDevice(device_id=device_id)
+        for key, value in data.items():
+            setattr(item, key, value)
+        item.updated_at = now
+        item.changed_at = now
+        session.add(item)
+        session.commit()
+        session.refresh(item)
+        state = _row_state(item)
+
+    latest_index.sync()
+    latest_index.apply([state], meta_only=True)
+    return latest_index.get(device_id) or state
@@ -1,13 +1,26 @@
 from __future__ import annotations
-import httpx
+
+import os
+
+from .http_client import get_http_client
+from .singleflight import SingleFlight
 
 BMKG_AUTOGEMPA_URL = "https://data.bmkg.go.id/DataMKG/TEWS/autogempa.json"
+BMKG_CACHE_TTL = float(os.environ.get("BMKG_CACHE_TTL_SECONDS", "30"))
+UPSTREAM_NEGATIVE_TTL = float(os.environ.get("UPSTREAM_NEGATIVE_TTL_SECONDS", "10"))
+
+flights = SingleFlight(negative_ttl=UPSTREAM_NEGATIVE_TTL)
+
 
 async def fetch_latest_quake(url: str = BMKG_AUTOGEMPA_URL) -> dict:
-    async with httpx.AsyncClient(timeout=20) as client:
-        r = await client.get(url, headers={"User-Agent": "sinabung-alert-mvp/1.0"})
-        r.raise_for_status()
-        data = r.json()
+    quake = await flights.do(("bmkg:autogempa", url), lambda: _fetch_latest_quake(url), ttl=BMKG_CACHE_TTL)
+    return dict(quake)
+
+
+async def _fetch_latest_quake(url: str) -> dict:
+    r = await get_http_client("bmkg").get(url)
+    r.raise_for_status()
+    data = r.json()
 
     g = data.get("Infogempa", {}).get("gempa", {}) or {}
     return {
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Set
+
+from sqlalchemy import text
+
+from .db import engine
+
+logger = logging.getLogger("sinabung.broadcast")
+
+BROADCAST_BACKEND = os.environ.get("BROADCAST_BACKEND", "auto").strip().lower() or "auto"
+BROADCAST_CHANNEL = os.environ.get("BROADCAST_PG_CHANNEL", "sinawise_events").strip() or "sinawise_events"
+BROADCAST_QUEUE_SIZE = int(os.environ.get("BROADCAST_QUEUE_SIZE", "32"))
+BROADCAST_MAX_SUBSCRIBERS = int(os.environ.get("BROADCAST_MAX_SUBSCRIBERS", "2000"))
+BROADCAST_HEARTBEAT_SECONDS = float(os.environ.get("BROADCAST_HEARTBEAT_SECONDS", "15"))
+# Subscriber yang terus tertinggal (antrian penuh berulang) diputus supaya tidak menahan memori.
+BROADCAST_MAX_DROPS = int(os.environ.get("BROADCAST_MAX_DROPS", "256"))
+
+# Batas payload NOTIFY Postgres 8000 byte.
+_PG_NOTIFY_LIMIT = 7900
+
+
+def _encode(event: Dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class Subscriber:
+    """Satu koneksi SSE/WebSocket dengan antrian terbatas (backpressure)."""
+
+    def __init__(self, topics: Optional[Set[str]], maxsize: int) -> None:
+        self.topics = topics
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def wants(self, topic: str) -> bool:
+        return not self.topics or topic in self.topics
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        # Klien lambat: buang event tertua, event status terbaru lebih penting.
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.dropped += 1
+            if self.dropped >= BROADCAST_MAX_DROPS:
+                self.closed = True
+        self.queue.put_nowait(event)
+
+
+class BroadcastHub:
+    """
+    Fan-out event (darurat, level MAGMA, status udara) ke klien SSE/WebSocket.
+    - publish() aman dipanggil dari thread mana pun (handler sync, job scheduler).
+    - Backend 'postgres': event dikirim lewat NOTIFY dan setiap worker uvicorn
+      menerimanya lewat LISTEN, jadi semua klien di semua worker kebagian.
+    - Backend 'local' (SQLite / fallback): hanya klien di proses ini.
+    Event terakhir per topik disimpan untuk dikirim ke klien yang baru tersambung.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: Set[Subscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._ids = itertools.count(1)
+        self.last: Dict[str, Dict[str, Any]] = {}
+        self.snapshot_loaders: Dict[str, Callable[[], Any]] = {}
+        self.backend = "local"
+        self.stats = {"published": 0, "delivered": 0, "dropped": 0, "notify_errors": 0}
+
+    # -- siklus hidup ------------------------------------------------------
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        wanted = BROADCAST_BACKEND
+        if wanted == "auto":
+            wanted = "postgres" if engine.dialect.name == "postgresql" else "local"
+        if wanted == "postgres" and engine.dialect.name == "postgresql":
+            self.backend = "postgres"
+            self._listener = asyncio.create_task(self._listen_forever())
+        else:
+            self.backend = "local"
+        logger.info("Broadcast hub started (backend=%s).", self.backend)
+
+    async def aclose(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+        for sub in list(self._subscribers):
+            sub.closed = True
+        self._loop = None
+
+    # -- subscriber --------------------------------------------------------
+    def subscribe(self, topics: Optional[Set[str]] = None) -> Optional[Subscriber]:
+        if len(self._subscribers) >= BROADCAST_MAX_SUBSCRIBERS:
+            return None
+        sub = Subscriber(topics, BROADCAST_QUEUE_SIZE)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+        self.stats["dropped"] += sub.dropped
+
+    def snapshot(self, topics: Optional[Set[str]] = None) -> list[Dict[str, Any]]:
+        """Event terakhir per topik; topik yang belum pernah di-publish dimuat lewat snapshot_loaders."""
+        events = []
+        for topic in sorted(set(self.last) | set(self.snapshot_loaders)):
+            if topics and topic not in topics:
+                continue
+            event = self.last.get(topic)
+            if event is None:
+                try:
+                    event = self._make_event(topic, self.snapshot_loaders[topic]())
+                except Exception as e:
+                    logger.warning("Broadcast snapshot %s failed: %s: %s", topic, type(e).__name__, e)
+                    continue
+            events.append(event)
+        return events
+
+    # -- publish -----------------------------------------------------------
+    def _make_event(self, topic: str, data: Any) -> Dict[str, Any]:
+        return {
+            "id": next(self._ids),
+            "topic": topic,
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "data": data,
+        }
+
+    def publish(self, topic: str, data: Any) -> None:
+        event = self._make_event(topic, data)
+        self.last[topic] = event
+        self.stats["published"] += 1
+        loop = self._loop
+        if loop is None:
+            return
+
+        if self.backend == "postgres":
+            payload = _encode(event)
+            if len(payload.encode("utf-8")) <= _PG_NOTIFY_LIMIT:
+                if self._in_loop_thread():
+                    loop.run_in_executor(None, self._notify_or_local, payload, event)
+                else:
+                    self._notify_or_local(payload, event)
+                return
+            logger.warning("Broadcast event %s too large for NOTIFY; delivering locally only.", topic)
+
+        self._deliver_threadsafe(event)
+
+    def _in_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _notify_or_local(self, payload: str, event: Dict[str, Any]) -> None:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": BROADCAST_CHANNEL, "payload": payload})
+        except Exception as e:
+            # Worker ini tetap dapat event walau NOTIFY gagal.
+            self.stats["notify_errors"] += 1
+            logger.warning("Broadcast NOTIFY failed: %s: %s", type(e).__name__, e)
+            self._deliver_threadsafe(event)
+
+    def _deliver_threadsafe(self, event: Dict[str, Any]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        if self._in_loop_thread():
+            self._deliver(event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event: Dict[str, Any]) -> None:
+        self.last[event["topic"]] = event
+        for sub in list(self._subscribers):
+            if sub.closed or not sub.wants(event["topic"]):
+                continue
+            sub.offer(event)
+            self.stats["delivered"] += 1
+
+    # -- LISTEN (Postgres) -------------------------------------------------
+    async def _listen_forever(self) -> None:
+        import psycopg
+
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+                    await conn.execute(f'LISTEN "{BROADCAST_CHANNEL}"')
+                    logger.info("Broadcast LISTEN %s ready.", BROADCAST_CHANNEL)
+                    async for notify in conn.notifies():
+                        try:
+                            self._deliver(json.loads(notify.payload))
+                        except Exception as e:
+                            logger.warning("Broadcast payload ignored: %s: %s", type(e).__name__, e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Broadcast LISTEN failed, retry in 5s: %s: %s", type(e).__name__, e)
+                await asyncio.sleep(5)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "backend": self.backend, "subscribers": len(self._subscribers)}
+
+
+hub = BroadcastHub()
+
+
+def publish(topic: str, data: Any) -> None:
+    """Publish aman: kegagalan broadcast tidak boleh menggagalkan pemanggil."""
+    try:
+        hub.publish(topic, data)
+    except Exception as e:
+        logger.warning("Broadcast publish %s failed: %s: %s", topic, type(e).__name__, e)
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+from .http_cache import body_etag, cache_headers, dumps, if_none_match, not_modified
+
+try:
+    import brotli
+except Exception:  # pragma: no cover - opsional
+    brotli = None
+
+logger = logging.getLogger("sinabung.bundle")
+
+# Input "volatile" (status udara, posko+okupansi) boleh memicu rebuild paling sering tiap
+# sekian detik; perubahan input lain (darurat, video, dashboard) selalu langsung dibangun ulang.
+BUNDLE_MIN_REBUILD_SECONDS = float(os.environ.get("BUNDLE_MIN_REBUILD_SECONDS", "10"))
+BUNDLE_GZIP_LEVEL = int(os.environ.get("BUNDLE_GZIP_LEVEL", "9"))
+BUNDLE_BROTLI_QUALITY = int(os.environ.get("BUNDLE_BROTLI_QUALITY", "9"))
+
+
+@dataclass
+class BundleInput:
+    name: str
+    version: Callable[[], Hashable]
+    build: Callable[[], Any]
+    volatile: bool = False
+
+
+@dataclass
+class BundleArtifact:
+    versions: Dict[str, Hashable]
+    etag: str
+    built_at: float
+    identity: bytes
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def pick(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encoded:
+                return self.encoded[encoding], encoding
+        return self.identity, None
+
+
+class OfflineBundle:
+    """
+    Satu artefak JSON berisi semua data publik untuk cold start aplikasi.
+    - Tiap input punya fungsi versi murah (versi AppKV, hash snapshot, versi index);
+      artefak dibangun ulang hanya kalau salah satu versi berubah.
+    - Hasilnya disimpan di memori sudah terkompresi (gzip, brotli kalau terpasang),
+      jadi request cukup memilih encoding dan mengirim byte yang sama.
+    """
+
+    def __init__(self, min_rebuild_seconds: float) -> None:
+        self.min_rebuild_seconds = min_rebuild_seconds
+        self._inputs: List[BundleInput] = []
+        self._artifact: Optional[BundleArtifact] = None
+        self._lock = threading.Lock()
+        self.stats = {"builds": 0, "served": 0, "not_modified": 0, "build_errors": 0}
+
+    def register(self, name: str, version: Callable[[], Hashable], build: Callable[[], Any], volatile: bool = False) -> None:
+        self._inputs.append(BundleInput(name, version, build, volatile))
+
+    def _versions(self) -> Dict[str, Hashable]:
+        return {item.name: item.version() for item in self._inputs}
+
+    def _fresh_enough(self, artifact: BundleArtifact, versions: Dict[str, Hashable]) -> bool:
+        changed = [item for item in self._inputs if artifact.versions.get(item.name) != versions[item.name]]
+        if not changed:
+            return True
+        if all(item.volatile for item in changed):
+            return time.monotonic() - artifact.built_at < self.min_rebuild_seconds
+        return False
+
+    def current(self) -> BundleArtifact:
+        versions = self._versions()
+        artifact = self._artifact
+        if artifact is not None and self._fresh_enough(artifact, versions):
+            return artifact
+
+        with self._lock:
+            # Request lain mungkin sudah membangun ulang selagi menunggu lock.
+            artifact = self._artifact
+            if artifact is not None and self._fresh_enough(artifact, versions):
+                return artifact
+            try:
+                artifact = self._build(versions)
+            except Exception as e:
+                self.stats["build_errors"] += 1
+                if self._artifact is None:
+                    raise
+                logger.warning("Offline bundle rebuild failed, serving previous: %s: %s", type(e).__name__, e)
+                return self._artifact
+            self._artifact = artifact
+            return artifact
+
+    def _build(self, versions: Dict[str, Hashable]) -> BundleArtifact:
+        started = time.perf_counter()
+        chunks = [b'{"generated_at":', dumps(datetime.now(timezone.utc).isoformat())]
+        for item in self._inputs:
+            content = item.build()
+            chunks += [b",", dumps(item.name), b":", content if isinstance(content, bytes) else dumps(content)]
+        chunks.append(b"}")
+        identity = b"".join(chunks)
+
+        encoded = {"gzip": gzip.compress(identity, compresslevel=BUNDLE_GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            encoded["br"] = brotli.compress(identity, quality=BUNDLE_BROTLI_QUALITY)
+        # ETag dari isi tanpa generated_at: rebuild yang hasilnya sama tidak memaksa klien unduh ulang.
+        # Weak, karena dipakai untuk identity/gzip/br (representasi beda) dan generated_at yang beda.
+        etag = "W/" + body_etag(identity[identity.index(b",") :])
+        self.stats["builds"] += 1
+        logger.info(
+            "Offline bundle rebuilt: %s bytes (gzip %s) in %.1f ms.",
+            len(identity),
+            len(encoded["gzip"]),
+            (time.perf_counter() - started) * 1000,
+        )
+        return BundleArtifact(versions=versions, etag=etag, built_at=time.monotonic(), identity=identity, encoded=encoded)
+
+    def response(self, request: Request) -> Response:
+        artifact = self.current()
+        if if_none_match(request, artifact.etag):
+            self.stats["not_modified"] += 1
+            resp = not_modified(artifact.etag, "bundle")
+            resp.headers["Vary"] = "Accept-Encoding"
+            return resp
+        body, encoding = artifact.pick(request.headers.get("accept-encoding", ""))
+        headers = {**cache_headers(artifact.etag, "bundle"), "Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        self.stats["served"] += 1
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        artifact = self._artifact
+        return {
+            **self.stats,
+            "bytes": len(artifact.identity) if artifact else None,
+            "bytes_gzip": len(artifact.encoded["gzip"]) if artifact else None,
+            "brotli": brotli is not None,
+        }
+
+
+offline_bundle = OfflineBundle(BUNDLE_MIN_REBUILD_SECONDS)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Sequence
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.engine import Connection
+
+from .db import engine
+from .models import ChangeLog
+
+logger = logging.getLogger("sinabung.sync")
+
+# Key AppKV yang ikut change feed (nilainya dibaca publik oleh aplikasi).
+SYNC_KV_KEYS = frozenset(
+    k.strip()
+    for k in os.environ.get("SYNC_KV_KEYS", "emergency_state,magma_latest_cache,scheduler_state").split(",")
+    if k.strip()
+)
+# Tombstone lebih tua dari ini dihapus; klien dengan cursor sebelum itu diminta sinkron penuh.
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+PRUNED_SEQ_KEY = "sync_pruned_seq"
+
+# Kunci advisory Postgres untuk menserialkan penulis change log.
+_PG_LOCK_ID = 0x53594E43
+
+
+def record_change(conn: Connection, entity: str, entity_id: str, op: str = "upsert") -> None:
+    """
+    Catat perubahan di transaksi pemanggil (commit bersama datanya).
+    Baris lama entitas yang sama diganti, jadi seq selalu menunjuk perubahan terakhir.
+    """
+    record_changes(conn, entity, [entity_id], op)
+
+
+def record_changes(conn: Connection, entity: str, entity_ids: Sequence[str], op: str = "upsert") -> None:
+    """Versi batch record_change (import massal): satu DELETE + satu INSERT multi-baris."""
+    if not entity_ids:
+        return
+    if conn.dialect.name == "postgresql":
+        # Tanpa kunci, transaksi dengan seq lebih kecil bisa commit belakangan
+        # dan terlewat oleh klien yang cursor-nya sudah lewat seq itu.
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _PG_LOCK_ID})
+    table = ChangeLog.__table__
+    now = datetime.now(timezone.utc)
+    conn.execute(delete(table).where(table.c.entity == entity, table.c.entity_id.in_(list(entity_ids))))
+    conn.execute(
+        insert(table),
+        [{"entity": entity, "entity_id": entity_id, "op": op, "changed_at": now} for entity_id in entity_ids],
+    )
+
+
+def record_kv_change(conn: Connection, key: str) -> None:
+    if key in SYNC_KV_KEYS:
+        record_change(conn, "kv", key)
+
+
+def head_seq(conn: Connection) -> int:
+    return int(conn.execute(select(func.coalesce(func.max(ChangeLog.__table__.c.seq), 0))).scalar_one())
+
+
+def prune_tombstones(now: Optional[datetime] = None) -> int:
+    """Hapus tombstone lama dan simpan seq tertingginya sebagai batas bawah cursor yang valid."""
+    from .storage import read_json, write_json
+
+    if SYNC_TOMBSTONE_RETENTION_DAYS <= 0:
+        return 0
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS)
+    table = ChangeLog.__table__
+    old = (table.c.op == "delete") & (table.c.changed_at < cutoff)
+    with engine.connect() as conn:
+        floor = conn.execute(select(func.max(table.c.seq)).where(old)).scalar_one_or_none()
+    if floor is None:
+        return 0
+
+    # Batas bawah ditulis dulu: klien yang membaca di tengah proses diminta reset,
+    # bukan kehilangan tombstone.
+    current = read_json(PRUNED_SEQ_KEY, {})
+    if int((current or {}).get("seq") or 0) < floor:
+        write_json(PRUNED_SEQ_KEY, {"seq": int(floor), "pruned_at": now.isoformat()})
+    with engine.begin() as conn:
+        removed = conn.execute(delete(table).where(old, table.c.seq <= floor)).rowcount or 0
+    logger.info("Change log: %s tombstone dihapus (seq <= %s).", removed, floor)
+    return removed
+
+
+def pruned_seq() -> int:
+    from .storage import read_json
+
+    data = read_json(PRUNED_SEQ_KEY, {})
+    return int(data.get("seq") or 0) if isinstance(data, dict) else 0
@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+import os
+
+
+def env_flag(name: str, default: str) -> bool:
+    """Flag boolean dari env: semua nilai selain 0/false/no/off dianggap aktif."""
+    return os.environ.get(name, default).strip().lower() not in {"0", "false", "no", "off"}
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def _dumps(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@dataclass
+class SnapshotPart:
+    payload: Dict[str, Any]
+    body: bytes
+    refreshed_at: float
+    refreshed_at_utc: str
+    digest: str = ""
+    stale: bool = False
+    # Isi sementara sebelum refresh pertama (bukan hasil fetch).
+    placeholder: bool = False
+
+
+class DashboardSnapshot:
+    """
+    Snapshot dashboard di memori. Tiap bagian (volcano/earthquake) di-refresh
+    oleh job background dengan jadwal masing-masing dan disimpan sudah dalam
+    bentuk JSON bytes, jadi endpoint cukup menyambung bytes tanpa fetch upstream.
+    """
+
+    def __init__(self, max_age_seconds: Dict[str, float]) -> None:
+        self.max_age_seconds = dict(max_age_seconds)
+        self._parts: Dict[str, SnapshotPart] = {}
+
+    def put(self, name: str, payload: Dict[str, Any], stale: bool = False, placeholder: bool = False) -> None:
+        body = _dumps(payload)
+        self._parts[name] = SnapshotPart(
+            payload=payload,
+            body=body,
+            refreshed_at=time.monotonic(),
+            refreshed_at_utc=datetime.now(timezone.utc).isoformat(),
+            digest=hashlib.blake2b(body, digest_size=12).hexdigest(),
+            stale=stale,
+            placeholder=placeholder,
+        )
+
+    def mark_stale(self, name: str) -> None:
+        part = self._parts.get(name)
+        if part is not None:
+            part.stale = True
+
+    def get(self, name: str) -> Optional[SnapshotPart]:
+        return self._parts.get(name)
+
+    def has(self, name: str) -> bool:
+        return name in self._parts
+
+    def needs_refresh(self, name: str) -> bool:
+        """Belum ada, masih placeholder, atau lebih tua dari max_age."""
+        part = self._parts.get(name)
+        if part is None or part.placeholder:
+            return True
+        max_age = self.max_age_seconds.get(name)
+        return max_age is not None and time.monotonic() - part.refreshed_at > max_age
+
+    async def refresh(self, name: str, loader: Callable[[], Awaitable[tuple[Dict[str, Any], bool]]]) -> None:
+        payload, stale = await loader()
+        self.put(name, payload, stale=stale)
+
+    def _meta(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        parts: Dict[str, Any] = {}
+        stale = False
+        oldest = 0.0
+        for name, part in self._parts.items():
+            age = max(0.0, now - part.refreshed_at)
+            max_age = self.max_age_seconds.get(name)
+            part_stale = part.stale or (max_age is not None and age > max_age)
+            stale = stale or part_stale
+            oldest = max(oldest, age)
+            parts[name] = {
+                "stale": part_stale,
+                "age_seconds": round(age, 3),
+                "refreshed_at": part.refreshed_at_utc,
+            }
+        return {"stale": stale, "age_seconds": round(oldest, 3), "parts": parts}
+
+    def version(self) -> tuple:
+        """Identitas isi snapshot (hash tiap bagian + status stale), untuk ETag weak.
+        Umur snapshot sengaja tidak ikut, supaya ETag tidak berubah tiap detik."""
+        meta = self._meta()["parts"]
+        return tuple(
+            (name, part.digest, meta[name]["stale"]) for name, part in sorted(self._parts.items())
+        )
+
+    def render(self) -> bytes:
+        volcano = self._parts["volcano"].body
+        earthquake = self._parts["earthquake"].body
+        return b"".join(
+            [
+                b'{"volcano":',
+                volcano,
+                b',"magma":',
+                volcano,
+                b',"earthquake":',
+                earthquake,
+                b',"gempa":',
+                earthquake,
+                b',"snapshot":',
+                _dumps(self._meta()),
+                b"}",
+            ]
+        )
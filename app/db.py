@@ -1,9 +1,16 @@
 from __future__ import annotations
 
+import logging
 import os
-from typing import Generator
+from typing import Any, AsyncGenerator, Callable, Generator, List, Optional, TypeVar
 
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
 from sqlmodel import SQLModel, create_engine, Session
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger("sinabung.db")
+T = TypeVar("T")
 
 # Default: SQLite file di folder project
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sinawise.db")
@@ -19,6 +26,97 @@ engine = create_engine(
     connect_args=connect_args,
 )
 
+
+def dialect_insert() -> Optional[Callable[..., Any]]:
+    """
+    `insert` milik dialect aktif (Postgres/SQLite) yang punya on_conflict_do_*
+    untuk upsert. None untuk dialect lain; pemanggil pakai jalur generik.
+    """
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+# ---------------- ASYNC (opsional) ----------------
+# Handler baca yang ramai memakai engine async supaya round trip ke Supabase tidak
+# memakan thread dari threadpool Starlette. Butuh `greenlet` + driver async:
+# psycopg (sudah terpasang, mode async) untuk Postgres, `aiosqlite` untuk SQLite.
+# Mati / driver tidak ada -> fetch_all() & run_in_transaction() jalan di threadpool
+# dengan engine sync seperti sebelumnya. Script tetap memakai engine sync.
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB_ENABLED", "0").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql+psycopg://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "").strip() or _async_url(DATABASE_URL)
+
+
+def _create_async_engine():
+    if not ASYNC_DB_ENABLED:
+        return None
+    if ASYNC_DATABASE_URL.startswith("sqlite") and (":memory:" in ASYNC_DATABASE_URL or ASYNC_DATABASE_URL.rstrip("/").endswith(":")):
+        # SQLite in-memory tidak bisa dibagi antar engine.
+        logger.warning("Async DB disabled: in-memory SQLite.")
+        return None
+    try:
+        import greenlet  # noqa: F401  (dipakai SQLAlchemy asyncio)
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        return create_async_engine(ASYNC_DATABASE_URL, echo=False)
+    except Exception as e:
+        logger.warning("Async DB disabled, using threadpool: %s: %s", type(e).__name__, e)
+        return None
+
+
+async_engine = _create_async_engine()
+
+
+def _fetch_all_sync(stmt: Any) -> List[Any]:
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+
+async def fetch_all(stmt: Any) -> List[Any]:
+    """Jalankan SELECT (Core) dan kembalikan semua baris, tanpa memblokir event loop."""
+    if async_engine is not None:
+        async with async_engine.connect() as conn:
+            return (await conn.execute(stmt)).all()
+    return await run_in_threadpool(_fetch_all_sync, stmt)
+
+
+def _begin_sync(fn: Callable[[Connection], T]) -> T:
+    with engine.begin() as conn:
+        return fn(conn)
+
+
+async def run_in_transaction(fn: Callable[[Connection], T]) -> T:
+    """
+    fn(conn) dengan API Connection sync di dalam satu transaksi. Dengan engine async,
+    fn dijalankan lewat run_sync (greenlet) sehingga kode tulis yang sama dipakai dua jalur.
+    """
+    if async_engine is not None:
+        async with async_engine.begin() as conn:
+            return await conn.run_sync(fn)
+    return await run_in_threadpool(_begin_sync, fn)
+
+
+async def dispose_async_engine() -> None:
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
 def init_db() -> None:
     """Create all tables from SQLModel metadata."""
     # Import model module lazily so all SQLModel tables are registered
@@ -26,8 +124,57 @@ def init_db() -> None:
     from . import models  # noqa: F401
 
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    _add_missing_indexes()
+
+
+# Kolom yang ditambahkan setelah tabel sudah ada di database lama;
+# create_all() tidak mengubah tabel yang sudah ada.
+_ADDED_COLUMNS = {
+    "appkv": {
+        "version": "INTEGER NOT NULL DEFAULT 1",
+    },
+}
+
+
+def _add_missing_columns() -> None:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table, columns in _ADDED_COLUMNS.items():
+            if table not in existing_tables:
+                continue
+            present = {col["name"] for col in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in present:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def _add_missing_indexes() -> None:
+    # create_all() hanya membuat index untuk tabel baru; index yang ditambahkan
+    # belakangan di model dibuat di sini.
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(engine, checkfirst=True)
+
 
 def get_session() -> Generator[Session, None, None]:
     """FastAPI dependency: yield a DB session."""
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session() -> AsyncGenerator[Any, None]:
+    """FastAPI dependency: AsyncSession (butuh ASYNC_DB_ENABLED + driver async)."""
+    if async_engine is None:
+        raise RuntimeError("Async DB tidak aktif (ASYNC_DB_ENABLED=0 atau driver async tidak terpasang)")
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
@@ -1,14 +1,18 @@
 from __future__ import annotations
 
 from datetime import datetime, timezone
-from typing import List
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlmodel import Session, select
 
 from .db import get_session
 from .models import Video, VideoCreate, VideoUpdate, VideoOut
 from .auth import require_admin
+from .changelog import record_change
+from .http_cache import cached_json_async, dumps, make_etag
+from .listing import keyset_page, page_headers, parse_fields, project, resolve_limit
+from .storage import bump_resource_version, resource_version_async
 
 router = APIRouter(tags=["education"])
 
@@ -17,21 +21,56 @@ def now_utc():
     return datetime.now(timezone.utc)
 
 
+def load_public_videos(session: Session) -> List[VideoOut]:
+    rows = session.exec(select(Video).order_by(Video.created_at.desc())).all()
+    return [VideoOut.model_validate(row.model_dump()) for row in rows]
+
+
+VIDEO_FIELDS = list(VideoOut.model_fields)
+
+
+async def load_video_page(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> tuple:
+    selected = parse_fields(fields, VIDEO_FIELDS) or VIDEO_FIELDS
+    rows, next_cursor = await keyset_page(Video, selected, resolve_limit(limit, cursor, fields), cursor)
+    return [project(row, selected) for row in rows], next_cursor
+
+
 # ===== PUBLIC =====
 @router.get("/education/videos", response_model=List[VideoOut])
-def public_list_videos(session: Session = Depends(get_session)):
-    rows = session.exec(select(Video).order_by(Video.created_at.desc())).all()
-    return rows
+async def public_list_videos(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, description="jumlah per halaman; tanpa parameter paging = daftar penuh"),
+    cursor: Optional[str] = Query(None, description="nilai header X-Next-Cursor dari halaman sebelumnya"),
+    fields: Optional[str] = Query(None, description="kolom yang dikembalikan, mis. id,judul,url"),
+):
+    # Versi koleksi dari cache AppKV: If-None-Match yang cocok dijawab 304 tanpa query tabel.
+    etag = make_etag("videos", await resource_version_async("videos"), resolve_limit(limit, cursor, fields), cursor, fields)
+    page: Dict[str, Any] = {}
+
+    async def _build():
+        page["items"], page["next"] = await load_video_page(limit, cursor, fields)
+        return page["items"]
+
+    response = await cached_json_async(request, "videos", etag, _build)
+    return page_headers(response, request, page.get("next"))
 
 
 # ===== ADMIN =====
 @router.get("/admin/videos", response_model=List[VideoOut])
-def admin_list_videos(
-    session: Session = Depends(get_session),
+async def admin_list_videos(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
     user: str = Depends(require_admin),
 ):
-    rows = session.exec(select(Video).order_by(Video.created_at.desc())).all()
-    return rows
+    items, next_cursor = await load_video_page(limit, cursor, fields)
+    response = Response(content=dumps(items), media_type="application/json", headers={"Cache-Control": "no-store"})
+    return page_headers(response, request, next_cursor)
 
 
 @router.post("/admin/videos", response_model=VideoOut)
@@ -42,8 +81,10 @@ def admin_create_video(
 ):
     item = Video(**payload.model_dump())
     session.add(item)
+    record_change(session.connection(), "videos", item.id)
     session.commit()
     session.refresh(item)
+    bump_resource_version("videos")
     return item
 
 
@@ -64,8 +105,10 @@ def admin_update_video(
     item.updated_at = now_utc()
 
     session.add(item)
+    record_change(session.connection(), "videos", item.id)
     session.commit()
     session.refresh(item)
+    bump_resource_version("videos")
     return item
 
 
@@ -80,5 +123,7 @@ def admin_delete_video(
         raise HTTPException(status_code=404, detail="Video not found")
 
     session.delete(item)
+    record_change(session.connection(), "videos", item.id, "delete")
     session.commit()
+    bump_resource_version("videos")
     return {"ok": True}
@@ -5,11 +5,13 @@ import os
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel, Field
 
 from .admin_auth import require_admin
-from .storage import read_json, write_json
+from .broadcast import hub, publish
+from .http_cache import cached_json, make_etag
+from .storage import KVConflictError, read_json, read_json_versioned_async, update_json
 
 router = APIRouter(tags=["emergency"])
 logger = logging.getLogger("sinabung.emergency")
@@ -35,7 +37,10 @@ def _default_state() -> Dict[str, Any]:
 
 
 def _load_state() -> Dict[str, Any]:
-    data = read_json(STATE_KEY, _default_state())
+    return _normalize_state(read_json(STATE_KEY, _default_state()))
+
+
+def _normalize_state(data: Any) -> Dict[str, Any]:
     if not isinstance(data, dict):
         data = _default_state()
     data.setdefault("active", False)
@@ -45,8 +50,14 @@ def _load_state() -> Dict[str, Any]:
     return data
 
 
-def _save_state(state: Dict[str, Any]) -> None:
-    write_json(STATE_KEY, state)
+def _update_state(changes: Dict[str, Any]) -> Dict[str, Any]:
+    def _apply(current: Any) -> Dict[str, Any]:
+        state = _normalize_state(current)
+        state.update(changes)
+        return state
+
+    state, _ = update_json(STATE_KEY, _apply, _default_state())
+    return state
 
 
 class EmergencyTriggerReq(BaseModel):
@@ -64,25 +75,42 @@ class EmergencyClearReq(BaseModel):
 
 
 @router.get("/emergency/status")
-def emergency_status() -> Dict[str, Any]:
-    return _load_state()
+async def emergency_status(request: Request) -> Response:
+    data, version = await read_json_versioned_async(STATE_KEY, None)
+    etag = make_etag("emergency", version)
+    return cached_json(request, "emergency", etag, lambda: _normalize_state(data))
+
+
+def activate_emergency(
+    level: Optional[str],
+    message: str,
+    title: Optional[str] = None,
+    only_if_inactive: bool = False,
+) -> tuple[Dict[str, Any], bool]:
+    """
+    Aktifkan status darurat + kirim alarm FCM. Dipakai endpoint admin dan
+    eskalasi otomatis. only_if_inactive=True: tidak menimpa darurat yang sedang
+    aktif (dicek atomik lewat update_json). Return (state, berubah?).
+    """
+    changes = {
+        "active": True,
+        "level": level,
+        "message": message,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    applied = {"changed": False}
 
+    def _apply(current: Any) -> Dict[str, Any]:
+        state = _normalize_state(current)
+        applied["changed"] = not (only_if_inactive and state.get("active"))
+        if applied["changed"]:
+            state.update(changes)
+        return state
 
-@router.post("/admin/emergency/trigger", dependencies=[Depends(require_admin)])
-def emergency_trigger(payload: EmergencyTriggerReq) -> Dict[str, Any]:
-    level = (payload.level or "").strip() or None
-    message = (payload.message or payload.body or "").strip() or "Segera evakuasi!"
-
-    state = _load_state()
-    state.update(
-        {
-            "active": True,
-            "level": level,
-            "message": message,
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-        }
-    )
-    _save_state(state)
+    state, _ = update_json(STATE_KEY, _apply, _default_state())
+    if not applied["changed"]:
+        return state, False
+    publish("emergency", state)
 
     if send_to_topic is not None:
         try:
@@ -92,11 +120,11 @@ def emergency_trigger(payload: EmergencyTriggerReq) -> Dict[str, Any]:
                 "ts_utc": str(state["updated_at"]),
                 "level": str(level or ""),
                 "message": str(message),
-                "title": str(payload.title or "PERINGATAN DARURAT"),
+                "title": str(title or "PERINGATAN DARURAT"),
             }
             send_to_topic(
                 topic=EMERGENCY_TOPIC,
-                title=payload.title or "PERINGATAN DARURAT",
+                title=title or "PERINGATAN DARURAT",
                 body=message,
                 data=data,
                 notification=True,
@@ -105,6 +133,28 @@ def emergency_trigger(payload: EmergencyTriggerReq) -> Dict[str, Any]:
         except Exception:
             logger.exception("Failed to send emergency alarm notification.")
 
+    return state, True
+
+
+def _busy() -> HTTPException:
+    # State darurat sedang ditulis bersamaan oleh penulis lain; aman diulang.
+    logger.warning("Emergency state update gave up after CAS retries.")
+    return HTTPException(
+        status_code=503,
+        detail="Status darurat sedang diperbarui, coba lagi",
+        headers={"Retry-After": "1"},
+    )
+
+
+@router.post("/admin/emergency/trigger", dependencies=[Depends(require_admin)])
+def emergency_trigger(payload: EmergencyTriggerReq) -> Dict[str, Any]:
+    level = (payload.level or "").strip() or None
+    message = (payload.message or payload.body or "").strip() or "Segera evakuasi!"
+
+    try:
+        state, _ = activate_emergency(level, message, title=payload.title)
+    except KVConflictError:
+        raise _busy()
     return {"ok": True, "status": state}
 
 
@@ -112,16 +162,18 @@ def emergency_trigger(payload: EmergencyTriggerReq) -> Dict[str, Any]:
 def emergency_clear(payload: EmergencyClearReq) -> Dict[str, Any]:
     message = (payload.message or payload.body or "").strip() or "Situasi sudah aman."
 
-    state = _load_state()
-    state.update(
-        {
-            "active": False,
-            "level": None,
-            "message": message,
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-        }
-    )
-    _save_state(state)
+    try:
+        state = _update_state(
+            {
+                "active": False,
+                "level": None,
+                "message": message,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+    except KVConflictError:
+        raise _busy()
+    publish("emergency", state)
 
     if send_to_topic is not None and NOTIFY_CLEAR:
         try:
@@ -144,3 +196,6 @@ def emergency_clear(payload: EmergencyClearReq) -> Dict[str, Any]:
             logger.exception("Failed to send emergency clear notification.")
 
     return {"ok": True, "status": state}
+
+
+hub.snapshot_loaders["emergency"] = _load_state
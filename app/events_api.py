@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from .broadcast import BROADCAST_HEARTBEAT_SECONDS, Subscriber, _encode, hub
+
+router = APIRouter(tags=["events"])
+logger = logging.getLogger("sinabung.broadcast")
+
+
+def _parse_topics(topics: Optional[str]) -> Optional[Set[str]]:
+    if not topics:
+        return None
+    parsed = {t.strip() for t in topics.split(",") if t.strip()}
+    return parsed or None
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"id: {event['id']}\nevent: {event['topic']}\ndata: {_encode(event)}\n\n"
+
+
+async def _next_event(sub: Subscriber) -> Optional[Dict[str, Any]]:
+    """Event berikutnya, atau None kalau heartbeat jatuh tempo."""
+    try:
+        return await asyncio.wait_for(sub.queue.get(), timeout=BROADCAST_HEARTBEAT_SECONDS)
+    except asyncio.TimeoutError:
+        return None
+
+
+@router.get("/events/stream")
+async def events_stream(request: Request, topics: Optional[str] = Query(None, description="mis. emergency,magma,air")):
+    """
+    Server-Sent Events: status darurat, perubahan level MAGMA, dan status udara.
+    Event pertama berisi state terakhir tiap topik; komentar ': ping' dikirim
+    tiap BROADCAST_HEARTBEAT_SECONDS supaya proxy tidak memutus koneksi.
+    """
+    wanted = _parse_topics(topics)
+    sub = hub.subscribe(wanted)
+    if sub is None:
+        raise HTTPException(status_code=503, detail="Terlalu banyak koneksi event", headers={"Retry-After": "30"})
+    initial = await run_in_threadpool(hub.snapshot, wanted)
+
+    async def _gen() -> AsyncIterator[str]:
+        try:
+            yield f"retry: {int(BROADCAST_HEARTBEAT_SECONDS * 1000)}\n\n"
+            for event in initial:
+                yield _sse(event)
+            while not sub.closed:
+                event = await _next_event(sub)
+                if event is None:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(event)
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        _gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/events/ws")
+async def events_ws(websocket: WebSocket, topics: Optional[str] = None) -> None:
+    """WebSocket dengan isi yang sama seperti /events/stream; heartbeat {"type": "ping"}."""
+    wanted = _parse_topics(topics)
+    sub = hub.subscribe(wanted)
+    # accept dulu: close sebelum accept dikirim uvicorn sebagai HTTP 403, kode 1013
+    # ("coba lagi nanti", setara 503 di SSE) tidak pernah sampai ke klien.
+    await websocket.accept()
+    if sub is None:
+        await websocket.close(code=1013)
+        return
+
+    async def _sender() -> None:
+        for event in await run_in_threadpool(hub.snapshot, wanted):
+            await websocket.send_text(_encode(event))
+        while not sub.closed:
+            event = await _next_event(sub)
+            await websocket.send_text(_encode(event) if event is not None else '{"type":"ping"}')
+
+    async def _receiver() -> None:
+        # Pesan dari klien diabaikan; loop ini hanya untuk mendeteksi disconnect.
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(_sender()), asyncio.create_task(_receiver())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except Exception:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, WebSocketDisconnect, Exception):
+                pass
+        hub.unsubscribe(sub)
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+
+@router.get("/events/stats")
+def events_stats() -> Dict[str, Any]:
+    return hub.snapshot_stats()
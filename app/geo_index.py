@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from .db import engine
+from .models import ChangeLog, Posko
+
+logger = logging.getLogger("sinabung.geo")
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+# Ukuran sel grid (derajat). 0.05 ~ 5.5 km: satu desa/kecamatan per sel di sekitar Sinabung.
+GEO_CELL_DEG = float(os.environ.get("GEO_CELL_DEG", "0.05"))
+GEO_INDEX_ENABLED = os.environ.get("GEO_INDEX_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+GEO_NEAREST_MAX_K = int(os.environ.get("GEO_NEAREST_MAX_K", "50"))
+
+Cell = Tuple[int, int]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _capacity_ok(item: Dict[str, Any], min_kapasitas: Optional[int], terisi: Optional[Dict[str, int]]) -> bool:
+    """min_kapasitas dibandingkan dengan sisa tempat (kapasitas - okupansi live)."""
+    if min_kapasitas is None:
+        return True
+    if item.get("kapasitas") is None:
+        return False
+    return item["kapasitas"] - (terisi or {}).get(item["id"], 0) >= min_kapasitas
+
+
+def _ranked(
+    items: Iterable[Dict[str, Any]],
+    lat: float,
+    lng: float,
+    k: int,
+    min_kapasitas: Optional[int],
+    max_km: Optional[float],
+    terisi: Optional[Dict[str, int]] = None,
+) -> List[Tuple[float, Dict[str, Any]]]:
+    scored = []
+    for item in items:
+        if not _capacity_ok(item, min_kapasitas, terisi):
+            continue
+        dist = haversine_km(lat, lng, item["lat"], item["lng"])
+        if max_km is None or dist <= max_km:
+            scored.append((dist, item["id"], item))
+    return [(d, item) for d, _, item in heapq.nsmallest(k, scored, key=lambda x: (x[0], x[1]))]
+
+
+def _posko_dict(row: Any) -> Dict[str, Any]:
+    # Hanya kolom Posko; okupansi live digabung pemanggil dari occupancy_cache.
+    return Posko.model_validate(row.model_dump()).model_dump(mode="json")
+
+
+class PoskoGeoIndex:
+    """
+    Index grid (bucket lat/lng per GEO_CELL_DEG) untuk posko terdekat.
+    - Query memeriksa sel berupa cincin yang melebar dari titik user, berhenti
+      begitu k kandidat terdekat pasti tidak bisa dikalahkan sel di luar cincin.
+      Jumlah posko yang dihitung jaraknya bergantung kepadatan lokal, bukan total.
+    - CRUD admin memperbarui index langsung (put/remove); worker lain menyusul
+      lewat ChangeLog ketika resource_version('posko') berubah.
+    """
+
+    def __init__(self, cell_deg: float) -> None:
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._cells: Dict[Cell, Dict[str, Dict[str, Any]]] = {}
+        self._loaded = False
+        self._version: Optional[int] = None
+        self._seq = 0
+        # Rentang indeks sel yang terisi; batas cincin maksimum.
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+
+    def _cell(self, lat: float, lng: float) -> Cell:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    # -- perubahan ---------------------------------------------------------
+    def _put_locked(self, item: Dict[str, Any]) -> None:
+        self._remove_locked(item["id"])
+        cell = self._cell(item["lat"], item["lng"])
+        self._items[item["id"]] = item
+        self._cells.setdefault(cell, {})[item["id"]] = item
+        self._bounds = None
+
+    def _remove_locked(self, item_id: str) -> None:
+        old = self._items.pop(item_id, None)
+        if old is None:
+            return
+        cell = self._cell(old["lat"], old["lng"])
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(item_id, None)
+            if not bucket:
+                del self._cells[cell]
+        self._bounds = None
+
+    def put(self, row: Any) -> None:
+        with self._lock:
+            if self._loaded:
+                self._put_locked(_posko_dict(row))
+
+    def remove(self, item_id: str) -> None:
+        with self._lock:
+            if self._loaded:
+                self._remove_locked(item_id)
+
+    # -- sinkron DB --------------------------------------------------------
+    def refresh(self, version: int) -> None:
+        """Muat penuh saat pertama dipakai; setelah itu terapkan ChangeLog posko sejak seq terakhir."""
+        with self._lock:
+            if self._loaded and version == self._version:
+                return
+            with Session(engine) as session:
+                if not self._loaded:
+                    self._load_full_locked(session)
+                else:
+                    self._apply_changes_locked(session)
+            self._version = version
+
+    def _load_full_locked(self, session: Session) -> None:
+        seq = session.exec(select(ChangeLog.seq).order_by(ChangeLog.seq.desc()).limit(1)).first() or 0
+        rows = session.exec(select(Posko)).all()
+        self._items.clear()
+        self._cells.clear()
+        for row in rows:
+            self._put_locked(_posko_dict(row))
+        self._seq = seq
+        self._loaded = True
+        logger.info("Posko geo index loaded: %s posko.", len(self._items))
+
+    def _apply_changes_locked(self, session: Session) -> None:
+        entries = session.exec(
+            select(ChangeLog)
+            .where(ChangeLog.entity == "posko", ChangeLog.seq > self._seq)
+            .order_by(ChangeLog.seq)
+        ).all()
+        if not entries:
+            return
+        upserts = [e.entity_id for e in entries if e.op != "delete"]
+        rows = {row.id: row for row in session.exec(select(Posko).where(Posko.id.in_(upserts))).all()} if upserts else {}
+        for entry in entries:
+            row = rows.get(entry.entity_id)
+            if entry.op == "delete" or row is None:
+                self._remove_locked(entry.entity_id)
+            else:
+                self._put_locked(_posko_dict(row))
+        self._seq = max(self._seq, entries[-1].seq)
+
+    # -- query -------------------------------------------------------------
+    def _cell_bounds(self) -> Tuple[int, int, int, int]:
+        if self._bounds is None:
+            rows = [c[0] for c in self._cells]
+            cols = [c[1] for c in self._cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        return self._bounds
+
+    def _ring(self, center: Cell, r: int) -> Iterable[Cell]:
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int,
+        min_kapasitas: Optional[int] = None,
+        max_km: Optional[float] = None,
+        terisi: Optional[Dict[str, int]] = None,
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        with self._lock:
+            if not self._cells:
+                return []
+            center = self._cell(lat, lng)
+            min_i, max_i, min_j, max_j = self._cell_bounds()
+            max_r = max(abs(center[0] - min_i), abs(center[0] - max_i), abs(center[1] - min_j), abs(center[1] - max_j))
+            best: List[Tuple[float, str, Dict[str, Any]]] = []  # max-heap lewat jarak negatif
+
+            def _consider(bucket: Dict[str, Dict[str, Any]]) -> None:
+                for item in bucket.values():
+                    if not _capacity_ok(item, min_kapasitas, terisi):
+                        continue
+                    dist = haversine_km(lat, lng, item["lat"], item["lng"])
+                    if max_km is not None and dist > max_km:
+                        continue
+                    entry = (-dist, item["id"], item)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, entry)
+
+            for r in range(max_r + 1):
+                if 8 * r > len(self._cells):
+                    # User jauh dari semua posko: cincin lebih banyak dari sel terisi,
+                    # lebih murah memeriksa sisa sel terisi sekaligus.
+                    for cell, bucket in self._cells.items():
+                        if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= r:
+                            _consider(bucket)
+                    break
+                for cell in self._ring(center, r):
+                    bucket = self._cells.get(cell)
+                    if bucket:
+                        _consider(bucket)
+                # Semua sel di luar cincin r berjarak minimal r sel dari titik user
+                # (lng menyempit dengan cos(lat), jadi pakai lintang terjauh cincin berikutnya).
+                edge_lat = min(89.0, abs(lat) + (r + 1) * self.cell_deg)
+                bound_km = r * self.cell_deg * KM_PER_DEG_LAT * math.cos(math.radians(edge_lat))
+                if max_km is not None and bound_km > max_km:
+                    break
+                if len(best) >= k and -best[0][0] <= bound_km:
+                    break
+            return sorted(((-d, item) for d, _, item in best), key=lambda x: (x[0], x[1]["id"]))
+
+    def items(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return sorted(self._items.values(), key=lambda item: item["id"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"loaded": self._loaded, "posko": len(self._items), "cells": len(self._cells), "seq": self._seq}
+
+
+posko_index = PoskoGeoIndex(GEO_CELL_DEG)
+
+
+def nearest_sql(
+    session: Session,
+    lat: float,
+    lng: float,
+    k: int,
+    min_kapasitas: Optional[int] = None,
+    max_km: Optional[float] = None,
+    terisi: Optional[Dict[str, int]] = None,
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    Tanpa index: prefilter bounding box di SQL (kolom lat/lng ber-index),
+    kotak diperlebar dua kali lipat sampai k posko ditemukan.
+    """
+    radius_km = min(10.0, max_km) if max_km is not None else 10.0
+    while True:
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlng = radius_km / (KM_PER_DEG_LAT * max(0.01, math.cos(math.radians(min(89.0, abs(lat) + dlat)))))
+        query = select(Posko).where(
+            Posko.lat >= lat - dlat,
+            Posko.lat <= lat + dlat,
+            Posko.lng >= lng - dlng,
+            Posko.lng <= lng + dlng,
+        )
+        if min_kapasitas is not None:
+            # Syarat perlu saja; sisa tempat (dengan okupansi) dicek di _ranked.
+            query = query.where(Posko.kapasitas >= min_kapasitas)
+        rows = [_posko_dict(row) for row in session.exec(query).all()]
+        # Hanya hasil di dalam lingkaran radius yang pasti benar; sudut kotak belum tentu.
+        found = _ranked(rows, lat, lng, k, min_kapasitas, radius_km, terisi)
+        exhausted = radius_km >= math.pi * EARTH_RADIUS_KM or (max_km is not None and radius_km >= max_km)
+        if len(found) >= k or exhausted:
+            return found
+        radius_km = min(radius_km * 2, max_km) if max_km is not None else radius_km * 2
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .storage import read_json_versioned
+
+try:
+    import numpy as np
+except Exception:  # pragma: no cover - fallback Python murni
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Puncak G. Sinabung (pusat semua zona).
+SUMMIT_LAT = float(os.environ.get("HAZARD_SUMMIT_LAT", "3.170"))
+SUMMIT_LNG = float(os.environ.get("HAZARD_SUMMIT_LNG", "98.392"))
+# Dipakai kalau cache MAGMA kosong / tidak ada radius yang bisa dibaca.
+HAZARD_DEFAULT_RADIUS_KM = float(os.environ.get("HAZARD_DEFAULT_RADIUS_KM", "3"))
+# Lebar setengah sektor kalau rekomendasi hanya menyebut satu arah (mis. "sektor tenggara").
+HAZARD_SECTOR_HALF_WIDTH = float(os.environ.get("HAZARD_SECTOR_HALF_WIDTH", "45"))
+MAGMA_CACHE_KEY = "magma_latest_cache"
+
+# Arah mata angin -> bearing (derajat dari utara, searah jarum jam).
+DIRECTIONS = {
+    "utara": 0.0,
+    "timur laut": 45.0,
+    "timur": 90.0,
+    "tenggara": 135.0,
+    "selatan": 180.0,
+    "barat daya": 225.0,
+    "barat": 270.0,
+    "barat laut": 315.0,
+}
+
+_KM_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*km\b", re.I)
+_RADIUS_RE = re.compile(r"radius", re.I)
+_AREA_RE = re.compile(r"sektor(?:al)?(?:\s+arah)?|area:", re.I)
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+@dataclass
+class HazardZone:
+    jenis: str  # radial | sektoral
+    radius_km: float
+    # Sektor: bearing awal + lebar (searah jarum jam). Radial: 0 / 360.
+    bearing_start: float = 0.0
+    bearing_width: float = 360.0
+    arah: List[str] = field(default_factory=list)
+    teks: Optional[str] = None
+
+    def label(self) -> str:
+        if self.jenis == "sektoral" and self.arah:
+            return f"Radius {self.radius_km:g} km (sektoral {'-'.join(self.arah)})"
+        return f"Radius {self.radius_km:g} km ({self.jenis})"
+
+
+def parse_directions(text: str) -> List[str]:
+    """'selatan-timur' -> ['selatan', 'timur']; 'barat daya' digabung jadi satu arah."""
+    words = _WORD_RE.findall(text.lower())
+    found: List[str] = []
+    i = 0
+    while i < len(words):
+        pair = " ".join(words[i : i + 2])
+        if pair in DIRECTIONS:
+            found.append(pair)
+            i += 2
+        elif words[i] in DIRECTIONS:
+            found.append(words[i])
+            i += 1
+        elif words[i] in {"dan", "ke", "hingga", "sampai"} and found:
+            i += 1
+        else:
+            break  # arah selalu di awal teks setelah kata 'sektor'
+    return found
+
+
+def sector_arc(arah: Sequence[str]) -> Optional[Tuple[float, float]]:
+    """(bearing awal, lebar) terkecil yang mencakup semua arah yang disebut."""
+    bearings = sorted({DIRECTIONS[a] for a in arah if a in DIRECTIONS})
+    if not bearings:
+        return None
+    if len(bearings) == 1:
+        return ((bearings[0] - HAZARD_SECTOR_HALF_WIDTH) % 360.0, 2 * HAZARD_SECTOR_HALF_WIDTH)
+    # Busur terkecil = lingkaran dikurangi celah terbesar di antara arah yang berurutan.
+    gaps = [((bearings[(i + 1) % len(bearings)] - b) % 360.0, i) for i, b in enumerate(bearings)]
+    gap, i = max(gaps)
+    start = bearings[(i + 1) % len(bearings)]
+    return (start, 360.0 - gap)
+
+
+def parse_zones(lines: Sequence[str]) -> List[HazardZone]:
+    """
+    Zona dari teks rekomendasi MAGMA, mis.
+    "radius radial 2 km dari puncak ..., serta radius 3.5 km untuk sektoral selatan-timur".
+    Tiap angka 'X km' di kalimat yang menyebut 'radius' jadi satu zona; jenisnya
+    dari kata 'radial'/'sektor' di antara kata 'radius' terakhir dan angka berikutnya.
+    Sektor tanpa arah yang terbaca diperlakukan radial (lebih aman).
+    """
+    zones: List[HazardZone] = []
+    for line in lines or []:
+        if not _RADIUS_RE.search(line):
+            continue
+        matches = list(_KM_RE.finditer(line))
+        for n, m in enumerate(matches):
+            between = line[matches[n - 1].end() if n else 0 : m.start()]
+            radius_pos = [r.start() for r in _RADIUS_RE.finditer(between)]
+            pre = between[radius_pos[-1] :] if radius_pos else ""
+            post = line[m.end() : matches[n + 1].start() if n + 1 < len(matches) else len(line)]
+            cut = _RADIUS_RE.search(post)
+            if cut:
+                post = post[: cut.start()]
+            context = f"{pre} {post}".lower()
+
+            km = float(m.group(1).replace(",", "."))
+            zone = HazardZone(jenis="radial", radius_km=km, teks=(pre + m.group(0) + post).strip(" ,.;"))
+            if "radial" not in pre.lower() and "sektor" in context:
+                arah: List[str] = []
+                for area in _AREA_RE.finditer(context):
+                    arah = parse_directions(context[area.end() :])
+                    if arah:
+                        break
+                arc = sector_arc(arah)
+                if arc is not None:
+                    zone.jenis = "sektoral"
+                    zone.arah = arah
+                    zone.bearing_start, zone.bearing_width = arc
+            zones.append(zone)
+
+    uniq: List[HazardZone] = []
+    seen = set()
+    for zone in zones:
+        key = (zone.jenis, zone.radius_km, round(zone.bearing_start, 3), round(zone.bearing_width, 3))
+        if key not in seen:
+            seen.add(key)
+            uniq.append(zone)
+    return uniq
+
+
+def _destination(lat: float, lng: float, bearing: float, km: float) -> Tuple[float, float]:
+    p1, l1, b, d = math.radians(lat), math.radians(lng), math.radians(bearing), km / EARTH_RADIUS_KM
+    p2 = math.asin(math.sin(p1) * math.cos(d) + math.cos(p1) * math.sin(d) * math.cos(b))
+    l2 = l1 + math.atan2(math.sin(b) * math.sin(d) * math.cos(p1), math.cos(d) - math.sin(p1) * math.sin(p2))
+    return math.degrees(p2), (math.degrees(l2) + 540.0) % 360.0 - 180.0
+
+
+@dataclass
+class HazardModel:
+    center_lat: float
+    center_lng: float
+    zones: List[HazardZone]
+    level: Optional[str] = None
+    report_id: Optional[str] = None
+    source: str = "magma"
+    version: int = 0
+
+    def signature(self) -> tuple:
+        """Identitas geometri zona (tanpa versi cache), untuk tahu kapan turunan perlu dihitung ulang."""
+        return (self.center_lat, self.center_lng) + tuple(
+            (z.jenis, z.radius_km, z.bearing_start, z.bearing_width) for z in self.zones
+        )
+
+    @property
+    def max_radius_km(self) -> float:
+        return max((z.radius_km for z in self.zones), default=0.0)
+
+    # -- evaluasi ----------------------------------------------------------
+    def classify(self, lats: Sequence[float], lngs: Sequence[float]) -> Dict[str, Any]:
+        """
+        Klasifikasi banyak titik sekaligus. Return array sejajar input:
+        inside (bool), zone (indeks zona terkecil yang memuat titik, -1 = aman),
+        jarak_km dan bearing dari puncak.
+        """
+        if np is not None:
+            return self._classify_numpy(np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64))
+        return self._classify_python(lats, lngs)
+
+    def _zone_order(self) -> List[int]:
+        # Zona dengan radius terkecil dicek terakhir supaya menimpa (paling spesifik).
+        return sorted(range(len(self.zones)), key=lambda i: -self.zones[i].radius_km)
+
+    def _classify_numpy(self, lats, lngs) -> Dict[str, Any]:
+        p1 = math.radians(self.center_lat)
+        p2 = np.radians(lats)
+        dlat = p2 - p1
+        dlng = np.radians(lngs - self.center_lng)
+        a = np.sin(dlat / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(dlng / 2) ** 2
+        dist = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+        y = np.sin(dlng) * np.cos(p2)
+        x = math.cos(p1) * np.sin(p2) - math.sin(p1) * np.cos(p2) * np.cos(dlng)
+        bearing = (np.degrees(np.arctan2(y, x)) + 360.0) % 360.0
+
+        zone = np.full(lats.shape, -1, dtype=np.int64)
+        for i in self._zone_order():
+            z = self.zones[i]
+            mask = dist <= z.radius_km
+            if z.bearing_width < 360.0:
+                mask &= ((bearing - z.bearing_start) % 360.0) <= z.bearing_width
+            zone[mask] = i
+        return {
+            "inside": (zone >= 0).tolist(),
+            "zone": zone.tolist(),
+            "jarak_km": np.round(dist, 3).tolist(),
+            "bearing": np.round(bearing, 1).tolist(),
+        }
+
+    def _classify_python(self, lats: Sequence[float], lngs: Sequence[float]) -> Dict[str, Any]:
+        p1 = math.radians(self.center_lat)
+        order = self._zone_order()
+        out: Dict[str, List[Any]] = {"inside": [], "zone": [], "jarak_km": [], "bearing": []}
+        for lat, lng in zip(lats, lngs):
+            p2 = math.radians(lat)
+            dlng = math.radians(lng - self.center_lng)
+            a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2) ** 2
+            dist = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+            y = math.sin(dlng) * math.cos(p2)
+            x = math.cos(p1) * math.sin(p2) - math.sin(p1) * math.cos(p2) * math.cos(dlng)
+            bearing = (math.degrees(math.atan2(y, x)) + 360.0) % 360.0
+            zone = -1
+            for i in order:
+                z = self.zones[i]
+                if dist <= z.radius_km and (z.bearing_width >= 360.0 or (bearing - z.bearing_start) % 360.0 <= z.bearing_width):
+                    zone = i
+            out["inside"].append(zone >= 0)
+            out["zone"].append(zone)
+            out["jarak_km"].append(round(dist, 3))
+            out["bearing"].append(round(bearing, 1))
+        return out
+
+    # -- output ------------------------------------------------------------
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "center": {"lat": self.center_lat, "lng": self.center_lng},
+            "level": self.level,
+            "report_id": self.report_id,
+            "source": self.source,
+            "max_radius_km": self.max_radius_km,
+            "zones": [{**asdict(z), "label": z.label()} for z in self.zones],
+        }
+
+    def to_geojson(self, segments: int = 64) -> Dict[str, Any]:
+        features = []
+        for i, z in enumerate(self.zones):
+            steps = max(4, int(segments * z.bearing_width / 360.0))
+            ring = [
+                _destination(self.center_lat, self.center_lng, z.bearing_start + z.bearing_width * s / steps, z.radius_km)
+                for s in range(steps + 1)
+            ]
+            if z.bearing_width < 360.0:
+                ring = [(self.center_lat, self.center_lng)] + ring + [(self.center_lat, self.center_lng)]
+            features.append(
+                {
+                    "type": "Feature",
+                    "properties": {"zone": i, "jenis": z.jenis, "radius_km": z.radius_km, "label": z.label()},
+                    "geometry": {"type": "Polygon", "coordinates": [[[lng, lat] for lat, lng in ring]]},
+                }
+            )
+        return {"type": "FeatureCollection", "features": features}
+
+
+def build_model(payload: Optional[Dict[str, Any]], version: int = 0) -> HazardModel:
+    payload = payload if isinstance(payload, dict) else {}
+    zones = parse_zones(payload.get("rekomendasi") or [])
+    source = "magma"
+    if not zones:
+        zones = parse_zones(payload.get("radius_info") or [])
+    if not zones:
+        zones = [HazardZone(jenis="radial", radius_km=HAZARD_DEFAULT_RADIUS_KM, teks="default")]
+        source = "default"
+    return HazardModel(
+        center_lat=SUMMIT_LAT,
+        center_lng=SUMMIT_LNG,
+        zones=zones,
+        level=payload.get("level"),
+        report_id=payload.get("report_id"),
+        source=source,
+        version=version,
+    )
+
+
+_model_lock = threading.Lock()
+_model: Optional[HazardModel] = None
+
+
+def current_model() -> HazardModel:
+    """Model dari cache MAGMA terakhir; di-parse ulang hanya kalau versi key AppKV berubah."""
+    global _model
+    payload, version = read_json_versioned(MAGMA_CACHE_KEY, None)
+    with _model_lock:
+        if _model is None or _model.version != version:
+            _model = build_model(payload, version)
+        return _model
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlmodel import Session
+
+from .db import engine
+from .geo_index import GEO_INDEX_ENABLED, posko_index
+from .hazard import current_model
+from .occupancy import occupancy_cache
+from .routing import evacuation_router
+from .storage import resource_version
+
+router = APIRouter(tags=["hazard"])
+logger = logging.getLogger("sinabung.geo")
+
+HAZARD_CLASSIFY_MAX_POINTS = int(os.environ.get("HAZARD_CLASSIFY_MAX_POINTS", "100000"))
+
+
+class HazardPoint(BaseModel):
+    lat: float
+    lng: float
+
+
+class HazardClassifyReq(BaseModel):
+    # Format kolom (lat[], lng[]) lebih hemat untuk batch besar; points[] untuk kemudahan.
+    lat: List[float] = Field(default_factory=list)
+    lng: List[float] = Field(default_factory=list)
+    points: List[HazardPoint] = Field(default_factory=list)
+
+
+def _load_posts() -> List[Dict[str, Any]]:
+    """Semua posko dari index geo; index dimatikan / gagal -> langsung dari DB."""
+    if GEO_INDEX_ENABLED:
+        try:
+            posko_index.refresh(resource_version("posko"))
+            return posko_index.items()
+        except Exception as e:
+            logger.warning("Posko geo index unavailable, loading from DB: %s: %s", type(e).__name__, e)
+    from .posko_api import load_public_posko
+
+    with Session(engine) as session:
+        rows = [row.model_dump(mode="json") for row in load_public_posko(session)]
+    return sorted(rows, key=lambda item: item["id"])
+
+
+@router.get("/hazard/zones")
+def hazard_zones(geojson: bool = Query(False, description="sertakan poligon GeoJSON untuk peta")) -> Dict[str, Any]:
+    """Zona bahaya terstruktur (radial + sektor) dari rekomendasi MAGMA terakhir."""
+    model = current_model()
+    body = model.to_dict()
+    if geojson:
+        body["geojson"] = model.to_geojson()
+    return body
+
+
+@router.post("/hazard/classify")
+def hazard_classify(payload: HazardClassifyReq) -> Dict[str, Any]:
+    lats = list(payload.lat) + [p.lat for p in payload.points]
+    lngs = list(payload.lng) + [p.lng for p in payload.points]
+    if len(payload.lat) != len(payload.lng):
+        raise HTTPException(status_code=422, detail="Panjang lat dan lng harus sama")
+    if len(lats) > HAZARD_CLASSIFY_MAX_POINTS:
+        raise HTTPException(status_code=413, detail=f"Maksimal {HAZARD_CLASSIFY_MAX_POINTS} titik per request")
+
+    model = current_model()
+    result = model.classify(lats, lngs)
+    return {
+        "count": len(lats),
+        "inside_count": sum(result["inside"]),
+        "level": model.level,
+        "report_id": model.report_id,
+        **result,
+    }
+
+
+@router.get("/hazard/posko")
+def hazard_posko(only_inside: Optional[bool] = Query(None)) -> Dict[str, Any]:
+    """Status semua posko terhadap zona bahaya aktif (satu evaluasi vektor untuk semua baris)."""
+    items = _load_posts()
+    model = current_model()
+    result = model.classify([p["lat"] for p in items], [p["lng"] for p in items])
+
+    rows = []
+    for i, item in enumerate(items):
+        zone = result["zone"][i]
+        if only_inside is not None and (zone >= 0) != only_inside:
+            continue
+        rows.append(
+            {
+                "id": item["id"],
+                "nama": item["nama"],
+                "lat": item["lat"],
+                "lng": item["lng"],
+                "kapasitas": item.get("kapasitas"),
+                "dalam_zona": zone >= 0,
+                "zona": model.zones[zone].label() if zone >= 0 else None,
+                "jarak_puncak_km": result["jarak_km"][i],
+                "bearing": result["bearing"][i],
+            }
+        )
+    return {"level": model.level, "report_id": model.report_id, "count": len(rows), "items": rows}
+
+
+@router.get("/evacuation/route")
+def evacuation_route(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    k: int = Query(3, ge=1, le=20),
+    orang: int = Query(1, ge=1, description="jumlah orang yang perlu ditampung"),
+    path: bool = Query(False, description="sertakan polyline rute (pusat sel grid)"),
+) -> Dict[str, Any]:
+    """
+    k posko terbaik dari lokasi user berdasarkan biaya tempuh di grid, tanpa posko
+    yang berada di zona bahaya aktif atau sudah penuh.
+    """
+    model = current_model()
+    posts = _load_posts()
+    evacuation_router.ensure((resource_version("posko"), model.signature()), posts, model)
+
+    _, terisi = occupancy_cache.snapshot()
+    user = model.classify([lat], [lng])
+    source, items = evacuation_router.best(lat, lng, k, orang=orang, with_path=path, terisi=terisi)
+    return {
+        "lat": lat,
+        "lng": lng,
+        "user_dalam_zona": user["inside"][0],
+        "level": model.level,
+        "source": source,
+        "items": items,
+        "dikecualikan": [{"id": p["id"], "nama": p["nama"], "alasan": p["alasan"]} for p in evacuation_router.excluded(terisi, orang)],
+    }
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from .kv_codec import orjson
+
+HTTP_CACHE_ENABLED = os.environ.get("HTTP_CACHE_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+# Cache-Control per resource. s-maxage untuk CDN di depan Koyeb, max-age untuk
+# klien; stale-while-revalidate membiarkan CDN menyajikan salinan lama sambil
+# revalidasi (If-None-Match -> 304 murah di sini).
+CACHE_POLICIES: Dict[str, str] = {
+    # Posko memuat okupansi live, jadi umurnya pendek.
+    "posko": "public, max-age=10, s-maxage=10, stale-while-revalidate=30",
+    "videos": "public, max-age=300, s-maxage=900, stale-while-revalidate=3600",
+    "emergency": "public, max-age=5, s-maxage=5, stale-while-revalidate=10",
+    "air": "public, max-age=15, s-maxage=15, stale-while-revalidate=60",
+    "dashboard": "public, max-age=30, s-maxage=60, stale-while-revalidate=300",
+    # Bundle ikut memuat status darurat, jadi umurnya mengikuti yang paling pendek.
+    "bundle": "public, max-age=5, s-maxage=5, stale-while-revalidate=30",
+}
+
+
+def make_etag(*parts: Any, weak: bool = False) -> str:
+    """
+    ETag dari identitas isi (nama resource + versi/hash). weak=True untuk body yang
+    setara secara makna tapi tidak identik per byte (mis. memuat umur data).
+    """
+    raw = repr(parts).encode("utf-8")
+    tag = '"' + hashlib.blake2b(raw, digest_size=16).hexdigest() + '"'
+    return "W/" + tag if weak else tag
+
+
+def body_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header or not HTTP_CACHE_ENABLED:
+        return False
+    if header.strip() == "*":
+        return True
+    # Perbandingan lemah sesuai RFC 9110 untuk If-None-Match (W/ diabaikan).
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def cache_headers(etag: str, policy: str) -> Dict[str, str]:
+    if not HTTP_CACHE_ENABLED:
+        return {"Cache-Control": "no-store"}
+    return {"ETag": etag, "Cache-Control": CACHE_POLICIES.get(policy, "no-cache")}
+
+
+def not_modified(etag: str, policy: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, policy))
+
+
+def dumps(content: Any) -> bytes:
+    content = jsonable_encoder(content)
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def cached_json(
+    request: Request,
+    policy: str,
+    etag: Optional[str],
+    build: Callable[[], Any],
+) -> Response:
+    """
+    Jawab 304 kalau If-None-Match cocok dengan `etag` (tanpa memanggil `build`),
+    selain itu serialisasi hasil `build()` dengan ETag + Cache-Control.
+    etag=None: ETag dihitung dari body (untuk data in-memory yang tidak punya versi).
+    """
+    if etag is not None and if_none_match(request, etag):
+        return not_modified(etag, policy)
+    return _json_response(request, policy, etag, build())
+
+
+async def cached_json_async(
+    request: Request,
+    policy: str,
+    etag: Optional[str],
+    build: Callable[[], Awaitable[Any]],
+) -> Response:
+    """cached_json() untuk handler async; `build` berupa coroutine function."""
+    if etag is not None and if_none_match(request, etag):
+        return not_modified(etag, policy)
+    return _json_response(request, policy, etag, await build())
+
+
+def _json_response(request: Request, policy: str, etag: Optional[str], content: Any) -> Response:
+    body = content if isinstance(content, bytes) else dumps(content)
+    if etag is None:
+        etag = body_etag(body)
+        if if_none_match(request, etag):
+            return not_modified(etag, policy)
+    return Response(content=body, media_type="application/json", headers=cache_headers(etag, policy))
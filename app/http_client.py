@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+
+from .config import env_flag
+
+logger = logging.getLogger("sinabung.http")
+
+USER_AGENT = "sinabung-alert-mvp/1.0"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+HTTP2_ENABLED = env_flag("HTTP2_ENABLED", "0") and _http2_available()
+# Kalau diisi, semua request keluar dijawab dari rekaman fixture (lihat app/http_replay.py).
+HTTP_REPLAY_DIR = os.environ.get("HTTP_REPLAY_DIR", "").strip()
+
+
+@dataclass(frozen=True)
+class UpstreamProfile:
+    timeout: float = 20.0
+    connect_timeout: float = 10.0
+    retries: int = 1
+    max_connections: int = 10
+    max_keepalive: int = 5
+    keepalive_expiry: float = 60.0
+    # Paksa IPv4 untuk host yang rute IPv6-nya bermasalah di sebagian cloud runtime.
+    force_ipv4: bool = False
+    http2: bool = False
+
+
+PROFILES: Dict[str, UpstreamProfile] = {
+    "magma": UpstreamProfile(
+        timeout=float(os.environ.get("MAGMA_HTTP_TIMEOUT_SECONDS", "20")),
+        retries=2,
+        max_connections=int(os.environ.get("MAGMA_HTTP_MAX_CONNECTIONS", "4")),
+        max_keepalive=2,
+        force_ipv4=env_flag("MAGMA_FORCE_IPV4", "1"),
+        http2=HTTP2_ENABLED,
+    ),
+    "bmkg": UpstreamProfile(
+        timeout=float(os.environ.get("BMKG_HTTP_TIMEOUT_SECONDS", "20")),
+        retries=1,
+        max_connections=int(os.environ.get("BMKG_HTTP_MAX_CONNECTIONS", "4")),
+        max_keepalive=2,
+        force_ipv4=env_flag("BMKG_FORCE_IPV4", "0"),
+        http2=HTTP2_ENABLED,
+    ),
+    "default": UpstreamProfile(http2=HTTP2_ENABLED),
+}
+
+
+class HttpClientRegistry:
+    """
+    Satu httpx.AsyncClient per upstream (MAGMA, BMKG, ...) untuk seluruh umur
+    aplikasi, supaya koneksi TCP/TLS dipakai ulang lewat keep-alive.
+    Dibuat saat startup dan ditutup saat shutdown di app/main.py; kalau belum
+    di-start (mis. dipanggil dari script), client dibuat saat pertama dipakai.
+    """
+
+    def __init__(self, profiles: Dict[str, UpstreamProfile]) -> None:
+        self.profiles = profiles
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        profile = self.profiles.get(name) or self.profiles["default"]
+        if HTTP_REPLAY_DIR:
+            from .http_replay import replay_transport
+
+            return httpx.AsyncClient(
+                timeout=httpx.Timeout(profile.timeout, connect=profile.connect_timeout),
+                headers={"User-Agent": USER_AGENT},
+                transport=replay_transport(HTTP_REPLAY_DIR),
+            )
+
+        transport_kwargs = {
+            "retries": profile.retries,
+            "http2": profile.http2,
+            "limits": httpx.Limits(
+                max_connections=profile.max_connections,
+                max_keepalive_connections=profile.max_keepalive,
+                keepalive_expiry=profile.keepalive_expiry,
+            ),
+        }
+        if profile.force_ipv4:
+            transport_kwargs["local_address"] = "0.0.0.0"
+
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(profile.timeout, connect=profile.connect_timeout),
+            headers={"User-Agent": USER_AGENT},
+            transport=httpx.AsyncHTTPTransport(**transport_kwargs),
+        )
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._build(name)
+            self._clients[name] = client
+        return client
+
+    async def start(self, names: Optional[list[str]] = None) -> None:
+        for name in names or list(self.profiles):
+            self.get(name)
+        logger.info("HTTP clients ready: %s (http2=%s)", ", ".join(sorted(self._clients)), HTTP2_ENABLED)
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("HTTP client close failed: %s: %s", type(e).__name__, e)
+
+
+http_clients = HttpClientRegistry(PROFILES)
+
+
+def get_http_client(name: str = "default") -> httpx.AsyncClient:
+    return http_clients.get(name)
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _route_key(url: str) -> Tuple[str, str]:
+    # Skema diabaikan supaya kandidat https/http menunjuk rekaman yang sama.
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return parts.netloc.lower(), path
+
+
+def load_manifest(directory: str | Path) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """
+    Baca manifest rekaman HTTP. Format manifest.json:
+      {"routes": [{"url": "...", "file": "magma/x.html", "status": 200, "headers": {...}}]}
+    """
+    base = Path(directory)
+    data = json.loads((base / MANIFEST_NAME).read_text(encoding="utf-8"))
+    routes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for route in data.get("routes", []):
+        entry = dict(route)
+        entry["path"] = base / route["file"]
+        routes[_route_key(route["url"])] = entry
+    return routes
+
+
+def replay_transport(directory: str | Path) -> httpx.MockTransport:
+    """
+    Transport httpx (sync dan async) yang menjawab dari fixture di disk,
+    tanpa akses jaringan. URL yang tidak direkam dijawab 404.
+    Mendukung If-None-Match terhadap header ETag rekaman.
+    """
+    routes = load_manifest(directory)
+    bodies: Dict[Tuple[str, str], bytes] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        key = _route_key(str(request.url))
+        route = routes.get(key)
+        if route is None:
+            return httpx.Response(404, text=f"replay: no fixture for {request.url}")
+
+        headers = dict(route.get("headers") or {})
+        etag = headers.get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304, headers=headers)
+
+        body = bodies.get(key)
+        if body is None:
+            body = route["path"].read_bytes()
+            bodies[key] = body
+        return httpx.Response(int(route.get("status", 200)), headers=headers, content=body)
+
+    return httpx.MockTransport(handler)
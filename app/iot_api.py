@@ -1,14 +1,24 @@
 from __future__ import annotations
 
+import json
 import logging
 import os
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field, ValidationError
+from starlette.concurrency import run_in_threadpool
 
-from .storage import read_json, write_json
+from . import air_history
+from .air_anomaly import anomaly_engine
+from .air_latest import latest_index, record_latest, update_device
+from .auth import require_admin
+from .broadcast import hub, publish
+from .http_cache import cached_json
+from .kv_codec import orjson
+from .models import AirDeviceUpdate
+from .storage import read_json, read_json_async, write_json
 
 router = APIRouter(tags=["iot"])
 logger = logging.getLogger("sinabung.iot")
@@ -23,6 +33,9 @@ IOT_MOCK_PM1 = float(os.environ.get("IOT_MOCK_PM1", "4"))
 IOT_MOCK_PM25 = float(os.environ.get("IOT_MOCK_PM25", "8"))
 IOT_MOCK_PM10 = float(os.environ.get("IOT_MOCK_PM10", "12"))
 IOT_MOCK_DEVICE_ID = os.environ.get("IOT_MOCK_DEVICE_ID", "virtual-air-sensor").strip() or "virtual-air-sensor"
+IOT_BATCH_MAX_ITEMS = int(os.environ.get("IOT_BATCH_MAX_ITEMS", "5000"))
+# Toleransi jam device yang kebablasan ke depan.
+IOT_MAX_CLOCK_SKEW_SECONDS = float(os.environ.get("IOT_MAX_CLOCK_SKEW_SECONDS", "300"))
 
 
 class AirPayload(BaseModel):
@@ -30,6 +43,7 @@ class AirPayload(BaseModel):
     pm10: Optional[float] = Field(None, description="PM10 ug/m3")
     pm1: Optional[float] = Field(None, description="PM1.0 ug/m3")
     device_id: Optional[str] = Field(None, description="ID device")
+    ts: Optional[datetime] = Field(None, description="Waktu pengukuran (ISO 8601); default waktu diterima server")
 
 
 def _default_state() -> Dict[str, Any]:
@@ -62,7 +76,14 @@ def _mock_state() -> Dict[str, Any]:
 
 
 def _load_state() -> Dict[str, Any]:
-    data = read_json(STATE_KEY, _default_state())
+    return _normalize_state(read_json(STATE_KEY, _default_state()))
+
+
+async def _load_state_async() -> Dict[str, Any]:
+    return _normalize_state(await read_json_async(STATE_KEY, _default_state()))
+
+
+def _normalize_state(data: Any) -> Dict[str, Any]:
     if not isinstance(data, dict):
         data = _default_state()
     data.setdefault("pm25", None)
@@ -99,8 +120,7 @@ def _check_api_key(request: Request) -> None:
         raise HTTPException(status_code=401, detail="Invalid IOT API key")
 
 
-def _resolve_state_for_read() -> Dict[str, Any]:
-    state = _load_state()
+def _resolve_state_for_read(state: Dict[str, Any]) -> Dict[str, Any]:
     should_use_mock = IOT_USE_MOCK and (state.get("is_mock") is True or state.get("pm25") is None)
     if should_use_mock:
         mock = _mock_state()
@@ -112,29 +132,275 @@ def _resolve_state_for_read() -> Dict[str, Any]:
 
 
 @router.get("/iot/air/latest")
-def air_latest() -> Dict[str, Any]:
-    return _resolve_state_for_read()
+async def air_latest(
+    request: Request,
+    device_id: Optional[str] = Query(None, description="Bacaan terakhir satu device"),
+    zona: Optional[str] = Query(None, description="Ringkasan satu zona"),
+) -> Response:
+    """
+    Tanpa filter: field lama (pm25, status, ...) diisi dari device terburuk,
+    plus `aggregate` (median, terburuk, per zona). Belum ada device -> state lama/mock.
+    """
+    # Polling DB (index device, state lama di AppKV) lewat jalur async dulu; setelah itu
+    # _air_latest_body hanya membaca memori. ETag dari hash body (aman lintas worker).
+    await latest_index.sync_async()
+    legacy = await _load_state_async() if latest_index.worst_state() is None else None
+    return cached_json(request, "air", None, lambda: _air_latest_body(device_id, zona, legacy))
+
+
+def air_latest_snapshot() -> Dict[str, Any]:
+    """Body /iot/air/latest tanpa filter, versi sync (dipakai offline bundle di threadpool)."""
+    latest_index.sync()
+    legacy = _load_state() if latest_index.worst_state() is None else None
+    return _air_latest_body(None, None, legacy)
+
+
+def _air_latest_body(
+    device_id: Optional[str],
+    zona: Optional[str],
+    legacy: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Index sudah di-sync oleh pemanggil; `legacy` = state lama kalau belum ada device."""
+    if device_id:
+        state = latest_index.get(device_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Device tidak ditemukan")
+        return state
+
+    summary = latest_index.summary()
+    if zona:
+        zone = summary["zones"].get(zona)
+        if zone is None:
+            raise HTTPException(status_code=404, detail="Zona tidak ditemukan")
+        return {"zona": zona, **zone, "items": latest_index.list(zona)}
+
+    worst = latest_index.worst_state()
+    if worst is None:
+        return _resolve_state_for_read(legacy if legacy is not None else _default_state())
+    return {**worst, "aggregate": summary}
+
+
+@router.get("/iot/air/anomalies")
+def air_anomalies(device_id: Optional[str] = Query(None)) -> Dict[str, Any]:
+    return anomaly_engine.snapshot(device_id)
+
+
+@router.get("/iot/devices")
+def air_devices(zona: Optional[str] = Query(None)) -> Dict[str, Any]:
+    latest_index.sync()
+    return {"items": latest_index.list(zona)}
+
+
+@router.put("/admin/iot/devices/{device_id}")
+def admin_upsert_air_device(
+    device_id: str,
+    payload: AirDeviceUpdate,
+    user: str = Depends(require_admin),
+) -> Dict[str, Any]:
+    return update_device(device_id, payload.model_dump(exclude_unset=True))
+
+
+def _reading_state(payload: AirPayload, ts: datetime) -> Dict[str, Any]:
+    status = _pm25_status(payload.pm25)
+    return {
+        "pm25": float(payload.pm25),
+        "pm10": float(payload.pm10) if payload.pm10 is not None else None,
+        "pm1": float(payload.pm1) if payload.pm1 is not None else None,
+        "status": status["status"],
+        "label": status["label"],
+        "updated_at": ts.isoformat(),
+        "device_id": payload.device_id or air_history.DEFAULT_DEVICE_ID,
+        "is_mock": False,
+        "source": "sensor",
+    }
+
+
+def _reading_ts(payload: AirPayload, now: datetime) -> datetime:
+    if payload.ts is None:
+        return now
+    ts = payload.ts.astimezone(timezone.utc) if payload.ts.tzinfo else payload.ts.replace(tzinfo=timezone.utc)
+    if (ts - now).total_seconds() > IOT_MAX_CLOCK_SKEW_SECONDS:
+        raise ValueError("ts di masa depan")
+    return ts
+
+
+def _is_newer(reading: Dict[str, Any], state: Dict[str, Any]) -> bool:
+    # Bacaan susulan (buffer sensor yang baru terkirim) tidak menimpa state yang lebih baru.
+    if state.get("source") != "sensor":
+        return True
+    try:
+        return datetime.fromisoformat(reading["updated_at"]) >= datetime.fromisoformat(state["updated_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
 
 
 @router.post("/iot/air")
 def air_ingest(payload: AirPayload, request: Request) -> Dict[str, Any]:
     _check_api_key(request)
 
-    status = _pm25_status(payload.pm25)
-    state = _load_state()
-    state.update(
-        {
-            "pm25": float(payload.pm25),
-            "pm10": float(payload.pm10) if payload.pm10 is not None else None,
-            "pm1": float(payload.pm1) if payload.pm1 is not None else None,
-            "status": status["status"],
-            "label": status["label"],
-            "updated_at": datetime.now(timezone.utc).isoformat(),
-            "device_id": payload.device_id,
-            "is_mock": False,
-            "source": "sensor",
-        }
-    )
-    _save_state(state)
+    try:
+        ts = _reading_ts(payload, datetime.now(timezone.utc))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    row = air_history.normalize_reading({**payload.model_dump(), "ts": ts})
+    try:
+        air_history.record_readings([row])
+    except Exception as e:
+        logger.warning("Air history write failed: %s: %s", type(e).__name__, e)
+    _observe_anomalies([row])
+
+    state = _reading_state(payload, ts)
+    _record_latest_and_publish([state])
     logger.info("Air quality updated pm25=%s status=%s", state["pm25"], state["status"])
     return {"ok": True, "status": state}
+
+
+def _observe_anomalies(rows: List[Dict[str, Any]]) -> None:
+    try:
+        anomaly_engine.observe_many(rows)
+    except Exception as e:
+        logger.warning("Air anomaly detection failed: %s: %s", type(e).__name__, e)
+
+
+def _air_status_key(summary: Dict[str, Any]) -> tuple:
+    return summary["status"], tuple((zone, z["status"]) for zone, z in summary["zones"].items())
+
+
+def _record_latest_and_publish(states: List[Dict[str, Any]]) -> None:
+    # Broadcast hanya kalau status agregat / status zona berubah, bukan tiap bacaan.
+    latest_index.sync()
+    before = _air_status_key(latest_index.summary())
+    record_latest(states)
+    summary = latest_index.summary()
+    if _air_status_key(summary) != before:
+        publish("air", summary)
+
+
+def check_silent_devices() -> None:
+    """Job scheduler: tandai sensor yang berhenti mengirim data."""
+    latest_index.sync()
+    anomaly_engine.check_silent(latest_index.list())
+
+
+def _loads(raw: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _parse_ndjson(body: bytes) -> List[Any]:
+    # Baris rusak tidak menggagalkan seluruh batch; dilaporkan di hasil per item.
+    items: List[Any] = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(_loads(line))
+        except ValueError as e:
+            items.append(ValueError(f"JSON tidak valid: {e}"))
+    return items
+
+
+def _parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    """Array JSON, objek {"readings": [...]}, atau NDJSON (satu objek per baris)."""
+    stripped = body.strip()
+    if not stripped:
+        return []
+    if "ndjson" in content_type or "jsonlines" in content_type or not stripped.startswith((b"[", b"{")):
+        return _parse_ndjson(stripped)
+    try:
+        data = _loads(stripped)
+    except ValueError:
+        if stripped.startswith(b"{"):
+            # `{...}\n{...}` tanpa Content-Type NDJSON.
+            return _parse_ndjson(stripped)
+        raise
+    if isinstance(data, dict):
+        data = data.get("readings", [data])
+    if not isinstance(data, list):
+        raise ValueError("body harus array JSON, {\"readings\": [...]}, atau NDJSON")
+    return data
+
+
+def _ingest_batch(items: List[Any]) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    results: List[Dict[str, Any]] = []
+    rows: List[Dict[str, Any]] = []
+    latest: Dict[Any, Dict[str, Any]] = {}
+
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            payload = AirPayload.model_validate(item)
+            ts = _reading_ts(payload, now)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors())
+            results.append({"index": index, "ok": False, "error": errors})
+            continue
+        except ValueError as e:
+            results.append({"index": index, "ok": False, "error": str(e)})
+            continue
+
+        row = air_history.normalize_reading({**payload.model_dump(), "ts": ts})
+        rows.append(row)
+        reading = _reading_state(payload, ts)
+        current = latest.get(reading["device_id"])
+        if current is None or _is_newer(reading, current):
+            latest[reading["device_id"]] = reading
+        results.append({"index": index, "ok": True, "device_id": row["device_id"], "status": reading["status"]})
+
+    if rows:
+        air_history.record_readings(rows)
+        _record_latest_and_publish(list(latest.values()))
+        _observe_anomalies(rows)
+
+    accepted = len(rows)
+    logger.info("Air batch ingested accepted=%s rejected=%s devices=%s", accepted, len(items) - accepted, len(latest))
+    return {
+        "ok": accepted == len(items),
+        "accepted": accepted,
+        "rejected": len(items) - accepted,
+        "results": results,
+    }
+
+
+@router.post("/iot/air/batch")
+async def air_ingest_batch(request: Request) -> Dict[str, Any]:
+    """
+    Ingest banyak bacaan sekaligus (bisa dari banyak device): array JSON atau NDJSON.
+    Semua bacaan valid ditulis dengan satu INSERT multi-row; state "latest"
+    diperbarui sekali per batch. Hasil per item dikembalikan sesuai urutan input.
+    """
+    _check_api_key(request)
+    body = await request.body()
+    try:
+        items = _parse_batch_body(body, request.headers.get("content-type", "").lower())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Body batch tidak valid: {e}")
+    if len(items) > IOT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Maksimal {IOT_BATCH_MAX_ITEMS} bacaan per batch")
+    return await run_in_threadpool(_ingest_batch, items)
+
+
+@router.get("/iot/air/history")
+def air_history_range(
+    device_id: Optional[str] = Query(None, description="ID device; kosong = gabungan semua device"),
+    start: Optional[datetime] = Query(None, description="ISO 8601, default 24 jam terakhir"),
+    end: Optional[datetime] = Query(None, description="ISO 8601, default sekarang"),
+    step: Optional[str] = Query(None, description="Lebar bucket: 30s, 5m, 1h, 1d (default otomatis)"),
+) -> Dict[str, Any]:
+    end = end or datetime.now(timezone.utc)
+    start = start or (end - timedelta(hours=24))
+    try:
+        return air_history.query_history(device_id, start, end, air_history.parse_step(step))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _air_snapshot() -> Dict[str, Any]:
+    latest_index.sync()
+    return latest_index.summary()
+
+
+hub.snapshot_loaders["air"] = _air_snapshot
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import os
+from typing import Any
+
+logger = logging.getLogger("sinabung.storage")
+
+try:
+    import orjson
+except Exception:  # pragma: no cover - opsional
+    orjson = None
+
+try:
+    import msgpack
+except Exception:  # pragma: no cover - opsional
+    msgpack = None
+
+# Prefix untuk nilai biner di kolom teks AppKV.value_json. Bukan awalan JSON
+# yang valid, jadi baris JSON lama (termasuk yang ber-indent) tetap terbaca.
+MSGPACK_PREFIX = "~mp1:"
+
+
+def _json_dumps(data: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # orjson menolak mis. int > 64-bit; stdlib masih bisa.
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _msgpack_dumps(data: Any) -> str:
+    packed = msgpack.packb(data, use_bin_type=True)
+    return MSGPACK_PREFIX + base64.b64encode(packed).decode("ascii")
+
+
+def _msgpack_loads(text: str) -> Any:
+    if msgpack is None:
+        raise RuntimeError("Nilai AppKV memakai msgpack, tapi paket msgpack tidak terpasang.")
+    return msgpack.unpackb(base64.b64decode(text[len(MSGPACK_PREFIX):]), raw=False)
+
+
+CODECS = {
+    "json": _json_dumps,
+    "msgpack": _msgpack_dumps,
+}
+
+
+def _selected_codec() -> str:
+    name = os.getenv("KV_CODEC", "json").strip().lower() or "json"
+    if name == "msgpack" and msgpack is None:
+        logger.warning("KV_CODEC=msgpack tapi paket msgpack tidak terpasang; pakai json.")
+        return "json"
+    if name not in CODECS:
+        logger.warning("KV_CODEC=%s tidak dikenal; pakai json.", name)
+        return "json"
+    return name
+
+
+KV_CODEC = _selected_codec()
+
+
+def encode(data: Any, codec: str | None = None) -> str:
+    """Serialisasi nilai AppKV dengan codec aktif (default: JSON ringkas)."""
+    return CODECS[codec or KV_CODEC](data)
+
+
+def decode(text: str) -> Any:
+    """Decode nilai AppKV dari format apa pun yang pernah ditulis (JSON lama ber-indent, JSON ringkas, msgpack)."""
+    if text.startswith(MSGPACK_PREFIX):
+        return _msgpack_loads(text)
+    return _json_loads(text)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select, tuple_
+
+from .db import fetch_all
+
+# Ukuran halaman daftar posko/video kalau klien memakai paging (?cursor/?fields/?bbox tanpa ?limit).
+# Request tanpa parameter apa pun tetap mendapat daftar penuh seperti sebelum ada paging.
+LIST_DEFAULT_LIMIT = int(os.environ.get("LIST_DEFAULT_LIMIT", "100"))
+LIST_MAX_LIMIT = int(os.environ.get("LIST_MAX_LIMIT", "500"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+# ---------------- CURSOR ----------------
+
+def encode_cursor(created_at: datetime, item_id: str) -> str:
+    """Cursor opaque = posisi (created_at, id) baris terakhir di halaman."""
+    raw = json.dumps([created_at.isoformat(), item_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, item_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor tidak valid")
+
+
+# ---------------- FIELDS / BBOX ----------------
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """`fields=id,nama,lat` -> list kolom (urutan dipertahankan). None = semua kolom."""
+    if fields is None or not fields.strip():
+        return None
+    allowed = set(allowed)
+    wanted: List[str] = []
+    for name in fields.split(","):
+        name = name.strip()
+        if not name or name in wanted:
+            continue
+        if name not in allowed:
+            raise HTTPException(status_code=400, detail=f"Field tidak dikenal: {name}")
+        wanted.append(name)
+    return wanted or None
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """`bbox=minLng,minLat,maxLng,maxLat` (urutan GeoJSON)."""
+    if bbox is None or not bbox.strip():
+        return None
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox harus minLng,minLat,maxLng,maxLat")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+        raise HTTPException(status_code=400, detail="bbox di luar rentang atau min > max")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+# ---------------- QUERY ----------------
+
+async def keyset_page(
+    model: Any,
+    columns: Sequence[str],
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+    where: Sequence[Any] = (),
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Satu halaman terurut (created_at desc, id desc) dengan keyset pagination:
+    WHERE (created_at, id) < cursor memakai index (created_at, id), jadi biaya
+    halaman ke-n sama dengan halaman pertama (tanpa OFFSET). Hanya `columns`
+    yang di-SELECT. limit=None: semua baris tanpa LIMIT.
+    Return (baris sebagai dict, cursor halaman berikutnya / None).
+    Query lewat fetch_all(): engine async kalau aktif, selain itu threadpool.
+    """
+    names = list(dict.fromkeys([*columns, "id", "created_at"]))
+    table = model.__table__
+    query = select(*[table.c[name] for name in names])
+    for clause in where:
+        query = query.where(clause)
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = query.where(tuple_(table.c.created_at, table.c.id) < tuple_(created_at, item_id))
+    query = query.order_by(table.c.created_at.desc(), table.c.id.desc())
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    rows = [dict(zip(names, row)) for row in await fetch_all(query)]
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+def resolve_limit(limit: Optional[int], *params: Optional[str]) -> Optional[int]:
+    """
+    None = daftar penuh (klien lama tidak mengirim limit/cursor/fields/bbox dan tidak
+    membaca X-Next-Cursor, jadi jangan dipotong diam-diam). Selain itu ukuran halaman.
+    """
+    if limit is None:
+        if all(param is None for param in params):
+            return None
+        return LIST_DEFAULT_LIMIT
+    return max(1, min(limit, LIST_MAX_LIMIT))
+
+
+def project(row: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return row
+    return {name: row.get(name) for name in fields}
+
+
+def page_headers(response: Response, request: Request, next_cursor: Optional[str]) -> Response:
+    """Cursor berikutnya di header supaya body tetap berupa list (kompatibel dengan klien lama)."""
+    if next_cursor is not None and response.status_code == 200:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
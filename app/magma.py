@@ -1,18 +1,73 @@
 from __future__ import annotations
 
+import asyncio
+import copy
+import hashlib
+import logging
+import os
 import re
-from typing import Iterable
-from urllib.parse import urljoin
+from typing import Any, Callable, Dict, Iterable, Optional
+from urllib.parse import urlsplit
 
 import httpx
-from bs4 import BeautifulSoup
 
+from .http_client import get_http_client
+from .magma_parsers import get_backend
+from .singleflight import SingleFlight
+from .storage import read_json_async, write_json_async
 
-def _extract_report_id(report_url: str) -> str | None:
+logger = logging.getLogger("sinabung.magma")
+
+# Hasil fetch dibagi ke semua pemanggil yang bersamaan; cache singkat supaya
+# lonjakan klien tidak menambah beban ke MAGMA.
+MAGMA_TINGKAT_CACHE_TTL = float(os.environ.get("MAGMA_TINGKAT_CACHE_TTL_SECONDS", "30"))
+MAGMA_REPORT_CACHE_TTL = float(os.environ.get("MAGMA_REPORT_CACHE_TTL_SECONDS", "300"))
+UPSTREAM_NEGATIVE_TTL = float(os.environ.get("UPSTREAM_NEGATIVE_TTL_SECONDS", "10"))
+
+# Hedged request: kandidat berikutnya dijalankan kalau kandidat sebelumnya belum
+# selesai dalam delay ini. 0 = semua kandidat langsung paralel, <0 = berurutan.
+MAGMA_HEDGE_DELAY = float(os.environ.get("MAGMA_HEDGE_DELAY_SECONDS", "2"))
+# Base URL Cloudflare worker di magma-proxy-worker/, mis. https://magma-proxy.example.workers.dev
+MAGMA_PROXY_URL = os.environ.get("MAGMA_PROXY_URL", "").strip().rstrip("/")
+
+# host asal -> origin kandidat yang terakhir menang (dicoba pertama di poll berikutnya).
+_preferred_origin: Dict[str, str] = {}
+
+flights = SingleFlight(negative_ttl=UPSTREAM_NEGATIVE_TTL)
+
+# Validator HTTP (ETag/Last-Modified) + hash body per URL, disimpan di AppKV
+# supaya poll berikutnya bisa pakai conditional GET dan melewati parsing.
+HTTP_CACHE_KEY = "magma_http_cache"
+HTTP_CACHE_MAX_URLS = 20
+_http_cache: Optional[Dict[str, Dict[str, Any]]] = None
+
+
+def extract_report_id(report_url: str) -> str | None:
     m = re.search(r"/laporan/(\d+)", report_url)
     return m.group(1) if m else None
 
 
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _with_proxy_and_preference(urls: list[str]) -> list[str]:
+    if not urls:
+        return urls
+    base = urls[0]
+    if MAGMA_PROXY_URL:
+        parts = urlsplit(base)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        urls.append(MAGMA_PROXY_URL + path)
+    urls = list(dict.fromkeys(urls))
+
+    preferred = _preferred_origin.get(urlsplit(base).netloc)
+    if preferred:
+        urls.sort(key=lambda u: 0 if _origin(u) == preferred else 1)
+    return urls
+
+
 def _candidate_tingkat_urls(tingkat_url: str) -> list[str]:
     base = (tingkat_url or "").strip()
     if not base:
@@ -20,7 +75,7 @@ def _candidate_tingkat_urls(tingkat_url: str) -> list[str]:
     urls = [base]
     if base.startswith("https://"):
         urls.append("http://" + base.removeprefix("https://"))
-    return list(dict.fromkeys(urls))
+    return _with_proxy_and_preference(list(dict.fromkeys(urls)))
 
 
 def _candidate_report_urls(report_url: str) -> list[str]:
@@ -30,30 +85,146 @@ def _candidate_report_urls(report_url: str) -> list[str]:
     urls = [base]
     if base.startswith("https://"):
         urls.append("http://" + base.removeprefix("https://"))
-    return list(dict.fromkeys(urls))
+    return _with_proxy_and_preference(list(dict.fromkeys(urls)))
+
+
+async def _load_http_cache() -> Dict[str, Dict[str, Any]]:
+    global _http_cache
+    if _http_cache is None:
+        try:
+            data = await read_json_async(HTTP_CACHE_KEY, {})
+        except Exception:
+            data = {}
+        _http_cache = data if isinstance(data, dict) else {}
+    return _http_cache
+
+
+async def _save_http_cache(url: str, record: Dict[str, Any]) -> None:
+    # Dipanggil dari coroutine fetch: tulis DB lewat jalur async/threadpool, bukan di event loop.
+    # Blob kecil (maks HTTP_CACHE_MAX_URLS) dan hanya ditulis kalau halaman berubah.
+    cache = await _load_http_cache()
+    cache.pop(url, None)
+    cache[url] = record
+    while len(cache) > HTTP_CACHE_MAX_URLS:
+        cache.pop(next(iter(cache)))
+    try:
+        await write_json_async(HTTP_CACHE_KEY, dict(cache))
+    except Exception as e:
+        logger.warning("Failed to persist MAGMA HTTP cache: %s: %s", type(e).__name__, e)
+
+
+def _conditional_headers(record: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    if not record or "parsed" not in record:
+        return {}
+    headers: Dict[str, str] = {}
+    if record.get("etag"):
+        headers["If-None-Match"] = record["etag"]
+    if record.get("last_modified"):
+        headers["If-Modified-Since"] = record["last_modified"]
+    return headers
+
+
+async def _get_one(
+    client: httpx.AsyncClient,
+    url: str,
+    timeout: float | None,
+    headers: Optional[Dict[str, str]],
+) -> httpx.Response:
+    if timeout is None:
+        resp = await client.get(url, headers=headers)
+    else:
+        resp = await client.get(url, headers=headers, timeout=timeout)
+    if resp.status_code == 304 and headers:
+        return resp
+    resp.raise_for_status()
+    return resp
 
 
-async def _get_with_fallback(urls: Iterable[str], timeout: float = 20.0) -> httpx.Response:
+async def _get_with_fallback(
+    urls: Iterable[str],
+    timeout: float | None = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> httpx.Response:
+    """
+    Coba kandidat URL secara hedged: kandidat berikutnya diluncurkan setelah
+    MAGMA_HEDGE_DELAY detik (atau segera kalau kandidat sebelumnya gagal),
+    respons sukses pertama dipakai dan sisanya dibatalkan.
+    """
+    urls = list(urls)
     errors: list[str] = []
-    async with httpx.AsyncClient(
-        timeout=timeout,
-        # Force IPv4 to avoid broken IPv6 routes in some cloud runtimes.
-        transport=httpx.AsyncHTTPTransport(retries=2, local_address="0.0.0.0"),
-    ) as client:
-        for url in urls:
-            try:
-                resp = await client.get(
-                    url,
-                    headers={"User-Agent": "sinabung-alert-mvp/1.0"},
-                )
-                resp.raise_for_status()
-                return resp
-            except httpx.HTTPError as e:
-                errors.append(f"{url}: {type(e).__name__}")
-                continue
+    client = get_http_client("magma")
+    remaining = list(urls)
+    pending: set[asyncio.Task] = set()
+    task_urls: Dict[asyncio.Task, str] = {}
+
+    try:
+        while remaining or pending:
+            if remaining:
+                url = remaining.pop(0)
+                task = asyncio.ensure_future(_get_one(client, url, timeout, headers))
+                task_urls[task] = url
+                pending.add(task)
+
+            if remaining and MAGMA_HEDGE_DELAY >= 0:
+                wait_timeout: float | None = MAGMA_HEDGE_DELAY
+            else:
+                wait_timeout = None
+            done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                url = task_urls[task]
+                error = task.exception()
+                if error is None:
+                    if len(urls) > 1:
+                        _preferred_origin[urlsplit(urls[0]).netloc] = _origin(url)
+                    return task.result()
+                if not isinstance(error, httpx.HTTPError):
+                    raise error
+                errors.append(f"{url}: {type(error).__name__}")
+    finally:
+        for task in pending:
+            task.cancel()
+        # Task lain yang selesai di batch yang sama tapi tidak sempat diperiksa:
+        # ambil exception-nya supaya tidak muncul "exception was never retrieved".
+        for task in task_urls:
+            if task.done() and not task.cancelled():
+                task.exception()
+
     raise httpx.ConnectError(f"MAGMA request failed on all candidates: {', '.join(errors)}")
 
 
+async def _fetch_parsed(key: str, urls: list[str], parse: Callable[[str], Any]) -> Any:
+    """
+    GET halaman MAGMA dengan conditional request. Kalau server menjawab 304
+    atau hash body sama dengan parse terakhir, hasil parse lama dipakai ulang
+    tanpa menjalankan parser.
+    """
+    record = (await _load_http_cache()).get(key)
+    resp = await _get_with_fallback(urls, headers=_conditional_headers(record))
+
+    if resp.status_code == 304 and record is not None:
+        logger.debug("MAGMA 304 Not Modified: %s", key)
+        return copy.deepcopy(record["parsed"])
+
+    body_hash = hashlib.sha256(resp.content).hexdigest()
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+
+    if record is not None and "parsed" in record and record.get("body_hash") == body_hash:
+        logger.debug("MAGMA body unchanged, skip parse: %s", key)
+        parsed = record["parsed"]
+        if record.get("etag") != etag or record.get("last_modified") != last_modified:
+            await _save_http_cache(key, {**record, "etag": etag, "last_modified": last_modified})
+        return copy.deepcopy(parsed)
+
+    parsed = parse(resp.text)
+    await _save_http_cache(
+        key,
+        {"etag": etag, "last_modified": last_modified, "body_hash": body_hash, "parsed": parsed},
+    )
+    return copy.deepcopy(parsed)
+
+
 async def get_latest_sinabung_report_url(tingkat_url: str) -> str:
     """
     Ambil URL laporan terbaru Sinabung dari halaman 'Tingkat Aktivitas' MAGMA.
@@ -63,23 +234,19 @@ async def get_latest_sinabung_report_url(tingkat_url: str) -> str:
     if not tingkat_url:
         raise ValueError("tingkat_url kosong")
 
-    resp = await _get_with_fallback(_candidate_tingkat_urls(tingkat_url), timeout=20)
-
-    soup = BeautifulSoup(resp.text, "html.parser")
+    return await flights.do(
+        ("magma:tingkat", tingkat_url),
+        lambda: _fetch_parsed(
+            tingkat_url,
+            _candidate_tingkat_urls(tingkat_url),
+            lambda html: _parse_tingkat(html, tingkat_url),
+        ),
+        ttl=MAGMA_TINGKAT_CACHE_TTL,
+    )
 
-    # Cari node teks yang mengandung "Sinabung", lalu cari link laporan di container terdekat.
-    candidates = soup.find_all(string=re.compile(r"\bSinabung\b", re.IGNORECASE))
-    for text_node in candidates:
-        parent = getattr(text_node, "parent", None)
-        if parent is None:
-            continue
 
-        container = parent.find_parent(["li", "tr", "div", "p"]) or parent
-        a = container.find("a", href=re.compile(r"/v1/gunung-api/laporan/"))
-        if a and a.get("href"):
-            return urljoin(tingkat_url, a["href"])
-
-    raise RuntimeError("Tidak menemukan link laporan Sinabung di halaman Tingkat Aktivitas.")
+def _parse_tingkat(html: str, tingkat_url: str) -> str:
+    return get_backend().find_report_url(html, tingkat_url)
 
 
 async def fetch_report_detail(report_url: str) -> dict:
@@ -93,40 +260,17 @@ async def fetch_report_detail(report_url: str) -> dict:
     if not report_url:
         raise ValueError("report_url kosong")
 
-    resp = await _get_with_fallback(_candidate_report_urls(report_url), timeout=20)
-
-    soup = BeautifulSoup(resp.text, "html.parser")
-    text = soup.get_text("\n", strip=True)
-
-    # Heuristik level
-    m_level = re.search(r"(Level\s+[IV]+\s*\([^)]+\))", text)
-    level = m_level.group(1) if m_level else None
-
-    # Judul ringkas (sering memuat periode)
-    title_line = None
-    for line in text.split("\n"):
-        if "Sinabung" in line and "periode" in line:
-            title_line = line
-            break
-
-    # Rekomendasi: ambil beberapa baris setelah kata 'Rekomendasi'
-    rekomendasi: list[str] = []
-    if "Rekomendasi" in text:
-        after = text.split("Rekomendasi", 1)[1]
-        for line in after.split("\n"):
-            line = line.strip()
-            if not line:
-                continue
-            if "Copyright" in line:
-                break
-            rekomendasi.append(line)
-            if len(rekomendasi) >= 10:
-                break
-
+    detail = await flights.do(
+        ("magma:report", report_url),
+        lambda: _fetch_parsed(report_url, _candidate_report_urls(report_url), _parse_report),
+        ttl=MAGMA_REPORT_CACHE_TTL,
+    )
     return {
         "report_url": report_url,
-        "report_id": _extract_report_id(report_url),
-        "level": level,
-        "title": title_line,
-        "rekomendasi": rekomendasi,
+        "report_id": extract_report_id(report_url),
+        **copy.deepcopy(detail),
     }
+
+
+def _parse_report(html: str) -> dict:
+    return get_backend().parse_report(html)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+from urllib.parse import urljoin
+
+logger = logging.getLogger("sinabung.magma")
+
+try:
+    from bs4 import BeautifulSoup
+except Exception:  # pragma: no cover - tergantung environment
+    BeautifulSoup = None
+
+try:
+    from lxml import etree, html as lxml_html
+except Exception:  # pragma: no cover - tergantung environment
+    etree = None
+    lxml_html = None
+
+SINABUNG_RE = re.compile(r"\bSinabung\b", re.IGNORECASE)
+REPORT_HREF_RE = re.compile(r"/v1/gunung-api/laporan/")
+LEVEL_RE = re.compile(r"(Level\s+[IV]+\s*\([^)]+\))")
+CONTAINER_TAGS = ("li", "tr", "div", "p")
+MAX_REKOMENDASI = 10
+
+# Teks di dalam tag ini tidak ikut get_text() BeautifulSoup, jadi ikut dilewati juga di lxml.
+_SKIP_TEXT_TAGS = {"script", "style", "template"}
+
+
+@dataclass(frozen=True)
+class ParserBackend:
+    name: str
+    find_report_url: Callable[[str, str], str]
+    parse_report: Callable[[str], dict]
+
+
+def _not_found() -> RuntimeError:
+    return RuntimeError("Tidak menemukan link laporan Sinabung di halaman Tingkat Aktivitas.")
+
+
+def _summarize_lines(lines: Iterator[str]) -> dict:
+    """
+    Ambil level/title/rekomendasi dari baris-baris teks halaman laporan.
+    Sama dengan heuristik lama di atas get_text("\\n", strip=True), tapi berhenti
+    begitu blok Rekomendasi selesai dan level + title sudah ketemu.
+    """
+    level: Optional[str] = None
+    title_line: Optional[str] = None
+    rekomendasi: list[str] = []
+    in_rekom = False
+    rekom_done = False
+    # Beberapa baris terakhir untuk regex level yang bisa terpotong antar node teks.
+    window: list[str] = []
+
+    for chunk in lines:
+        for line in chunk.split("\n"):
+            if level is None:
+                window.append(line)
+                if len(window) > 4:
+                    window.pop(0)
+                m_level = LEVEL_RE.search("\n".join(window))
+                if m_level:
+                    level = m_level.group(1)
+
+            if title_line is None and "Sinabung" in line and "periode" in line:
+                title_line = line
+
+            if in_rekom and not rekom_done:
+                stripped = line.strip()
+                if stripped:
+                    if "Copyright" in stripped:
+                        rekom_done = True
+                    else:
+                        rekomendasi.append(stripped)
+                        if len(rekomendasi) >= MAX_REKOMENDASI:
+                            rekom_done = True
+            elif not in_rekom and "Rekomendasi" in line:
+                in_rekom = True
+                after = line.split("Rekomendasi", 1)[1].strip()
+                if after:
+                    if "Copyright" in after:
+                        rekom_done = True
+                    else:
+                        rekomendasi.append(after)
+
+        if rekom_done and level is not None and title_line is not None:
+            break
+
+    return {"level": level, "title": title_line, "rekomendasi": rekomendasi}
+
+
+# ---------------------------------------------------------------------------
+# BeautifulSoup (fallback, perilaku asli)
+# ---------------------------------------------------------------------------
+def _bs4_find_report_url(page: str, base_url: str) -> str:
+    soup = BeautifulSoup(page, "html.parser")
+
+    # Cari node teks yang mengandung "Sinabung", lalu cari link laporan di container terdekat.
+    candidates = soup.find_all(string=SINABUNG_RE)
+    for text_node in candidates:
+        parent = getattr(text_node, "parent", None)
+        if parent is None:
+            continue
+
+        container = parent.find_parent(list(CONTAINER_TAGS)) or parent
+        a = container.find("a", href=REPORT_HREF_RE)
+        if a and a.get("href"):
+            return urljoin(base_url, a["href"])
+
+    raise _not_found()
+
+
+def _bs4_parse_report(page: str) -> dict:
+    soup = BeautifulSoup(page, "html.parser")
+    text = soup.get_text("\n", strip=True)
+    return _summarize_lines(iter([text]))
+
+
+# ---------------------------------------------------------------------------
+# lxml (XPath + ekstraksi teks bertahap)
+# ---------------------------------------------------------------------------
+def _lxml_root(page: str):
+    return lxml_html.document_fromstring(page.encode("utf-8"))
+
+
+def _lxml_find_report_url(page: str, base_url: str) -> str:
+    root = _lxml_root(page)
+    # XPath menyaring kasar di C; regex word-boundary dicek di Python hanya untuk hasilnya.
+    texts = root.xpath(
+        "//text()[contains(translate(., 'SINABUNG', 'sinabung'), 'sinabung')]"
+        "[not(ancestor::script) and not(ancestor::style) and not(ancestor::template)]"
+    )
+    for text in texts:
+        if not SINABUNG_RE.search(text):
+            continue
+        parent = text.getparent()
+        if parent is None:
+            continue
+        if text.is_tail:
+            parent = parent.getparent()
+            if parent is None:
+                continue
+
+        container = next(
+            (el for el in parent.iterancestors() if el.tag in CONTAINER_TAGS),
+            parent,
+        )
+        for a in container.iterdescendants("a"):
+            href = a.get("href")
+            if href and REPORT_HREF_RE.search(href):
+                return urljoin(base_url, href)
+
+    raise _not_found()
+
+
+def _lxml_iter_text(root) -> Iterator[str]:
+    skip_depth = 0
+    for event, el in etree.iterwalk(root, events=("start", "end")):
+        is_element = isinstance(el.tag, str)
+        if event == "start":
+            if is_element and el.tag in _SKIP_TEXT_TAGS:
+                skip_depth += 1
+            elif skip_depth == 0 and is_element and el.text:
+                text = el.text.strip()
+                if text:
+                    yield text
+        else:
+            if is_element and el.tag in _SKIP_TEXT_TAGS:
+                skip_depth -= 1
+            if skip_depth == 0 and el.tail and el is not root:
+                text = el.tail.strip()
+                if text:
+                    yield text
+
+
+def _lxml_parse_report(page: str) -> dict:
+    return _summarize_lines(_lxml_iter_text(_lxml_root(page)))
+
+
+# ---------------------------------------------------------------------------
+# Registry
+# ---------------------------------------------------------------------------
+BACKENDS: Dict[str, ParserBackend] = {}
+if lxml_html is not None:
+    BACKENDS["lxml"] = ParserBackend("lxml", _lxml_find_report_url, _lxml_parse_report)
+if BeautifulSoup is not None:
+    BACKENDS["bs4"] = ParserBackend("bs4", _bs4_find_report_url, _bs4_parse_report)
+
+
+def get_backend(name: Optional[str] = None) -> ParserBackend:
+    """
+    Pilih backend parser MAGMA. Default dari env MAGMA_PARSER:
+    'lxml', 'bs4', atau 'auto' (lxml kalau terpasang, selain itu bs4).
+    """
+    wanted = (name or os.environ.get("MAGMA_PARSER", "auto")).strip().lower() or "auto"
+    if wanted == "auto":
+        for candidate in ("lxml", "bs4"):
+            if candidate in BACKENDS:
+                return BACKENDS[candidate]
+    elif wanted in BACKENDS:
+        return BACKENDS[wanted]
+    elif BACKENDS:
+        fallback = "bs4" if "bs4" in BACKENDS else next(iter(BACKENDS))
+        logger.warning("MAGMA_PARSER=%s tidak tersedia, pakai %s.", wanted, fallback)
+        return BACKENDS[fallback]
+    raise RuntimeError("Tidak ada parser HTML MAGMA (pasang lxml atau beautifulsoup4).")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import os
 import logging
 import re
@@ -7,14 +8,18 @@ from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Optional
 
 
-import httpx
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
 from .admin_auth import require_admin
-from .db import init_db
-from .storage import read_json, write_json
+from .broadcast import hub, publish
+from .bundle import offline_bundle
+from .dashboard import DashboardSnapshot
+from .db import async_engine, dispose_async_engine, init_db
+from .http_cache import cached_json, make_etag
+from .http_client import http_clients
+from .storage import kv_cache_stats, read_json, write_json
 
 # -----------------------------------------------------------------------------
 # Logging
@@ -84,6 +89,27 @@ try:
 except Exception as e:
     logger.warning("Emergency routes not enabled: %s: %s", type(e).__name__, e)
 
+try:
+    from .events_api import router as events_router
+    app.include_router(events_router)
+    logger.info("Event stream routes enabled.")
+except Exception as e:
+    logger.warning("Event stream routes not enabled: %s: %s", type(e).__name__, e)
+
+try:
+    from .hazard_api import router as hazard_router
+    app.include_router(hazard_router)
+    logger.info("Hazard zone routes enabled.")
+except Exception as e:
+    logger.warning("Hazard zone routes not enabled: %s: %s", type(e).__name__, e)
+
+try:
+    from .sync_api import router as sync_router
+    app.include_router(sync_router)
+    logger.info("Sync routes enabled.")
+except Exception as e:
+    logger.warning("Sync routes not enabled: %s: %s", type(e).__name__, e)
+
 try:
     from .admin_auth_api import router as admin_auth_router
     app.include_router(admin_auth_router)
@@ -97,16 +123,25 @@ except Exception as e:
 FEATURES_ERROR: Optional[str] = None
 DEFAULT_MAGMA_TINGKAT_URL = "https://magma.esdm.go.id/v1/gunung-api/tingkat-aktivitas"
 MAGMA_CACHE_KEY = "magma_latest_cache"
+DASHBOARD_MAGMA_REFRESH_SECONDS = max(30, int(os.environ.get("DASHBOARD_MAGMA_REFRESH_SECONDS", "300")))
+DASHBOARD_BMKG_REFRESH_SECONDS = max(10, int(os.environ.get("DASHBOARD_BMKG_REFRESH_SECONDS", "60")))
+dashboard_snapshot = DashboardSnapshot(
+    max_age_seconds={
+        "volcano": DASHBOARD_MAGMA_REFRESH_SECONDS * 3,
+        "earthquake": DASHBOARD_BMKG_REFRESH_SECONDS * 3,
+    }
+)
 scheduler = None
 get_latest_sinabung_report_url = None
 fetch_report_detail = None
+extract_report_id = None
 send_to_topic = None
 load_state = None
 save_state = None
 
 try:
     from apscheduler.schedulers.asyncio import AsyncIOScheduler
-    from .magma import get_latest_sinabung_report_url, fetch_report_detail
+    from .magma import extract_report_id, fetch_report_detail, get_latest_sinabung_report_url
     from .notifier import send_to_topic
     from .state import load_state, save_state
 
@@ -239,6 +274,8 @@ def root() -> Dict[str, Any]:
         "dashboard": "/sinabung/dashboard",
         # public:
         "posko_public": "/evacuation/posts",
+        "posko_checkin": "/evacuation/posts/{posko_id}/checkin (POST)",
+        "posko_checkout": "/evacuation/posts/{posko_id}/checkout (POST)",
         "education_public": "/education/videos",
         "emergency_status": "/emergency/status",
         "air_quality_latest": "/iot/air/latest",
@@ -252,6 +289,9 @@ def root() -> Dict[str, Any]:
         # admin CRUD:
         "posko_admin": "/admin/posts (GET/POST)",
         "posko_admin_by_id": "/admin/posts/{posko_id} (PUT/DELETE)",
+        "posko_admin_occupancy": "/admin/posts/{posko_id}/occupancy (PUT)",
+        "posko_admin_import": "/admin/posts/import (POST csv/geojson/geojsonseq/legacy)",
+        "posko_admin_export": "/admin/posts/export?format=csv|geojson (GET)",
         "education_admin": "/admin/videos (GET/POST)",
         "education_admin_by_id": "/admin/videos/{video_id} (PUT/DELETE)",
         # scheduler manual:
@@ -268,6 +308,10 @@ def health() -> Dict[str, Any]:
         "time_utc": datetime.now(timezone.utc).isoformat(),
         "features_ready": FEATURES_ERROR is None,
         "features_error": FEATURES_ERROR,
+        "kv_cache": kv_cache_stats(),
+        "async_db": async_engine is not None,
+        "broadcast": hub.snapshot_stats(),
+        "offline_bundle": offline_bundle.snapshot_stats(),
     }
 
 
@@ -282,15 +326,16 @@ def sinabung_last() -> Dict[str, Any]:
     }
 
 
-@app.get("/sinabung/dashboard")
-async def dashboard() -> Dict[str, Any]:
-    # BMKG
-    try:
-        from .bmkg import fetch_latest_quake
-        bmkg = await fetch_latest_quake()
-    except Exception as e:
-        bmkg = {"source": "BMKG", "error": f"{type(e).__name__}: {e}"}
+def _magma_event_snapshot() -> Dict[str, Any]:
+    st = load_state()
+    return {"level": getattr(st, "last_level", None), "report_id": getattr(st, "last_report_id", None)}
+
 
+if load_state is not None:
+    hub.snapshot_loaders["magma"] = _magma_event_snapshot
+
+
+async def _load_volcano_part() -> tuple[Dict[str, Any], bool]:
     volcano_payload: Dict[str, Any] = {"name": "Sinabung", "source": "MAGMA/PVMBG"}
 
     try:
@@ -316,45 +361,157 @@ async def dashboard() -> Dict[str, Any]:
             }
         )
         _save_magma_cache(volcano_payload)
+        return volcano_payload, False
 
     except HTTPException as e:
-        cached = _load_magma_cache()
-        if cached.get("report_url"):
-            volcano_payload.update(cached)
-            volcano_payload["stale"] = True
-            volcano_payload["warning"] = f"MAGMA live fetch gagal, pakai cache: {e.detail}"
-        else:
-            volcano_payload.update(_default_magma_payload())
-            volcano_payload["stale"] = True
-            volcano_payload["warning"] = f"MAGMA live fetch gagal, pakai fallback default: {e.detail}"
-    except httpx.HTTPError as e:
-        cached = _load_magma_cache()
-        if cached.get("report_url"):
-            volcano_payload.update(cached)
-            volcano_payload["stale"] = True
-            volcano_payload["warning"] = f"MAGMA live fetch gagal, pakai cache: {type(e).__name__}: {e}"
-        else:
-            volcano_payload.update(_default_magma_payload())
-            volcano_payload["stale"] = True
-            volcano_payload["warning"] = f"MAGMA live fetch gagal, pakai fallback default: {type(e).__name__}: {e}"
+        reason = str(e.detail)
     except Exception as e:
-        cached = _load_magma_cache()
-        if cached.get("report_url"):
-            volcano_payload.update(cached)
-            volcano_payload["stale"] = True
-            volcano_payload["warning"] = f"MAGMA live fetch gagal, pakai cache: {type(e).__name__}: {e}"
-        else:
-            volcano_payload.update(_default_magma_payload())
-            volcano_payload["stale"] = True
-            volcano_payload["warning"] = f"MAGMA live fetch gagal, pakai fallback default: {type(e).__name__}: {e}"
+        reason = f"{type(e).__name__}: {e}"
 
-    return {
-        "volcano": volcano_payload,
-        "magma": volcano_payload,
-        "earthquake": bmkg,
-        "gempa": bmkg,
-    }
+    return _fallback_volcano_payload(reason), True
+
+
+def _fallback_volcano_payload(reason: str, prefix: str = "MAGMA live fetch gagal") -> Dict[str, Any]:
+    volcano_payload: Dict[str, Any] = {"name": "Sinabung", "source": "MAGMA/PVMBG"}
+    cached = _load_magma_cache()
+    if cached.get("report_url"):
+        volcano_payload.update(cached)
+        volcano_payload["stale"] = True
+        volcano_payload["warning"] = f"{prefix}, pakai cache: {reason}"
+    else:
+        volcano_payload.update(_default_magma_payload())
+        volcano_payload["stale"] = True
+        volcano_payload["warning"] = f"{prefix}, pakai fallback default: {reason}"
+    return volcano_payload
+
+
+async def _load_earthquake_part() -> tuple[Dict[str, Any], bool]:
+    try:
+        from .bmkg import fetch_latest_quake
+        return await fetch_latest_quake(), False
+    except Exception as e:
+        return {"source": "BMKG", "error": f"{type(e).__name__}: {e}"}, True
+
+
+async def refresh_dashboard_volcano() -> None:
+    await dashboard_snapshot.refresh("volcano", _load_volcano_part)
+
+
+async def refresh_dashboard_earthquake() -> None:
+    previous = dashboard_snapshot.get("earthquake")
+    payload, stale = await _load_earthquake_part()
+    if stale and previous is not None and not previous.stale:
+        # Pertahankan data gempa terakhir yang valid, cukup tandai stale.
+        dashboard_snapshot.mark_stale("earthquake")
+        return
+    dashboard_snapshot.put("earthquake", payload, stale=stale)
+
+
+def _seed_dashboard_snapshot(reason: str) -> None:
+    if not dashboard_snapshot.has("volcano"):
+        payload = _fallback_volcano_payload(reason, prefix="MAGMA belum di-refresh")
+        dashboard_snapshot.put("volcano", payload, stale=True, placeholder=True)
+    if not dashboard_snapshot.has("earthquake"):
+        dashboard_snapshot.put("earthquake", {"source": "BMKG", "error": reason}, stale=True, placeholder=True)
+
+
+_dashboard_refresh_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def _refresh_dashboard_on_demand() -> None:
+    """
+    Tanpa scheduler (komponen opsional gagal dimuat) tidak ada job refresh:
+    bagian yang belum ada / masih placeholder / lewat max_age di-refresh di sini,
+    satu fetch per bagian walau banyak request bersamaan.
+    """
+    for name, refresh in (("volcano", refresh_dashboard_volcano), ("earthquake", refresh_dashboard_earthquake)):
+        if not dashboard_snapshot.needs_refresh(name):
+            continue
+        lock = _dashboard_refresh_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if dashboard_snapshot.needs_refresh(name):
+                try:
+                    await refresh()
+                except Exception as e:
+                    logger.warning("Dashboard %s refresh failed: %s: %s", name, type(e).__name__, e)
+
+
+@app.get("/sinabung/dashboard")
+async def dashboard(request: Request) -> Response:
+    if scheduler is None or not getattr(scheduler, "running", False):
+        await _refresh_dashboard_on_demand()
+    if not dashboard_snapshot.has("volcano") or not dashboard_snapshot.has("earthquake"):
+        _seed_dashboard_snapshot("snapshot dashboard belum siap")
+    # Weak: snapshot.age_seconds berubah tiap render walau isi datanya sama.
+    etag = make_etag("dashboard", dashboard_snapshot.version(), weak=True)
+    return cached_json(request, "dashboard", etag, dashboard_snapshot.render)
+
+
+
+def _register_bundle_inputs() -> None:
+    """Isi /offline/bundle: bagian yang sama dengan endpoint publik masing-masing."""
+    from sqlmodel import Session
+
+    from .db import engine
+    from .storage import read_json_versioned, resource_version
+
+    def _dashboard_version() -> tuple:
+        if not dashboard_snapshot.has("volcano") or not dashboard_snapshot.has("earthquake"):
+            _seed_dashboard_snapshot("snapshot dashboard belum siap")
+        return dashboard_snapshot.version()
+
+    offline_bundle.register("dashboard", _dashboard_version, dashboard_snapshot.render)
+    try:
+        from .emergency_api import STATE_KEY as EMERGENCY_KEY, _load_state as load_emergency
+
+        offline_bundle.register("emergency", lambda: read_json_versioned(EMERGENCY_KEY, None)[1], load_emergency)
+    except Exception as e:
+        logger.warning("Bundle: emergency not included: %s: %s", type(e).__name__, e)
+    try:
+        from .posko_api import load_public_posko, public_posko_version
 
+        def _posko():
+            with Session(engine) as session:
+                return load_public_posko(session)
+
+        # Okupansi berubah tiap check-in: rebuild karena okupansi saja ikut di-throttle.
+        offline_bundle.register("posko", public_posko_version, _posko, volatile=True)
+    except Exception as e:
+        logger.warning("Bundle: posko not included: %s: %s", type(e).__name__, e)
+    try:
+        from .education_api import load_public_videos
+
+        def _videos():
+            with Session(engine) as session:
+                return load_public_videos(session)
+
+        offline_bundle.register("videos", lambda: resource_version("videos"), _videos)
+    except Exception as e:
+        logger.warning("Bundle: videos not included: %s: %s", type(e).__name__, e)
+    try:
+        from .air_latest import latest_index
+        from .iot_api import air_latest_snapshot
+
+        def _air_version() -> int:
+            latest_index.sync()
+            return latest_index.version
+
+        offline_bundle.register("air", _air_version, air_latest_snapshot, volatile=True)
+    except Exception as e:
+        logger.warning("Bundle: air not included: %s: %s", type(e).__name__, e)
+
+
+_register_bundle_inputs()
+
+
+@app.get("/offline/bundle")
+def offline_bundle_endpoint(request: Request) -> Response:
+    """
+    Semua data publik untuk cold start dalam satu respons: dashboard, status
+    darurat, posko, video edukasi, dan kualitas udara. Artefak dibangun ulang
+    hanya saat salah satu input berubah dan disajikan sudah terkompresi.
+    """
+    return offline_bundle.response(request)
 
 async def check_update() -> None:
     if (
@@ -374,6 +531,17 @@ async def check_update() -> None:
 
     try:
         report_url = await get_latest_sinabung_report_url(tingkat_url)
+    except Exception:
+        logger.warning("MAGMA scheduler fetch failed; keeping previous state.")
+        return
+
+    # Laporan yang sama dengan state terakhir: tidak perlu fetch halaman detail.
+    last_report_id = getattr(st, "last_report_id", None)
+    if last_report_id and extract_report_id is not None and extract_report_id(report_url) == last_report_id:
+        logger.info("No change. last_report_id=%s (report page not fetched)", last_report_id)
+        return
+
+    try:
         detail = await fetch_report_detail(report_url)
     except Exception:
         logger.warning("MAGMA scheduler fetch failed; keeping previous state.")
@@ -423,11 +591,22 @@ async def check_update() -> None:
         except Exception:
             logger.exception("Failed to send FCM (cek GOOGLE_APPLICATION_CREDENTIALS).")
 
+    level_changed = bool(new_level) and new_level != getattr(st, "last_level", None)
     if new_id:
         st.last_report_id = new_id
     if new_level:
         st.last_level = new_level
     save_state(st)
+    publish(
+        "magma",
+        {
+            "level": st.last_level,
+            "report_id": st.last_report_id,
+            "report_url": detail.get("report_url"),
+            "title": detail.get("title"),
+            "level_changed": level_changed,
+        },
+    )
 
 
 @app.post("/admin/check-now")
@@ -455,6 +634,11 @@ def admin_set_magma_cache(payload: MagmaCacheUpsertReq) -> Dict[str, Any]:
         "radius_info": payload.radius_info,
     }
     _save_magma_cache(cache_payload)
+
+    current = dashboard_snapshot.get("volcano")
+    if current is None or current.stale:
+        dashboard_snapshot.put("volcano", _fallback_volcano_payload("cache diperbarui admin"), stale=True)
+
     return {"ok": True, "cache": _load_magma_cache()}
 
 
@@ -466,6 +650,14 @@ async def on_startup() -> None:
     except Exception as e:
         logger.warning("DB init failed: %s: %s", type(e).__name__, e)
 
+    await http_clients.start()
+    await hub.start()
+
+    try:
+        _seed_dashboard_snapshot("menunggu refresh pertama")
+    except Exception as e:
+        logger.warning("Dashboard snapshot seed failed: %s: %s", type(e).__name__, e)
+
     if FEATURES_ERROR or scheduler is None:
         logger.warning("Scheduler not started: %s", FEATURES_ERROR)
         return
@@ -482,8 +674,75 @@ async def on_startup() -> None:
         max_instances=1,
         coalesce=True,
     )
+    scheduler.add_job(
+        refresh_dashboard_volcano,
+        trigger="interval",
+        seconds=DASHBOARD_MAGMA_REFRESH_SECONDS,
+        id="dashboard_volcano_refresh",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        next_run_time=datetime.now(timezone.utc),
+    )
+    scheduler.add_job(
+        refresh_dashboard_earthquake,
+        trigger="interval",
+        seconds=DASHBOARD_BMKG_REFRESH_SECONDS,
+        id="dashboard_earthquake_refresh",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        next_run_time=datetime.now(timezone.utc),
+    )
+    try:
+        from .air_history import compact as compact_air_history
+
+        scheduler.add_job(
+            compact_air_history,
+            trigger="interval",
+            minutes=max(1, int(os.environ.get("IOT_COMPACT_INTERVAL_MINUTES", "60"))),
+            id="air_history_compact",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    except Exception as e:
+        logger.warning("Air history compaction not scheduled: %s: %s", type(e).__name__, e)
+    try:
+        from .iot_api import check_silent_devices
+
+        scheduler.add_job(
+            check_silent_devices,
+            trigger="interval",
+            seconds=60,
+            id="air_silent_check",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    except Exception as e:
+        logger.warning("Air silent check not scheduled: %s: %s", type(e).__name__, e)
+    try:
+        from .changelog import prune_tombstones
+
+        scheduler.add_job(
+            prune_tombstones,
+            trigger="interval",
+            hours=24,
+            id="sync_tombstone_prune",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    except Exception as e:
+        logger.warning("Sync tombstone prune not scheduled: %s: %s", type(e).__name__, e)
     scheduler.start()
-    logger.info("Scheduler started (interval=%s minutes).", interval_minutes)
+    logger.info(
+        "Scheduler started (interval=%s minutes, dashboard magma=%ss bmkg=%ss).",
+        interval_minutes,
+        DASHBOARD_MAGMA_REFRESH_SECONDS,
+        DASHBOARD_BMKG_REFRESH_SECONDS,
+    )
 
 
 @app.on_event("shutdown")
@@ -492,3 +751,7 @@ async def on_shutdown() -> None:
         scheduler.shutdown(wait=False)
         logger.info("Scheduler stopped.")
 
+    await hub.aclose()
+    await http_clients.aclose()
+    logger.info("HTTP clients closed.")
+    await dispose_async_engine()
@@ -4,6 +4,7 @@ from datetime import datetime, timezone
 from typing import Optional
 from uuid import uuid4
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -11,6 +12,15 @@ def now_utc() -> datetime:
     return datetime.now(timezone.utc)
 
 
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Datetime aware UTC; input tanpa zona waktu (mis. dari SQLite) dianggap UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
 class PoskoBase(SQLModel):
     nama: str
     alamat: str
@@ -22,6 +32,12 @@ class PoskoBase(SQLModel):
 
 
 class Posko(PoskoBase, table=True):
+    # lat/lng: prefilter bounding box (posko terdekat, ?bbox=); created_at/id: keyset pagination.
+    __table_args__ = (
+        Index("ix_posko_lat_lng", "lat", "lng"),
+        Index("ix_posko_created_at_id", "created_at", "id"),
+    )
+
     id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True, index=True)
     created_at: datetime = Field(default_factory=now_utc)
     updated_at: datetime = Field(default_factory=now_utc)
@@ -45,6 +61,28 @@ class PoskoOut(PoskoBase):
     id: str
     created_at: datetime
     updated_at: datetime
+    # Okupansi live dari PoskoOccupancy (bukan kolom tabel posko).
+    terisi: int = 0
+    sisa_kapasitas: Optional[int] = None
+    persen_terisi: Optional[float] = None
+
+
+class PoskoOccupancy(SQLModel, table=True):
+    """Jumlah pengungsi per posko; tabel terpisah supaya check-in tidak mengunci baris posko."""
+
+    posko_id: str = Field(primary_key=True)
+    terisi: int = 0
+    updated_at: datetime = Field(default_factory=now_utc)
+
+
+class PoskoOccupancyEvent(SQLModel, table=True):
+    """Log check-in/check-out (append-only). client_id unik mencegah hitung ganda saat relawan retry."""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    posko_id: str = Field(index=True)
+    delta: int
+    client_id: Optional[str] = Field(default=None, unique=True)
+    created_at: datetime = Field(default_factory=now_utc)
 
 
 # ---------------- VIDEOS ----------------
@@ -56,6 +94,9 @@ class VideoBase(SQLModel):
 
 
 class Video(VideoBase, table=True):
+    # Keyset pagination daftar video.
+    __table_args__ = (Index("ix_video_created_at_id", "created_at", "id"),)
+
     id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True, index=True)
     created_at: datetime = Field(default_factory=now_utc)
     updated_at: datetime = Field(default_factory=now_utc)
@@ -83,3 +124,91 @@ class AppKV(SQLModel, table=True):
     key: str = Field(primary_key=True, index=True)
     value_json: str
     updated_at: datetime = Field(default_factory=now_utc)
+    # Mulai dari 1 dan naik setiap penulisan; dipakai untuk compare-and-swap
+    # (optimistic concurrency). Versi 0 berarti key belum ada.
+    version: int = Field(default=1)
+
+
+# ---------------- CHANGE FEED (DELTA SYNC) ----------------
+
+class ChangeLog(SQLModel, table=True):
+    """
+    Perubahan terakhir per entitas (posko, videos, kv) untuk GET /sync.
+    Satu baris per (entity, entity_id): perubahan baru menghapus baris lama dan
+    mendapat seq baru, jadi ukuran tabel = jumlah entitas + tombstone.
+    """
+
+    # sqlite_autoincrement: seq tidak boleh dipakai ulang setelah baris terakhir dihapus.
+    __table_args__ = (
+        Index("ux_changelog_entity", "entity", "entity_id", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    entity: str
+    entity_id: str
+    op: str  # upsert | delete
+    changed_at: datetime = Field(default_factory=now_utc, index=True)
+
+
+# ---------------- IOT TIME SERIES ----------------
+
+class AirReading(SQLModel, table=True):
+    """Titik mentah sensor kualitas udara (append-only)."""
+
+    __table_args__ = (Index("ix_airreading_device_ts", "device_id", "ts"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: str
+    ts: datetime
+    pm25: float
+    pm10: Optional[float] = None
+    pm1: Optional[float] = None
+
+
+class AirRollup(SQLModel, table=True):
+    """Agregat per device per bucket waktu (resolution: 1m/1h/1d), diperbarui tiap ingest."""
+
+    device_id: str = Field(primary_key=True)
+    resolution: str = Field(primary_key=True)
+    bucket: datetime = Field(primary_key=True)
+    pm25_n: int = 0
+    pm25_min: Optional[float] = None
+    pm25_max: Optional[float] = None
+    pm25_sum: float = 0.0
+    pm10_n: int = 0
+    pm10_min: Optional[float] = None
+    pm10_max: Optional[float] = None
+    pm10_sum: float = 0.0
+    pm1_n: int = 0
+    pm1_min: Optional[float] = None
+    pm1_max: Optional[float] = None
+    pm1_sum: float = 0.0
+
+
+class AirDeviceBase(SQLModel):
+    nama: Optional[str] = None
+    zona: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    keterangan: Optional[str] = None
+
+
+class AirDevice(AirDeviceBase, table=True):
+    """Registry sensor + bacaan terakhirnya (satu baris per device, tidak saling rebutan)."""
+
+    device_id: str = Field(primary_key=True)
+    created_at: datetime = Field(default_factory=now_utc)
+    updated_at: datetime = Field(default_factory=now_utc)
+    last_ts: Optional[datetime] = None
+    last_pm25: Optional[float] = None
+    last_pm10: Optional[float] = None
+    last_pm1: Optional[float] = None
+    last_status: Optional[str] = None
+    last_label: Optional[str] = None
+    # Waktu server saat baris berubah (ingest atau edit registry); dipakai worker lain untuk sinkron.
+    changed_at: datetime = Field(default_factory=now_utc, index=True)
+
+
+class AirDeviceUpdate(AirDeviceBase):
+    pass
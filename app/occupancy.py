@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import case, delete, insert, select, update
+
+from .db import dialect_insert, engine, fetch_all
+from .models import PoskoOccupancy, PoskoOccupancyEvent
+
+logger = logging.getLogger("sinabung.posko")
+
+# Umur maksimum snapshot okupansi untuk daftar publik / ETag / rute.
+OCCUPANCY_CACHE_SECONDS = float(os.environ.get("OCCUPANCY_CACHE_SECONDS", "2"))
+
+
+def adjust(posko_id: str, delta: int, client_id: Optional[str] = None) -> Tuple[int, bool]:
+    """
+    Tambah/kurangi okupansi posko dengan satu increment atomik di DB
+    (tanpa baca-ubah-tulis, tidak menyentuh baris Posko). Tidak pernah di bawah 0.
+    Return (terisi, duplikat?) — duplikat kalau client_id sudah pernah dipakai.
+    """
+    now = datetime.now(timezone.utc)
+    table = PoskoOccupancy.__table__
+    events = PoskoOccupancyEvent.__table__
+    upsert_insert = dialect_insert()
+    with engine.begin() as conn:
+        event = {"posko_id": posko_id, "delta": delta, "client_id": client_id, "created_at": now}
+        if client_id and upsert_insert is not None:
+            stmt = upsert_insert(events).values(**event).on_conflict_do_nothing(index_elements=[events.c.client_id])
+            if conn.execute(stmt.returning(events.c.id)).first() is None:
+                current = conn.execute(select(table.c.terisi).where(table.c.posko_id == posko_id)).scalar_one_or_none()
+                return int(current or 0), True
+        else:
+            conn.execute(insert(events).values(**event))
+
+        new_value = case((table.c.terisi + delta < 0, 0), else_=table.c.terisi + delta)
+        if upsert_insert is not None:
+            stmt = upsert_insert(table).values(posko_id=posko_id, terisi=max(delta, 0), updated_at=now)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.posko_id],
+                set_={"terisi": new_value, "updated_at": now},
+            ).returning(table.c.terisi)
+            terisi = conn.execute(stmt).scalar_one()
+        else:
+            result = conn.execute(
+                update(table).where(table.c.posko_id == posko_id).values(terisi=new_value, updated_at=now).returning(table.c.terisi)
+            ).first()
+            if result is None:
+                conn.execute(insert(table).values(posko_id=posko_id, terisi=max(delta, 0), updated_at=now))
+                terisi = max(delta, 0)
+            else:
+                terisi = result[0]
+    occupancy_cache.invalidate()
+    return int(terisi), False
+
+
+def set_count(posko_id: str, terisi: int) -> int:
+    """Koreksi admin: set jumlah absolut (mis. setelah hitung ulang manual)."""
+    now = datetime.now(timezone.utc)
+    table = PoskoOccupancy.__table__
+    with engine.begin() as conn:
+        updated = conn.execute(
+            update(table).where(table.c.posko_id == posko_id).values(terisi=terisi, updated_at=now)
+        ).rowcount
+        if not updated:
+            conn.execute(insert(table).values(posko_id=posko_id, terisi=terisi, updated_at=now))
+        conn.execute(insert(PoskoOccupancyEvent.__table__).values(posko_id=posko_id, delta=0, created_at=now))
+    occupancy_cache.invalidate()
+    return terisi
+
+
+def remove(posko_id: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(delete(PoskoOccupancy.__table__).where(PoskoOccupancy.__table__.c.posko_id == posko_id))
+    occupancy_cache.invalidate()
+
+
+class OccupancyCache:
+    """
+    Snapshot {posko_id: terisi} untuk daftar publik, dibaca ulang paling sering
+    tiap OCCUPANCY_CACHE_SECONDS. stamp = hash isi, dipakai di ETag dan kunci cache
+    turunan (bundle), jadi sama di semua worker untuk data yang sama.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._stamp = ""
+        self._loaded_at = 0.0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def _fresh(self) -> Optional[Tuple[str, Dict[str, int]]]:
+        with self._lock:
+            if self._loaded_at and time.monotonic() - self._loaded_at < self.ttl:
+                return self._stamp, self._counts
+        return None
+
+    def _query(self):
+        table = PoskoOccupancy.__table__
+        return select(table.c.posko_id, table.c.terisi).order_by(table.c.posko_id)
+
+    def _failed(self, e: Exception) -> Tuple[str, Dict[str, int]]:
+        logger.warning("Occupancy snapshot failed: %s: %s", type(e).__name__, e)
+        with self._lock:
+            return self._stamp, self._counts
+
+    def snapshot(self) -> Tuple[str, Dict[str, int]]:
+        fresh = self._fresh()
+        if fresh is not None:
+            return fresh
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(self._query()).all()
+        except Exception as e:
+            return self._failed(e)
+        return self._store(rows)
+
+    async def snapshot_async(self) -> Tuple[str, Dict[str, int]]:
+        fresh = self._fresh()
+        if fresh is not None:
+            return fresh
+        try:
+            rows = await fetch_all(self._query())
+        except Exception as e:
+            return self._failed(e)
+        return self._store(rows)
+
+    def _store(self, rows: Any) -> Tuple[str, Dict[str, int]]:
+        counts = {posko_id: int(terisi) for posko_id, terisi in rows if terisi}
+        digest = hashlib.blake2b(repr(sorted(counts.items())).encode("utf-8"), digest_size=8).hexdigest()
+        with self._lock:
+            self._counts, self._stamp, self._loaded_at = counts, digest, time.monotonic()
+            return digest, counts
+
+    def stamp(self) -> str:
+        return self.snapshot()[0]
+
+    async def stamp_async(self) -> str:
+        return (await self.snapshot_async())[0]
+
+
+occupancy_cache = OccupancyCache(OCCUPANCY_CACHE_SECONDS)
+
+
+def occupancy_fields(kapasitas: Optional[int], terisi: int) -> Dict[str, Any]:
+    if kapasitas is None:
+        return {"terisi": terisi, "sisa_kapasitas": None, "persen_terisi": None}
+    return {
+        "terisi": terisi,
+        "sisa_kapasitas": max(kapasitas - terisi, 0),
+        "persen_terisi": round(100.0 * terisi / kapasitas, 1) if kapasitas > 0 else None,
+    }
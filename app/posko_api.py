@@ -1,37 +1,227 @@
 from __future__ import annotations
 
+import logging
+import os
 from datetime import datetime, timezone
-from typing import List
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
 
 from .db import get_session
 from .models import Posko, PoskoCreate, PoskoUpdate, PoskoOut
 from .auth import require_admin
+from .changelog import record_change
+from .geo_index import GEO_INDEX_ENABLED, GEO_NEAREST_MAX_K, nearest_sql, posko_index
+from .http_cache import cached_json_async, dumps, make_etag
+from .listing import keyset_page, page_headers, parse_bbox, parse_fields, project, resolve_limit
+from . import occupancy, posko_bulk
+from .storage import bump_resource_version, resource_version, resource_version_async
 
 router = APIRouter(tags=["posko"])
+logger = logging.getLogger("sinabung.posko")
+geo_logger = logging.getLogger("sinabung.geo")
+
+VOLUNTEER_API_KEY = os.environ.get("VOLUNTEER_API_KEY", "").strip()
 
 
 def now_utc():
     return datetime.now(timezone.utc)
 
 
+def _posko_out(row: Posko, counts: Dict[str, int]) -> PoskoOut:
+    return PoskoOut.model_validate(
+        {**row.model_dump(), **occupancy.occupancy_fields(row.kapasitas, counts.get(row.id, 0))}
+    )
+
+
+def load_public_posko(session: Session) -> List[PoskoOut]:
+    _, counts = occupancy.occupancy_cache.snapshot()
+    rows = session.exec(select(Posko).order_by(Posko.created_at.desc())).all()
+    return [_posko_out(row, counts) for row in rows]
+
+
+POSKO_COLUMNS = list(Posko.model_fields)
+POSKO_OCCUPANCY_FIELDS = ["terisi", "sisa_kapasitas", "persen_terisi"]
+POSKO_FIELDS = list(PoskoOut.model_fields)
+
+
+async def load_posko_page(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    bbox: Optional[str] = None,
+) -> tuple:
+    """
+    Satu halaman daftar posko: hanya kolom di `fields` yang di-SELECT, filter bbox
+    lewat index (lat, lng). Okupansi digabung dari snapshot kalau diminta.
+    Return (list dict, cursor berikutnya).
+    """
+    selected = parse_fields(fields, POSKO_FIELDS) or POSKO_FIELDS
+    columns = [name for name in selected if name in POSKO_COLUMNS]
+    with_occupancy = any(name in POSKO_OCCUPANCY_FIELDS for name in selected)
+    if with_occupancy:
+        columns.append("kapasitas")
+    where = []
+    box = parse_bbox(bbox)
+    if box is not None:
+        min_lng, min_lat, max_lng, max_lat = box
+        where = [Posko.lat >= min_lat, Posko.lat <= max_lat, Posko.lng >= min_lng, Posko.lng <= max_lng]
+
+    rows, next_cursor = await keyset_page(Posko, columns, resolve_limit(limit, cursor, fields, bbox), cursor, where)
+    if with_occupancy:
+        _, counts = await occupancy.occupancy_cache.snapshot_async()
+        for row in rows:
+            row.update(occupancy.occupancy_fields(row["kapasitas"], counts.get(row["id"], 0)))
+    return [project(row, selected) for row in rows], next_cursor
+
+
+def public_posko_version() -> tuple:
+    """Versi daftar publik: versi koleksi (AppKV) + hash snapshot okupansi."""
+    return (resource_version("posko"), occupancy.occupancy_cache.stamp())
+
+
+async def public_posko_version_async() -> tuple:
+    return (await resource_version_async("posko"), await occupancy.occupancy_cache.stamp_async())
+
+
+def _check_volunteer_key(request: Request) -> None:
+    # Okupansi ikut menentukan rute evakuasi (posko penuh dilewati), jadi tanpa key
+    # yang dikonfigurasi endpoint ini ditutup, bukan terbuka untuk siapa saja.
+    if not VOLUNTEER_API_KEY:
+        raise HTTPException(status_code=503, detail="VOLUNTEER_API_KEY belum dikonfigurasi")
+    key = request.headers.get("X-VOLUNTEER-KEY", "").strip()
+    if key != VOLUNTEER_API_KEY:
+        raise HTTPException(status_code=401, detail="Invalid volunteer key")
+
+
+class OccupancyReq(BaseModel):
+    jumlah: int = Field(1, ge=1, le=1000, description="Jumlah orang")
+    # Id unik dari perangkat relawan; request yang di-retry dengan id sama tidak dihitung dua kali.
+    client_id: Optional[str] = Field(None, max_length=100)
+
+
+class OccupancySetReq(BaseModel):
+    terisi: int = Field(..., ge=0)
+
+
 # ===== PUBLIC =====
 @router.get("/evacuation/posts", response_model=List[PoskoOut])
-def public_list_posko(session: Session = Depends(get_session)):
-    rows = session.exec(select(Posko).order_by(Posko.created_at.desc())).all()
-    return rows
+async def public_list_posko(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, description="jumlah per halaman; tanpa parameter paging = daftar penuh"),
+    cursor: Optional[str] = Query(None, description="nilai header X-Next-Cursor dari halaman sebelumnya"),
+    fields: Optional[str] = Query(None, description="kolom yang dikembalikan, mis. id,nama,lat,lng"),
+    bbox: Optional[str] = Query(None, description="minLng,minLat,maxLng,maxLat"),
+):
+    # Versi koleksi dari cache AppKV + snapshot okupansi: If-None-Match yang cocok dijawab 304 tanpa query posko.
+    etag = make_etag("posko", await public_posko_version_async(), resolve_limit(limit, cursor, fields, bbox), cursor, fields, bbox)
+    page: Dict[str, Any] = {}
+
+    async def _build():
+        page["items"], page["next"] = await load_posko_page(limit, cursor, fields, bbox)
+        return page["items"]
+
+    response = await cached_json_async(request, "posko", etag, _build)
+    return page_headers(response, request, page.get("next"))
+
+
+@router.get("/evacuation/posts/nearest")
+def public_nearest_posko(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1),
+    min_kapasitas: Optional[int] = Query(None, ge=0, description="sisa tempat minimum (kapasitas - terisi)"),
+    max_km: Optional[float] = Query(None, gt=0),
+    session: Session = Depends(get_session),
+) -> Dict[str, Any]:
+    """k posko terdekat (jarak haversine) dari titik user, opsional dengan sisa tempat minimum."""
+    k = min(k, GEO_NEAREST_MAX_K)
+    _, counts = occupancy.occupancy_cache.snapshot()
+    source = "index"
+    try:
+        if not GEO_INDEX_ENABLED:
+            raise RuntimeError("geo index dimatikan")
+        posko_index.refresh(resource_version("posko"))
+        found = posko_index.nearest(lat, lng, k, min_kapasitas, max_km, counts)
+    except Exception as e:
+        if GEO_INDEX_ENABLED:
+            geo_logger.warning("Posko geo index unavailable, using SQL: %s: %s", type(e).__name__, e)
+        source = "sql"
+        found = nearest_sql(session, lat, lng, k, min_kapasitas, max_km, counts)
+    return {
+        "lat": lat,
+        "lng": lng,
+        "k": k,
+        "source": source,
+        "items": [
+            {
+                **item,
+                **occupancy.occupancy_fields(item.get("kapasitas"), counts.get(item["id"], 0)),
+                "jarak_km": round(dist, 3),
+            }
+            for dist, item in found
+        ],
+    }
+
+
+# ===== RELAWAN =====
+def _occupancy_response(item: Posko, terisi: int, duplicate: bool) -> Dict[str, Any]:
+    return {
+        "posko_id": item.id,
+        "nama": item.nama,
+        "kapasitas": item.kapasitas,
+        **occupancy.occupancy_fields(item.kapasitas, terisi),
+        "duplicate": duplicate,
+    }
+
+
+def _adjust_occupancy(posko_id: str, delta: int, client_id: Optional[str], session: Session) -> Dict[str, Any]:
+    item = session.get(Posko, posko_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Posko not found")
+    terisi, duplicate = occupancy.adjust(posko_id, delta, client_id)
+    return _occupancy_response(item, terisi, duplicate)
+
+
+@router.post("/evacuation/posts/{posko_id}/checkin")
+def volunteer_checkin(
+    posko_id: str,
+    payload: OccupancyReq,
+    request: Request,
+    session: Session = Depends(get_session),
+) -> Dict[str, Any]:
+    _check_volunteer_key(request)
+    return _adjust_occupancy(posko_id, payload.jumlah, payload.client_id, session)
+
+
+@router.post("/evacuation/posts/{posko_id}/checkout")
+def volunteer_checkout(
+    posko_id: str,
+    payload: OccupancyReq,
+    request: Request,
+    session: Session = Depends(get_session),
+) -> Dict[str, Any]:
+    _check_volunteer_key(request)
+    return _adjust_occupancy(posko_id, -payload.jumlah, payload.client_id, session)
 
 
 # ===== ADMIN =====
 @router.get("/admin/posts", response_model=List[PoskoOut])
-def admin_list_posko(
-    session: Session = Depends(get_session),
+async def admin_list_posko(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    bbox: Optional[str] = Query(None),
     user: str = Depends(require_admin),
 ):
-    rows = session.exec(select(Posko).order_by(Posko.created_at.desc())).all()
-    return rows
+    items, next_cursor = await load_posko_page(limit, cursor, fields, bbox)
+    response = Response(content=dumps(items), media_type="application/json", headers={"Cache-Control": "no-store"})
+    return page_headers(response, request, next_cursor)
 
 
 @router.post("/admin/posts", response_model=PoskoOut)
@@ -42,8 +232,11 @@ def admin_create_posko(
 ):
     item = Posko(**payload.model_dump())
     session.add(item)
+    record_change(session.connection(), "posko", item.id)
     session.commit()
     session.refresh(item)
+    posko_index.put(item)
+    bump_resource_version("posko")
     return item
 
 
@@ -64,8 +257,11 @@ def admin_update_posko(
     item.updated_at = now_utc()
 
     session.add(item)
+    record_change(session.connection(), "posko", item.id)
     session.commit()
     session.refresh(item)
+    posko_index.put(item)
+    bump_resource_version("posko")
     return item
 
 
@@ -80,5 +276,98 @@ def admin_delete_posko(
         raise HTTPException(status_code=404, detail="Posko not found")
 
     session.delete(item)
+    record_change(session.connection(), "posko", item.id, "delete")
     session.commit()
+    occupancy.remove(posko_id)
+    posko_index.remove(posko_id)
+    bump_resource_version("posko")
     return {"ok": True}
+
+
+@router.put("/admin/posts/{posko_id}/occupancy")
+def admin_set_occupancy(
+    posko_id: str,
+    payload: OccupancySetReq,
+    session: Session = Depends(get_session),
+    user: str = Depends(require_admin),
+) -> Dict[str, Any]:
+    item = session.get(Posko, posko_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Posko not found")
+    return _occupancy_response(item, occupancy.set_count(posko_id, payload.terisi), False)
+
+
+@router.post("/admin/posts/import")
+async def admin_import_posko(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv | geojson | geojsonseq | legacy (default dari Content-Type)"),
+    dry_run: bool = Query(False, description="validasi saja, tidak menulis"),
+    user: str = Depends(require_admin),
+) -> Dict[str, Any]:
+    """
+    Import massal posko. Baris divalidasi satu per satu; baris valid di-upsert per
+    POSKO_IMPORT_CHUNK dalam satu transaksi (id yang sudah ada diperbarui).
+    Baris gagal dilaporkan tanpa membatalkan baris lain.
+    """
+    fmt = posko_bulk.detect_format(request, format)
+    errors: List[Dict[str, Any]] = []
+    counts = {"diterima": 0, "ditulis": 0, "ditolak": 0}
+    chunk: List[tuple] = []
+
+    def _reject(baris: int, message: str, item_id: Any = None) -> None:
+        counts["ditolak"] += 1
+        if len(errors) < posko_bulk.POSKO_IMPORT_MAX_ERRORS:
+            errors.append({"baris": baris, "id": item_id, "error": message})
+
+    async def _flush() -> None:
+        if not chunk:
+            return
+        rows = [values for _, values in chunk]
+        if not dry_run:
+            try:
+                counts["ditulis"] += await run_in_threadpool(posko_bulk.upsert_chunk, rows)
+            except Exception as e:
+                logger.warning("Posko import chunk failed: %s: %s", type(e).__name__, e)
+                counts["diterima"] -= len(chunk)
+                for baris, values in chunk:
+                    _reject(baris, f"gagal disimpan: {type(e).__name__}", values["id"])
+        chunk.clear()
+
+    async for baris, raw in posko_bulk.iter_records(request, fmt):
+        if isinstance(raw, Exception):
+            _reject(baris, str(raw))
+            continue
+        try:
+            values = posko_bulk.validate_row(raw)
+        except posko_bulk.ROW_ERRORS as e:
+            _reject(baris, str(e) or type(e).__name__, raw.get("id"))
+            continue
+        counts["diterima"] += 1
+        chunk.append((baris, values))
+        if len(chunk) >= posko_bulk.POSKO_IMPORT_CHUNK:
+            await _flush()
+    await _flush()
+
+    if counts["ditulis"]:
+        # Index posko terdekat & cache daftar menyusul lewat versi + ChangeLog.
+        bump_resource_version("posko")
+    logger.info("Posko import (%s, dry_run=%s): %s", fmt, dry_run, counts)
+    return {"format": fmt, "dry_run": dry_run, **counts, "errors": errors, "errors_truncated": counts["ditolak"] > len(errors)}
+
+
+@router.get("/admin/posts/export")
+def admin_export_posko(
+    format: str = Query("csv", pattern="^(csv|geojson)$"),
+    user: str = Depends(require_admin),
+):
+    """Export semua posko, di-stream dari server-side cursor (tidak dimuat sekaligus ke memori)."""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    if format == "csv":
+        body, media_type, ext = posko_bulk.export_csv(), "text/csv; charset=utf-8", "csv"
+    else:
+        body, media_type, ext = posko_bulk.export_geojson(), "application/geo+json", "geojson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="posko-{stamp}.{ext}"', "Cache-Control": "no-store"},
+    )
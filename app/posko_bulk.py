@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import select, update
+
+from .changelog import record_changes
+from .db import dialect_insert, engine
+from .models import Posko, PoskoCreate
+
+logger = logging.getLogger("sinabung.posko")
+
+# Baris valid ditulis per transaksi sebanyak ini (satu INSERT ... ON CONFLICT multi-baris).
+POSKO_IMPORT_CHUNK = int(os.environ.get("POSKO_IMPORT_CHUNK", "500"))
+# Format yang harus di-parse utuh (GeoJSON FeatureCollection, JSON lama) dibatasi ukurannya.
+POSKO_IMPORT_MAX_BYTES = int(os.environ.get("POSKO_IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Laporan error per baris dipotong di sini; jumlah baris gagal tetap dihitung semua.
+POSKO_IMPORT_MAX_ERRORS = int(os.environ.get("POSKO_IMPORT_MAX_ERRORS", "1000"))
+POSKO_EXPORT_BATCH = int(os.environ.get("POSKO_EXPORT_BATCH", "500"))
+
+IMPORT_FORMATS = ("csv", "geojson", "geojsonseq", "legacy")
+EXPORT_COLUMNS = ["id", "nama", "alamat", "lat", "lng", "kapasitas", "telepon", "keterangan", "created_at", "updated_at"]
+
+# Nama kolom spreadsheet BPBD yang sering muncul -> field Posko.
+_ALIASES = {
+    "name": "nama",
+    "nama_posko": "nama",
+    "address": "alamat",
+    "lokasi": "alamat",
+    "latitude": "lat",
+    "lintang": "lat",
+    "lon": "lng",
+    "long": "lng",
+    "longitude": "lng",
+    "bujur": "lng",
+    "capacity": "kapasitas",
+    "daya_tampung": "kapasitas",
+    "telp": "telepon",
+    "phone": "telepon",
+    "no_hp": "telepon",
+    "catatan": "keterangan",
+    "keterangan_posko": "keterangan",
+}
+_FIELDS = set(EXPORT_COLUMNS)
+
+
+def detect_format(request: Request, fmt: Optional[str]) -> str:
+    if fmt:
+        if fmt not in IMPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format harus salah satu dari {', '.join(IMPORT_FORMATS)}")
+        return fmt
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype in {"text/csv", "application/csv", "text/plain"}:
+        return "csv"
+    if ctype in {"application/geo+json-seq", "application/x-ndjson", "application/json-seq"}:
+        return "geojsonseq"
+    if ctype in {"application/geo+json", "application/json"}:
+        return "geojson"
+    raise HTTPException(status_code=415, detail="Content-Type tidak dikenali; kirim ?format=")
+
+
+# ---------------- PARSE ----------------
+
+def _normalize(raw: Dict[str, Any]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {}
+    for key, value in raw.items():
+        if key is None:
+            continue
+        name = str(key).strip().lower().replace(" ", "_")
+        name = _ALIASES.get(name, name)
+        if name not in _FIELDS:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                value = None
+            elif name in {"lat", "lng"} and "," in value and "." not in value:
+                # Spreadsheet lokal sering memakai koma desimal: "3,17".
+                value = value.replace(",", ".")
+        row[name] = value
+    return row
+
+
+def validate_row(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Dict mentah -> nilai kolom Posko siap upsert. ValueError kalau tidak valid."""
+    row = _normalize(raw)
+    try:
+        item = PoskoCreate.model_validate(row)
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+        raise ValueError(problems) from None
+    if not -90 <= item.lat <= 90 or not -180 <= item.lng <= 180:
+        raise ValueError("lat/lng di luar rentang")
+    if item.kapasitas is not None and item.kapasitas < 0:
+        raise ValueError("kapasitas negatif")
+
+    values = item.model_dump()
+    values["id"] = str(row.get("id") or uuid4())
+    created_at = row.get("created_at")
+    if created_at:
+        try:
+            created_at = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError("created_at bukan ISO-8601") from None
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        values["created_at"] = created_at
+    return values
+
+
+# Error yang dilaporkan per baris; selain ini dianggap bug dan menggagalkan request.
+ROW_ERRORS = (ValueError, TypeError, AttributeError)
+
+
+def _feature_row(feature: Any) -> Dict[str, Any]:
+    if not isinstance(feature, dict):
+        raise ValueError("feature harus object")
+    props = feature.get("properties") or {}
+    if not isinstance(props, dict):
+        raise ValueError("properties harus object")
+    props = dict(props)
+    geom = feature.get("geometry") or {}
+    coords = geom.get("coordinates") if isinstance(geom, dict) else None
+    if not isinstance(geom, dict) or geom.get("type") != "Point" or not isinstance(coords, list) or len(coords) < 2:
+        raise ValueError("geometry harus Point")
+    props["lng"], props["lat"] = coords[0], coords[1]
+    if feature.get("id") is not None and "id" not in props:
+        props["id"] = feature["id"]
+    return props
+
+
+async def _text_lines(request: Request) -> AsyncIterator[str]:
+    """Body request per baris (utf-8, BOM Excel dibuang) tanpa menampung seluruh body."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def _read_all(request: Request) -> Any:
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > POSKO_IMPORT_MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Body lebih dari {POSKO_IMPORT_MAX_BYTES} byte; pakai format=csv atau geojsonseq",
+            )
+    try:
+        return json.loads(body.decode("utf-8-sig"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"JSON tidak valid: {e}")
+
+
+async def iter_records(request: Request, fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    (nomor baris/urutan, dict mentah atau Exception) dari body request.
+    csv dan geojsonseq diproses per baris sambil body masih diterima.
+    """
+    if fmt == "csv":
+        header: Optional[List[str]] = None
+        pending, start, lineno = "", 0, 0
+        async for line in _text_lines(request):
+            lineno += 1
+            if not pending:
+                start = lineno
+            pending += line
+            # Sel ber-kutip boleh memuat newline: record selesai kalau jumlah kutip genap.
+            if pending.count('"') % 2:
+                continue
+            record, pending = pending, ""
+            if not record.strip():
+                continue
+            try:
+                values = next(csv.reader(io.StringIO(record)))
+            except csv.Error as e:
+                yield start, ValueError(f"CSV: {e}")
+                continue
+            if header is None:
+                header = values
+                continue
+            yield start, dict(zip(header, values))
+        if pending.strip():
+            yield start, ValueError("CSV: kutip tidak ditutup")
+    elif fmt == "geojsonseq":
+        lineno = 0
+        async for line in _text_lines(request):
+            lineno += 1
+            line = line.strip().lstrip("\x1e")
+            if not line:
+                continue
+            try:
+                yield lineno, _feature_row(json.loads(line))
+            except ROW_ERRORS as e:
+                yield lineno, ValueError(str(e))
+    else:
+        data = await _read_all(request)
+        if fmt == "geojson":
+            features = data.get("features") if isinstance(data, dict) else None
+            if not isinstance(features, list):
+                raise HTTPException(status_code=400, detail="GeoJSON harus FeatureCollection")
+            for index, feature in enumerate(features, start=1):
+                try:
+                    yield index, _feature_row(feature)
+                except ROW_ERRORS as e:
+                    yield index, ValueError(str(e))
+        else:
+            # Format app/posko_store.py: list object posko apa adanya.
+            if not isinstance(data, list):
+                raise HTTPException(status_code=400, detail="Format legacy harus list posko")
+            for index, item in enumerate(data, start=1):
+                yield index, item if isinstance(item, dict) else ValueError("item harus object")
+
+
+# ---------------- WRITE ----------------
+
+def upsert_chunk(rows: List[Dict[str, Any]]) -> int:
+    """
+    Satu transaksi: INSERT ... ON CONFLICT (id) DO UPDATE multi-baris + ChangeLog batch.
+    Baris dengan id sama di satu chunk: yang terakhir menang.
+    """
+    if not rows:
+        return 0
+    now = datetime.now(timezone.utc)
+    unique: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        unique[row["id"]] = {"created_at": now, **row, "updated_at": now}
+    values = list(unique.values())
+    table = Posko.__table__
+    upsert_insert = dialect_insert()
+
+    with engine.begin() as conn:
+        if upsert_insert is not None:
+            # Kolom seragam per baris supaya jadi satu statement multi-VALUES.
+            columns = sorted({key for row in values for key in row})
+            stmt = upsert_insert(table).values([{c: row.get(c) for c in columns} for row in values])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={c: stmt.excluded[c] for c in columns if c not in {"id", "created_at"}},
+            )
+            conn.execute(stmt)
+        else:
+            for row in values:
+                data = {k: v for k, v in row.items() if k not in {"id", "created_at"}}
+                if not conn.execute(update(table).where(table.c.id == row["id"]).values(**data)).rowcount:
+                    conn.execute(table.insert().values(**row))
+        record_changes(conn, "posko", list(unique))
+    return len(values)
+
+
+# ---------------- EXPORT ----------------
+
+def _iter_rows() -> Iterator[Dict[str, Any]]:
+    """Baris posko lewat server-side cursor (stream_results) per POSKO_EXPORT_BATCH."""
+    table = Posko.__table__
+    query = select(*[table.c[name] for name in EXPORT_COLUMNS]).order_by(table.c.created_at, table.c.id)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=POSKO_EXPORT_BATCH).execute(query)
+        for partition in result.partitions():
+            for row in partition:
+                yield dict(row._mapping)
+
+
+def _iso(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_csv() -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in _iter_rows():
+        writer.writerow(["" if row[c] is None else _iso(row[c]) for c in EXPORT_COLUMNS])
+        count += 1
+        if count % POSKO_EXPORT_BATCH == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def export_geojson() -> Iterator[bytes]:
+    yield b'{"type":"FeatureCollection","features":['
+    parts: List[str] = []
+    first = True
+    for row in _iter_rows():
+        props = {c: _iso(row[c]) for c in EXPORT_COLUMNS if c not in {"lat", "lng"}}
+        feature = {
+            "type": "Feature",
+            "id": row["id"],
+            "geometry": {"type": "Point", "coordinates": [row["lng"], row["lat"]]},
+            "properties": props,
+        }
+        parts.append(("" if first else ",") + json.dumps(feature, ensure_ascii=False, separators=(",", ":")))
+        first = False
+        if len(parts) >= POSKO_EXPORT_BATCH:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+    yield ("".join(parts) + "]}").encode("utf-8")
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .geo_index import KM_PER_DEG_LAT, haversine_km
+from .hazard import HazardModel
+from .occupancy import occupancy_fields
+
+logger = logging.getLogger("sinabung.routing")
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+# Grid biaya di sekitar puncak; posko/user di luar grid pakai jarak garis lurus.
+ROUTING_CELL_DEG = float(os.environ.get("ROUTING_CELL_DEG", "0.005"))
+ROUTING_RADIUS_KM = float(os.environ.get("ROUTING_RADIUS_KM", "25"))
+# Jumlah posko terbaik yang disimpan per sel saat precompute.
+ROUTING_PRECOMPUTE_K = int(os.environ.get("ROUTING_PRECOMPUTE_K", "5"))
+# Sel di dalam zona bahaya tetap bisa dilalui (user mungkin sedang di dalamnya), tapi mahal.
+ROUTING_HAZARD_PENALTY = float(os.environ.get("ROUTING_HAZARD_PENALTY", "20"))
+# Faktor biaya sel yang dilalui jalan/jalur dari dataset lokal (lebih kecil = lebih cepat).
+ROUTING_ROAD_FACTOR = float(os.environ.get("ROUTING_ROAD_FACTOR", "0.35"))
+ROUTING_ROADS_GEOJSON = os.environ.get("ROUTING_ROADS_GEOJSON", "").strip() or str(BASE_DIR / "data" / "roads.geojson")
+
+_NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def sisa_kapasitas(item: Dict[str, Any], terisi: int = 0) -> Optional[int]:
+    """Sisa tempat di posko; None = kapasitas tidak diketahui (dianggap masih bisa menampung)."""
+    kapasitas = item.get("kapasitas")
+    if kapasitas is None:
+        return None
+    return max(kapasitas - terisi, 0)
+
+
+def load_road_lines(path: str) -> List[List[Tuple[float, float]]]:
+    """LineString/MultiLineString dari GeoJSON lokal sebagai list [(lat, lng), ...]."""
+    p = Path(path)
+    if not p.exists():
+        return []
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except Exception as e:
+        logger.warning("Road dataset %s unreadable: %s: %s", path, type(e).__name__, e)
+        return []
+    features = data.get("features") if isinstance(data, dict) and "features" in data else [data]
+    lines: List[List[Tuple[float, float]]] = []
+    for feature in features or []:
+        geom = feature.get("geometry") if isinstance(feature, dict) and "geometry" in feature else feature
+        if not isinstance(geom, dict):
+            continue
+        if geom.get("type") == "LineString":
+            parts = [geom.get("coordinates") or []]
+        elif geom.get("type") == "MultiLineString":
+            parts = geom.get("coordinates") or []
+        else:
+            continue
+        for coords in parts:
+            line = [(float(c[1]), float(c[0])) for c in coords if len(c) >= 2]
+            if len(line) >= 2:
+                lines.append(line)
+    return lines
+
+
+@dataclass
+class _Grid:
+    lat0: float
+    lng0: float
+    rows: int
+    cols: int
+    cell_deg: float
+
+    def index(self, lat: float, lng: float) -> Optional[int]:
+        i = math.floor((lat - self.lat0) / self.cell_deg)
+        j = math.floor((lng - self.lng0) / self.cell_deg)
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            return i * self.cols + j
+        return None
+
+    def center(self, cell: int) -> Tuple[float, float]:
+        i, j = divmod(cell, self.cols)
+        return self.lat0 + (i + 0.5) * self.cell_deg, self.lng0 + (j + 0.5) * self.cell_deg
+
+
+class EvacuationRouter:
+    """
+    Rute evakuasi di grid biaya sekitar G. Sinabung.
+    - Biaya sel: 1 per km, dikali ROUTING_ROAD_FACTOR kalau dilewati jalan dari
+      dataset lokal (GeoJSON), dikali ROUTING_HAZARD_PENALTY di dalam zona bahaya.
+    - Precompute: Dijkstra multi-sumber dari semua posko di luar zona bahaya,
+      menyimpan K posko termurah per sel. Query = lookup sel.
+    - Dihitung ulang hanya kalau versi posko / zona berubah. Okupansi berubah
+      tiap check-in, jadi posko penuh disaring saat query, bukan saat precompute.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._key: Optional[Hashable] = None
+        self._grid: Optional[_Grid] = None
+        self._labels: List[List[Tuple[float, int]]] = []
+        self._pred: Dict[Tuple[int, int], int] = {}
+        self._posts: List[Dict[str, Any]] = []
+        self._excluded: List[Dict[str, Any]] = []
+        self._roads: Optional[List[List[Tuple[float, float]]]] = None
+        self.stats: Dict[str, Any] = {"builds": 0, "build_ms": None, "cells": 0, "road_cells": 0}
+
+    # -- precompute --------------------------------------------------------
+    def ensure(self, key: Hashable, posts: List[Dict[str, Any]], model: HazardModel) -> None:
+        with self._lock:
+            if key == self._key:
+                return
+            self._build(posts, model)
+            self._key = key
+
+    def _build(self, posts: List[Dict[str, Any]], model: HazardModel) -> None:
+        started = time.perf_counter()
+        cell_deg = ROUTING_CELL_DEG
+        dlat = ROUTING_RADIUS_KM / KM_PER_DEG_LAT
+        dlng = ROUTING_RADIUS_KM / (KM_PER_DEG_LAT * math.cos(math.radians(model.center_lat)))
+        rows = int(math.ceil(2 * dlat / cell_deg))
+        cols = int(math.ceil(2 * dlng / cell_deg))
+        grid = _Grid(model.center_lat - dlat, model.center_lng - dlng, rows, cols, cell_deg)
+        n = rows * cols
+
+        centers = [grid.center(c) for c in range(n)]
+        hazard = model.classify([c[0] for c in centers], [c[1] for c in centers])["inside"]
+        cost = [ROUTING_HAZARD_PENALTY if h else 1.0 for h in hazard]
+
+        if self._roads is None:
+            self._roads = load_road_lines(ROUTING_ROADS_GEOJSON)
+            if self._roads:
+                logger.info("Routing: %s road lines loaded from %s.", len(self._roads), ROUTING_ROADS_GEOJSON)
+        road_cells = set()
+        for line in self._roads:
+            for (a_lat, a_lng), (b_lat, b_lng) in zip(line, line[1:]):
+                steps = max(1, int(max(abs(b_lat - a_lat), abs(b_lng - a_lng)) / (cell_deg / 2)))
+                for s in range(steps + 1):
+                    cell = grid.index(a_lat + (b_lat - a_lat) * s / steps, a_lng + (b_lng - a_lng) * s / steps)
+                    if cell is not None:
+                        road_cells.add(cell)
+        for cell in road_cells:
+            cost[cell] *= ROUTING_ROAD_FACTOR
+
+        status = model.classify([p["lat"] for p in posts], [p["lng"] for p in posts])
+        eligible, excluded = [], []
+        for p, inside in zip(posts, status["inside"]):
+            if inside:
+                excluded.append({**p, "alasan": "dalam zona bahaya"})
+            else:
+                eligible.append(p)
+
+        # Langkah antar sel dalam km (arah timur-barat menyempit dengan cos(lat)).
+        step_ns = cell_deg * KM_PER_DEG_LAT
+        step_ew = step_ns * math.cos(math.radians(model.center_lat))
+        step_diag = math.hypot(step_ns, step_ew)
+        K = max(1, ROUTING_PRECOMPUTE_K)
+        labels: List[List[Tuple[float, int]]] = [[] for _ in range(n)]
+        pred: Dict[Tuple[int, int], int] = {}
+        # Jarak sementara terbaik per (sel, posko): push hanya kalau memperbaiki.
+        tentative: Dict[Tuple[int, int], float] = {}
+        heap: List[Tuple[float, int, int, int]] = []
+        for src, p in enumerate(eligible):
+            cell = grid.index(p["lat"], p["lng"])
+            if cell is not None:
+                heap.append((0.0, cell, src, -1))
+                tentative[(cell, src)] = 0.0
+        heapq.heapify(heap)
+
+        moves = []
+        for di, dj in _NEIGHBORS:
+            moves.append((di, dj, step_diag if di and dj else (step_ns if di else step_ew)))
+        heappush, heappop = heapq.heappush, heapq.heappop
+        while heap:
+            d, cell, src, prev = heappop(heap)
+            if tentative.get((cell, src), math.inf) < d:
+                continue
+            bucket = labels[cell]
+            if len(bucket) >= K:
+                continue
+            bucket.append((d, src))
+            if prev >= 0:
+                pred[(cell, src)] = prev
+            i, j = divmod(cell, cols)
+            c0 = cost[cell]
+            for di, dj, step in moves:
+                ni, nj = i + di, j + dj
+                if ni < 0 or nj < 0 or ni >= rows or nj >= cols:
+                    continue
+                nb = ni * cols + nj
+                if len(labels[nb]) >= K:
+                    continue
+                nd = d + step * (c0 + cost[nb]) / 2
+                key = (nb, src)
+                if nd < tentative.get(key, math.inf):
+                    tentative[key] = nd
+                    heappush(heap, (nd, nb, src, cell))
+
+        self._grid = grid
+        self._labels = labels
+        self._pred = pred
+        self._posts = eligible
+        self._excluded = excluded
+        self.stats.update(
+            builds=self.stats["builds"] + 1,
+            build_ms=round((time.perf_counter() - started) * 1000, 1),
+            cells=n,
+            road_cells=len(road_cells),
+            posko_aman=len(eligible),
+            posko_dikecualikan=len(excluded),
+        )
+        logger.info("Routing grid rebuilt: %s cells, %s posko aman, %.0f ms.", n, len(eligible), self.stats["build_ms"])
+
+    # -- query -------------------------------------------------------------
+    def _path(self, cell: int, src: int) -> List[List[float]]:
+        grid = self._grid
+        path = []
+        current: Optional[int] = cell
+        while current is not None:
+            lat, lng = grid.center(current)
+            path.append([round(lat, 6), round(lng, 6)])
+            current = self._pred.get((current, src))
+        return path
+
+    def best(
+        self,
+        lat: float,
+        lng: float,
+        k: int,
+        orang: int = 1,
+        with_path: bool = False,
+        terisi: Optional[Dict[str, int]] = None,
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        terisi = terisi or {}
+
+        def _muat(p: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+            fields = occupancy_fields(p.get("kapasitas"), terisi.get(p["id"], 0))
+            sisa = fields["sisa_kapasitas"]
+            return sisa is None or sisa >= orang, fields
+
+        with self._lock:
+            grid, posts = self._grid, self._posts
+            if grid is None:
+                return "none", []
+            cell = grid.index(lat, lng)
+            results: List[Dict[str, Any]] = []
+            if cell is not None and self._labels[cell]:
+                for cost, src in self._labels[cell]:
+                    p = posts[src]
+                    ok, occ = _muat(p)
+                    if not ok:
+                        continue
+                    item = {
+                        **p,
+                        **occ,
+                        "biaya": round(cost, 3),
+                        "jarak_km": round(haversine_km(lat, lng, p["lat"], p["lng"]), 3),
+                    }
+                    if with_path:
+                        item["rute"] = self._path(cell, src)
+                    results.append(item)
+                    if len(results) >= k:
+                        break
+                if len(results) >= k or len(results) == len(posts):
+                    return "grid", results
+
+            # Di luar grid / kandidat precompute kurang: urutkan semua posko aman per jarak lurus.
+            seen = {r["id"] for r in results}
+            extra = []
+            for p in posts:
+                if p["id"] in seen:
+                    continue
+                ok, occ = _muat(p)
+                if not ok:
+                    continue
+                dist = haversine_km(lat, lng, p["lat"], p["lng"])
+                extra.append({**p, **occ, "biaya": None, "jarak_km": round(dist, 3)})
+            extra.sort(key=lambda x: x["jarak_km"])
+            return ("grid+garis-lurus" if results else "garis-lurus"), results + extra[: k - len(results)]
+
+    def excluded(self, terisi: Optional[Dict[str, int]] = None, orang: int = 1) -> List[Dict[str, Any]]:
+        """Posko dalam zona (dari precompute) + posko yang saat ini tidak muat untuk `orang`."""
+        terisi = terisi or {}
+        with self._lock:
+            out = list(self._excluded)
+            for p in self._posts:
+                sisa = sisa_kapasitas(p, terisi.get(p["id"], 0))
+                if sisa is not None and sisa < orang:
+                    out.append({**p, "alasan": "penuh"})
+            return out
+
+
+evacuation_router = EvacuationRouter()
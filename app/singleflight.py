@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+@dataclass
+class _Entry:
+    expires_at: float
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Gabungkan request upstream yang bersamaan untuk key yang sama: hanya satu
+    coroutine yang benar-benar jalan, pemanggil lain menunggu future yang sama.
+    Hasil sukses disimpan `ttl` detik, kegagalan disimpan `negative_ttl` detik.
+    Tiap pemanggil mendapat salinan hasil (deepcopy), jadi boleh dimutasi.
+    """
+
+    def __init__(self, negative_ttl: float = 0.0) -> None:
+        self.negative_ttl = negative_ttl
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._cache: Dict[Hashable, _Entry] = {}
+        self.stats = {"hits": 0, "joins": 0, "calls": 0, "negative_hits": 0}
+
+    def forget(self, key: Hashable) -> None:
+        self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        ttl: float = 0.0,
+        negative_ttl: Optional[float] = None,
+    ) -> Any:
+        entry = self._cache.get(key)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                if entry.error is not None:
+                    self.stats["negative_hits"] += 1
+                    # Traceback lama dibuang supaya tidak terus bertambah tiap hit.
+                    raise entry.error.with_traceback(None)
+                self.stats["hits"] += 1
+                return copy.deepcopy(entry.value)
+            self._cache.pop(key, None)
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["calls"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            neg = self.negative_ttl if negative_ttl is None else negative_ttl
+            task.add_done_callback(lambda t: self._finish(key, t, ttl, neg))
+        else:
+            self.stats["joins"] += 1
+
+        # shield: pemanggil yang di-cancel tidak ikut membatalkan fetch bersama.
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _finish(self, key: Hashable, task: asyncio.Task, ttl: float, negative_ttl: float) -> None:
+        if self._inflight.get(key) is task:
+            self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+
+        error = task.exception()
+        now = time.monotonic()
+        if error is None:
+            if ttl > 0:
+                self._cache[key] = _Entry(expires_at=now + ttl, value=task.result())
+        elif negative_ttl > 0:
+            self._cache[key] = _Entry(expires_at=now + negative_ttl, error=error)
@@ -1,14 +1,27 @@
 from __future__ import annotations
 
 import json
-from datetime import datetime, timezone
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Dict, Optional
 
-from sqlmodel import Session
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
 
-from .db import engine
-from .models import AppKV
+from . import kv_codec
+from .changelog import record_kv_change
+from .db import dialect_insert, engine, fetch_all, run_in_transaction
+from .models import AppKV, as_utc
+
+logger = logging.getLogger("sinabung.storage")
 
 BASE_DIR = Path(__file__).resolve().parents[1]  # -> backend/
 DATA_DIR = BASE_DIR / "data"
@@ -34,34 +47,410 @@ def _read_legacy_json(name: str) -> Any:
         return _MISSING
 
 
-def read_json(name: str, default: Any) -> Any:
+KV_CACHE_TTL_SECONDS = float(os.getenv("KV_CACHE_TTL_SECONDS", "30"))
+KV_CACHE_MAX_ITEMS = int(os.getenv("KV_CACHE_MAX_ITEMS", "256"))
+# Interval cek perubahan dari worker/proses lain lewat kolom updated_at (0 = mati).
+KV_CACHE_POLL_SECONDS = float(os.getenv("KV_CACHE_POLL_SECONDS", "2"))
+KV_CAS_MAX_RETRIES = int(os.getenv("KV_CAS_MAX_RETRIES", "16"))
+# Jeda antar percobaan CAS: acak 0..min(max, base * 2^n) ms supaya penulis yang kalah tidak bertabrakan lagi serentak.
+KV_CAS_BACKOFF_MS = float(os.getenv("KV_CAS_BACKOFF_MS", "5"))
+KV_CAS_BACKOFF_MAX_MS = float(os.getenv("KV_CAS_BACKOFF_MAX_MS", "250"))
+_POLL_OVERLAP = timedelta(seconds=5)
+
+
+class KVConflictError(RuntimeError):
+    """update_json() gagal karena key terus berubah oleh penulis lain."""
+
+
+def _copy_json(value: Any) -> Any:
+    # Lebih murah dari copy.deepcopy untuk data hasil decode JSON/msgpack.
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    version: int
+    expires_at: float
+
+
+class KVCache:
+    """
+    Cache in-memory (LRU + TTL) di depan tabel AppKV.
+    - read_json() membaca dari sini dulu; miss -> satu lookup ke DB.
+    - Penulisan menulis-tembus beserta kolom version dari DB.
+    - Perubahan dari worker lain dideteksi dengan polling updated_at/version
+      (satu query untuk semua key, paling sering tiap KV_CACHE_POLL_SECONDS).
+    """
+
+    def __init__(self, ttl: float, max_items: int, poll_seconds: float) -> None:
+        self.ttl = ttl
+        self.max_items = max_items
+        self.poll_seconds = poll_seconds
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        # key -> versi DB terakhir yang terlihat; bertahan walau entry di-evict.
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._last_poll = time.monotonic()
+        self._poll_since: Optional[datetime] = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "polls": 0}
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.stats["misses"] += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: str, value: Any, version: int) -> None:
+        with self._lock:
+            if version < self._versions.get(key, 0):
+                # Hasil baca yang lebih tua dari tulisan yang sudah terlihat; jangan simpan.
+                return
+            self._versions[key] = version
+            self._entries[key] = _CacheEntry(
+                value=value,
+                version=version,
+                expires_at=time.monotonic() + self.ttl,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def version(self, key: str) -> int:
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def _poll_query(self):
+        """Query polling kalau sudah waktunya, selain itu None."""
+        if self.poll_seconds <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_poll < self.poll_seconds:
+                return None
+            self._last_poll = now
+            since = self._poll_since
+
+        query = select(AppKV.key, AppKV.version, AppKV.updated_at)
+        if since is not None:
+            query = query.where(AppKV.updated_at > since - _POLL_OVERLAP)
+        return query
+
+    def poll_remote_changes(self) -> None:
+        query = self._poll_query()
+        if query is None:
+            return
+        try:
+            with Session(engine) as session:
+                rows = session.exec(query).all()
+        except Exception:
+            return
+        self._apply_poll(rows)
+
+    async def poll_remote_changes_async(self) -> None:
+        query = self._poll_query()
+        if query is None:
+            return
+        try:
+            rows = await fetch_all(query)
+        except Exception:
+            return
+        self._apply_poll(rows)
+
+    def _apply_poll(self, rows: Any) -> None:
+        with self._lock:
+            self.stats["polls"] += 1
+            for key, version, updated_at in rows:
+                # Tetap aware UTC: parameter datetime naive ditolak kolom updated_at SQLModel,
+                # dan poll berikutnya akan gagal diam-diam.
+                updated_at = as_utc(updated_at)
+                if updated_at is not None and (self._poll_since is None or updated_at > self._poll_since):
+                    self._poll_since = updated_at
+                if key in self._versions and version > self._versions[key]:
+                    self._versions[key] = version
+                    if self._entries.pop(key, None) is not None:
+                        self.stats["invalidations"] += 1
+            if self._poll_since is None:
+                self._poll_since = datetime.now(timezone.utc)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "hit_ratio": round(self.stats["hits"] / total, 4) if total else None,
+            }
+
+
+kv_cache = KVCache(KV_CACHE_TTL_SECONDS, KV_CACHE_MAX_ITEMS, KV_CACHE_POLL_SECONDS)
+
+
+def kv_cache_stats() -> Dict[str, Any]:
+    return kv_cache.snapshot_stats()
+
+
+def kv_version(name: str) -> int:
+    """Versi key AppKV (kolom version di DB) yang terakhir terlihat proses ini; 0 = belum ada."""
+    return kv_cache.version(name)
+
+
+RESOURCE_VERSION_PREFIX = "resource_version:"
+
+
+def resource_version(resource: str) -> int:
+    """
+    Versi koleksi tabel (mis. 'posko', 'videos') untuk ETag. Disimpan sebagai
+    key AppKV sehingga ikut cache + polling lintas worker.
+    """
+    return read_json_versioned(RESOURCE_VERSION_PREFIX + resource, None)[1]
+
+
+async def resource_version_async(resource: str) -> int:
+    return (await read_json_versioned_async(RESOURCE_VERSION_PREFIX + resource, None))[1]
+
+
+def bump_resource_version(resource: str) -> int:
+    """Dipanggil setelah CRUD admin mengubah koleksi; kolom version AppKV naik atomik."""
+    return write_json(RESOURCE_VERSION_PREFIX + resource, {"changed_at": datetime.now(timezone.utc).isoformat()})
+
+
+def _upsert_stmt(name: str, payload: str, now: datetime):
+    """INSERT ... ON CONFLICT DO UPDATE ... RETURNING version (Postgres & SQLite)."""
+    insert = dialect_insert()
+    if insert is None:
+        return None
+
+    table = AppKV.__table__
+    stmt = insert(table).values(key=name, value_json=payload, updated_at=now, version=1)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={
+            "value_json": stmt.excluded.value_json,
+            "updated_at": stmt.excluded.updated_at,
+            "version": table.c.version + 1,
+        },
+    ).returning(table.c.version)
+
+
+def _read_row(name: str) -> tuple[Any, int]:
+    with Session(engine) as session:
+        item = session.get(AppKV, name)
+        if item is None:
+            return _MISSING, 0
+        value = kv_codec.decode(item.value_json)
+        version = item.version or 1
+        kv_cache.put(name, value, version)
+        return value, version
+
+
+def read_json_versioned(name: str, default: Any) -> tuple[Any, int]:
+    """Seperti read_json(), plus versi baris (0 kalau key belum ada)."""
+    kv_cache.poll_remote_changes()
+    entry = kv_cache.get(name)
+    if entry is not _MISSING:
+        if entry.value is _MISSING:
+            return default, 0
+        return _copy_json(entry.value), entry.version
+
     try:
-        with Session(engine) as session:
-            item = session.get(AppKV, name)
-            if item is not None:
-                return json.loads(item.value_json)
+        value, version = _read_row(name)
+        if value is not _MISSING:
+            return _copy_json(value), version
     except Exception:
         pass
 
     legacy = _read_legacy_json(name)
     if legacy is _MISSING:
-        return default
+        kv_cache.put(name, _MISSING, 0)
+        return default, 0
 
     try:
-        write_json(name, legacy)
+        version = compare_and_swap(name, 0, legacy)
+        if version is not None:
+            return legacy, version
+        return read_json_versioned(name, default)
     except Exception:
-        pass
-    return legacy
+        return legacy, 0
 
 
-def write_json(name: str, data: Any) -> None:
-    payload = json.dumps(data, ensure_ascii=False, indent=2)
-    with Session(engine) as session:
-        item = session.get(AppKV, name)
-        if item is None:
-            item = AppKV(key=name, value_json=payload)
+def read_json(name: str, default: Any) -> Any:
+    return read_json_versioned(name, default)[0]
+
+
+async def read_json_versioned_async(name: str, default: Any) -> tuple[Any, int]:
+    """
+    read_json_versioned() untuk handler async: cache hit tanpa I/O, miss dibaca lewat
+    engine async (atau threadpool). Key yang belum ada di DB (migrasi file JSON lama)
+    diserahkan ke jalur sync.
+    """
+    await kv_cache.poll_remote_changes_async()
+    entry = kv_cache.get(name)
+    if entry is not _MISSING:
+        if entry.value is _MISSING:
+            return default, 0
+        return _copy_json(entry.value), entry.version
+
+    table = AppKV.__table__
+    try:
+        rows = await fetch_all(select(table.c.value_json, table.c.version).where(table.c.key == name))
+        if rows:
+            value = kv_codec.decode(rows[0][0])
+            version = rows[0][1] or 1
+            kv_cache.put(name, value, version)
+            return _copy_json(value), version
+    except Exception as e:
+        logger.warning("KV async read %s gagal, pakai jalur sync: %s: %s", name, type(e).__name__, e)
+    return await run_in_threadpool(read_json_versioned, name, default)
+
+
+async def read_json_async(name: str, default: Any) -> Any:
+    return (await read_json_versioned_async(name, default))[0]
+
+
+def _upsert_in(conn: Connection, name: str, stmt: Any) -> int:
+    version = int(conn.execute(stmt).scalar_one())
+    record_kv_change(conn, name)
+    return version
+
+
+def write_json(name: str, data: Any) -> int:
+    """Tulis seluruh nilai dengan satu upsert. Return versi baru."""
+    payload = kv_codec.encode(data)
+    now = datetime.now(timezone.utc)
+    stmt = _upsert_stmt(name, payload, now)
+    if stmt is not None:
+        with engine.begin() as conn:
+            version = _upsert_in(conn, name, stmt)
+    else:
+        with Session(engine) as session:
+            item = session.get(AppKV, name)
+            if item is None:
+                item = AppKV(key=name, value_json=payload, version=1)
+            else:
+                item.value_json = payload
+                item.updated_at = now
+                item.version = (item.version or 1) + 1
+            version = item.version
+            session.add(item)
+            record_kv_change(session.connection(), name)
+            session.commit()
+    kv_cache.put(name, kv_codec.decode(payload), version)
+    return version
+
+
+async def write_json_async(name: str, data: Any) -> int:
+    payload = kv_codec.encode(data)
+    stmt = _upsert_stmt(name, payload, datetime.now(timezone.utc))
+    if stmt is None:
+        return await run_in_threadpool(write_json, name, data)
+    version = await run_in_transaction(lambda conn: _upsert_in(conn, name, stmt))
+    kv_cache.put(name, kv_codec.decode(payload), version)
+    return version
+
+
+def compare_and_swap(name: str, expected_version: int, data: Any) -> Optional[int]:
+    """
+    Tulis `data` hanya jika versi baris masih `expected_version`
+    (0 = key belum ada). Return versi baru, atau None kalau kalah balapan.
+    """
+    payload = kv_codec.encode(data)
+    now = datetime.now(timezone.utc)
+    table = AppKV.__table__
+
+    with engine.begin() as conn:
+        if expected_version == 0:
+            insert = dialect_insert()
+            if insert is not None:
+                stmt = (
+                    insert(table)
+                    .values(key=name, value_json=payload, updated_at=now, version=1)
+                    .on_conflict_do_nothing(index_elements=[table.c.key])
+                    .returning(table.c.version)
+                )
+                version = conn.execute(stmt).scalar_one_or_none()
+            else:
+                exists = conn.execute(select(table.c.key).where(table.c.key == name)).first()
+                version = None
+                if exists is None:
+                    conn.execute(table.insert().values(key=name, value_json=payload, updated_at=now, version=1))
+                    version = 1
+        else:
+            stmt = (
+                table.update()
+                .where(table.c.key == name, table.c.version == expected_version)
+                .values(value_json=payload, updated_at=now, version=table.c.version + 1)
+            )
+            result = conn.execute(stmt)
+            version = expected_version + 1 if result.rowcount == 1 else None
+        if version is not None:
+            record_kv_change(conn, name)
+
+    if version is None:
+        kv_cache.invalidate(name)
+        return None
+    kv_cache.put(name, kv_codec.decode(payload), int(version))
+    return int(version)
+
+
+def update_json(name: str, fn: Callable[[Any], Any], default: Any) -> tuple[Any, int]:
+    """
+    Read-modify-write atomik dengan optimistic concurrency:
+    baca (biasanya dari cache), jalankan fn(value) -> nilai baru, lalu
+    compare_and_swap. Kalau versi sudah berubah, tunggu sebentar (backoff + jitter),
+    baca ulang dari DB dan ulangi. Return (nilai baru, versi baru).
+    KVConflictError kalau tetap kalah setelah KV_CAS_MAX_RETRIES percobaan.
+    """
+    value, version = read_json_versioned(name, default)
+    for attempt in range(KV_CAS_MAX_RETRIES):
+        new_value = fn(value)
+        new_version = compare_and_swap(name, version, new_value)
+        if new_version is not None:
+            return new_value, new_version
+        if attempt + 1 == KV_CAS_MAX_RETRIES:
+            break
+        time.sleep(random.uniform(0, min(KV_CAS_BACKOFF_MAX_MS, KV_CAS_BACKOFF_MS * 2 ** attempt)) / 1000)
+        value, version = _read_row(name)
+        if value is _MISSING:
+            value, version = _copy_json(default), 0
         else:
-            item.value_json = payload
-            item.updated_at = datetime.now(timezone.utc)
-        session.add(item)
-        session.commit()
+            value = _copy_json(value)
+    raise KVConflictError(f"update_json({name!r}) gagal setelah {KV_CAS_MAX_RETRIES} percobaan")
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """JSON Merge Patch (RFC 7386): dict digabung rekursif, nilai None menghapus key."""
+    if not isinstance(patch, dict):
+        return _copy_json(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def patch_json(name: str, patch: Dict[str, Any], default: Any) -> tuple[Any, int]:
+    """Update parsial: terapkan JSON Merge Patch ke nilai key secara atomik."""
+    return update_json(name, lambda current: merge_patch(current, patch), default)
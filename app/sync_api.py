@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Query
+from sqlmodel import Session, select
+
+from .changelog import SYNC_KV_KEYS, head_seq, pruned_seq
+from .db import engine
+from .models import ChangeLog, Posko, PoskoOut, Video, VideoOut
+from .storage import read_json_versioned
+
+router = APIRouter(tags=["sync"])
+
+SYNC_MAX_LIMIT = int(os.environ.get("SYNC_MAX_LIMIT", "2000"))
+
+# entity di ChangeLog -> (model tabel, model output)
+_TABLES = {
+    "posko": (Posko, PoskoOut),
+    "videos": (Video, VideoOut),
+}
+
+
+def _empty_changes() -> Dict[str, Any]:
+    changes: Dict[str, Any] = {name: {"upserted": [], "deleted": []} for name in _TABLES}
+    changes["kv"] = {"upserted": {}, "deleted": []}
+    return changes
+
+
+def _read_kv(keys) -> Dict[str, Any]:
+    values = {}
+    for key in sorted(keys):
+        value, version = read_json_versioned(key, None)
+        if version:
+            values[key] = value
+    return values
+
+
+def _full_snapshot(session: Session) -> Dict[str, Any]:
+    changes = _empty_changes()
+    for name, (model, out) in _TABLES.items():
+        rows = session.exec(select(model).order_by(model.created_at.desc())).all()
+        changes[name]["upserted"] = [out.model_validate(row.model_dump()) for row in rows]
+    changes["kv"]["upserted"] = _read_kv(SYNC_KV_KEYS)
+    return changes
+
+
+def _delta(session: Session, entries: List[ChangeLog]) -> Dict[str, Any]:
+    changes = _empty_changes()
+    upserts: Dict[str, List[str]] = defaultdict(list)
+    for entry in entries:
+        if entry.entity not in changes:
+            continue
+        if entry.op == "delete":
+            changes[entry.entity]["deleted"].append(entry.entity_id)
+        else:
+            upserts[entry.entity].append(entry.entity_id)
+
+    for name, (model, out) in _TABLES.items():
+        ids = upserts.get(name)
+        if not ids:
+            continue
+        # Baris yang sudah terhapus lagi dilewati; tombstone-nya punya seq lebih besar.
+        rows = session.exec(select(model).where(model.id.in_(ids))).all()
+        changes[name]["upserted"] = [out.model_validate(row.model_dump()) for row in rows]
+    if upserts.get("kv"):
+        changes["kv"]["upserted"] = _read_kv(upserts["kv"])
+    return changes
+
+
+@router.get("/sync")
+def sync_changes(
+    since: int = Query(0, ge=0, description="cursor dari respons /sync sebelumnya; 0 = sinkron penuh"),
+    limit: int = Query(500, ge=1),
+) -> Dict[str, Any]:
+    """
+    Change feed untuk aplikasi: posko, video, dan key publik (status darurat,
+    cache MAGMA) yang berubah sejak `since`, termasuk id yang dihapus.
+    - since=0 atau reset=true: isi lengkap; klien mengganti data lokalnya.
+    - has_more=true: panggil lagi dengan cursor yang dikembalikan.
+    """
+    limit = min(limit, SYNC_MAX_LIMIT)
+    with Session(engine) as session:
+        # Head dibaca sebelum data: perubahan di tengah jalan terkirim lagi di sync berikutnya.
+        head = head_seq(session.connection())
+        reset = since > 0 and (since < pruned_seq() or since > head)
+        if since == 0 or reset:
+            return {"cursor": head, "full": True, "reset": reset, "has_more": False, **_full_snapshot(session)}
+
+        rows = session.exec(
+            select(ChangeLog).where(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit + 1)
+        ).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        cursor = rows[-1].seq if rows else since
+        return {"cursor": cursor, "full": False, "reset": False, "has_more": has_more, **_delta(session, rows)}
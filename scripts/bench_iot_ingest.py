@@ -0,0 +1,97 @@
+"""
+Benchmark throughput ingest sensor kualitas udara, in-process lewat TestClient
+(tanpa jaringan), memakai database SQLite sementara kecuali DATABASE_URL diset.
+
+  python scripts/bench_iot_ingest.py                       # default: 20k bacaan, 50 device, batch 1000
+  python scripts/bench_iot_ingest.py --readings 50000 --batch 2000 --ndjson
+  python scripts/bench_iot_ingest.py --single 500          # bandingkan dengan POST /iot/air per bacaan
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+# Harus diset sebelum modul app di-import.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.mkdtemp()) / 'bench.db'}")
+os.environ.setdefault("HTTP_REPLAY_DIR", str(Path(__file__).resolve().parent / "fixtures"))
+os.environ.pop("IOT_API_KEY", None)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.db import init_db  # noqa: E402
+from app.iot_api import router  # noqa: E402
+
+
+def _readings(count: int, devices: int) -> list[dict]:
+    start = datetime.now(timezone.utc) - timedelta(seconds=count * 5 // devices)
+    out = []
+    for i in range(count):
+        out.append({
+            "device_id": f"karo-{i % devices:03d}",
+            "ts": (start + timedelta(seconds=5 * (i // devices))).isoformat(),
+            "pm25": round(random.uniform(3, 180), 1),
+            "pm10": round(random.uniform(5, 250), 1),
+            "pm1": round(random.uniform(1, 90), 1),
+        })
+    return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=20000)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--ndjson", action="store_true", help="kirim sebagai NDJSON, bukan array JSON")
+    parser.add_argument("--single", type=int, default=0, help="jumlah POST /iot/air tunggal untuk pembanding")
+    args = parser.parse_args()
+
+    from fastapi import FastAPI
+
+    init_db()
+    app = FastAPI()
+    app.include_router(router)
+    readings = _readings(args.readings, args.devices)
+
+    with TestClient(app) as client:
+        t0 = time.perf_counter()
+        accepted = 0
+        for i in range(0, len(readings), args.batch):
+            chunk = readings[i:i + args.batch]
+            if args.ndjson:
+                body = "\n".join(json.dumps(r) for r in chunk)
+                resp = client.post("/iot/air/batch", content=body, headers={"Content-Type": "application/x-ndjson"})
+            else:
+                resp = client.post("/iot/air/batch", json=chunk)
+            resp.raise_for_status()
+            accepted += resp.json()["accepted"]
+        elapsed = time.perf_counter() - t0
+        fmt = "ndjson" if args.ndjson else "json"
+        print(f"batch  {fmt:<6} size={args.batch:<5} readings={accepted:<7} {elapsed:7.2f}s  {accepted / elapsed:9.0f} readings/s")
+
+        if args.single:
+            t0 = time.perf_counter()
+            for r in readings[:args.single]:
+                client.post("/iot/air", json=r).raise_for_status()
+            elapsed = time.perf_counter() - t0
+            print(f"single POST /iot/air     readings={args.single:<7} {elapsed:7.2f}s  {args.single / elapsed:9.0f} readings/s")
+
+        history = client.get("/iot/air/history", params={"device_id": "karo-000", "step": "1h"}).json()
+        print(f"history karo-000: {len(history['points'])} bucket dari {history['source']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
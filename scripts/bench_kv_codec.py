@@ -0,0 +1,112 @@
+"""
+Benchmark codec AppKV.value_json: waktu encode/decode dan ukuran baris
+untuk nilai-nilai KV yang sering dipakai (format lama ber-indent vs codec baru).
+
+  python scripts/bench_kv_codec.py [--iterations N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from app import kv_codec  # noqa: E402
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+def _samples() -> dict:
+    expected = json.loads((FIXTURES_DIR / "expected.json").read_text(encoding="utf-8"))
+    report = expected["reports"][0]
+    magma_cache = {
+        "name": "Sinabung",
+        "source": "MAGMA/PVMBG",
+        "level": report["level"],
+        "report_id": report["report_id"],
+        "report_url": report["url"],
+        "title": report["title"],
+        "rekomendasi": report["rekomendasi"],
+        "radius_info": report["radius_info"],
+        "cached_at": "2026-10-17T01:00:00+00:00",
+    }
+    return {
+        "air_quality_state": {
+            "pm25": 38.5,
+            "pm10": 61.2,
+            "pm1": 20.1,
+            "status": "yellow",
+            "label": "sedang",
+            "updated_at": "2026-10-17T01:41:27.123456+00:00",
+            "device_id": "karo-naman-teran-01",
+            "is_mock": False,
+            "source": "sensor",
+        },
+        "emergency_state": {
+            "active": True,
+            "level": "AWAS",
+            "message": "Segera evakuasi ke posko terdekat!",
+            "updated_at": "2026-10-17T01:41:27.123456+00:00",
+        },
+        "magma_latest_cache": magma_cache,
+        "magma_http_cache": {
+            f"https://magma.esdm.go.id/v1/gunung-api/laporan/{24000 + i}": {
+                "etag": None,
+                "last_modified": None,
+                "body_hash": "9f2c" * 16,
+                "parsed": {k: magma_cache[k] for k in ("level", "title", "rekomendasi")},
+            }
+            for i in range(10)
+        },
+    }
+
+
+def _legacy_encode(data) -> str:
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def _median_us(fn, iterations: int) -> float:
+    fn()
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    # codec -> (encode, decode). "legacy" = format lama: stdlib json indent=2.
+    codecs = {"legacy (indent=2)": (_legacy_encode, json.loads)}
+    for name in kv_codec.CODECS:
+        if name == "msgpack" and kv_codec.msgpack is None:
+            continue
+        codecs[name] = (lambda data, name=name: kv_codec.encode(data, codec=name), kv_codec.decode)
+
+    print(f"orjson: {'ya' if kv_codec.orjson is not None else 'tidak'}, msgpack: {'ya' if kv_codec.msgpack is not None else 'tidak'}")
+    header = f"{'key':<20} {'codec':<18} {'bytes':>7} {'encode us':>10} {'decode us':>10}"
+    print(header)
+    print("-" * len(header))
+    for key, value in _samples().items():
+        for codec_name, (encode, decode) in codecs.items():
+            text = encode(value)
+            assert kv_codec.decode(text) == value, f"{key}/{codec_name} round-trip gagal"
+            enc = _median_us(lambda: encode(value), args.iterations)
+            dec = _median_us(lambda: decode(text), args.iterations)
+            print(f"{key:<20} {codec_name:<18} {len(text.encode('utf-8')):>7} {enc:>10.2f} {dec:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
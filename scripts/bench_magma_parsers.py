@@ -0,0 +1,197 @@
+"""
+Benchmark + regresi parser MAGMA/BMKG terhadap fixture rekaman di scripts/fixtures.
+Jalan sepenuhnya offline (HTTP dijawab dari fixture lewat app/http_replay.py).
+
+  python scripts/bench_magma_parsers.py              # regresi + benchmark
+  python scripts/bench_magma_parsers.py --check      # regresi saja, exit 1 kalau gagal
+  python scripts/bench_magma_parsers.py --record     # rekam ulang fixture dari upstream (butuh internet)
+
+Kolom "peak KiB"/"blocks" dari tracemalloc: hanya alokasi Python, memori internal
+libxml2 (backend lxml) tidak ikut terhitung.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+# Harus diset sebelum modul app di-import.
+os.environ["HTTP_REPLAY_DIR"] = str(FIXTURES_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.mkdtemp()) / 'bench.db'}")
+
+import httpx  # noqa: E402
+
+from app import bmkg, magma  # noqa: E402
+from app.db import init_db  # noqa: E402
+from app.http_replay import load_manifest, replay_transport  # noqa: E402
+from app.magma_parsers import BACKENDS  # noqa: E402
+from app.main import _extract_radius_km  # noqa: E402
+from scripts import magma_cache_updater as updater  # noqa: E402
+
+
+def _load_expected() -> dict:
+    return json.loads((FIXTURES_DIR / "expected.json").read_text(encoding="utf-8"))
+
+
+def _read(rel: str) -> str:
+    return (FIXTURES_DIR / rel).read_text(encoding="utf-8")
+
+
+# ---------------------------------------------------------------------------
+# Regresi
+# ---------------------------------------------------------------------------
+def _compare(label: str, got, want, failures: list[str]) -> None:
+    if got != want:
+        failures.append(f"{label}:\n    got:  {got!r}\n    want: {want!r}")
+
+
+def run_checks() -> list[str]:
+    expected = _load_expected()
+    failures: list[str] = []
+    tingkat = expected["tingkat"]
+    report_fields = ("level", "title", "rekomendasi")
+
+    for name, backend in BACKENDS.items():
+        got = backend.find_report_url(_read(tingkat["file"]), tingkat["url"])
+        _compare(f"[{name}] tingkat report_url", got, tingkat["report_url"], failures)
+        for report in expected["reports"]:
+            detail = backend.parse_report(_read(report["file"]))
+            for field in report_fields:
+                _compare(f"[{name}] {report['file']} {field}", detail.get(field), report[field], failures)
+
+    for report in expected["reports"]:
+        _compare(f"_extract_radius_km {report['file']}", _extract_radius_km(report["rekomendasi"]), report["radius_info"], failures)
+
+    # Jalur fetch app lengkap (client registry -> replay transport).
+    async def _app_path() -> None:
+        init_db()
+        got_url = await magma.get_latest_sinabung_report_url(tingkat["url"])
+        _compare("app.magma.get_latest_sinabung_report_url", got_url, tingkat["report_url"], failures)
+        for report in expected["reports"]:
+            detail = await magma.fetch_report_detail(report["url"])
+            _compare(f"app.magma.fetch_report_detail {report['file']} report_id", detail.get("report_id"), report["report_id"], failures)
+            for field in report_fields:
+                _compare(f"app.magma.fetch_report_detail {report['file']} {field}", detail.get(field), report[field], failures)
+        quake = await bmkg.fetch_latest_quake(expected["bmkg"]["url"])
+        _compare("app.bmkg.fetch_latest_quake", quake, expected["bmkg"]["quake"], failures)
+
+    asyncio.run(_app_path())
+
+    # Script updater GitHub Actions memakai parser BeautifulSoup sendiri.
+    with httpx.Client(transport=replay_transport(FIXTURES_DIR)) as client:
+        got_url = updater._get_latest_report_url(tingkat["url"], client)
+        _compare("scripts.magma_cache_updater._get_latest_report_url", got_url, tingkat["report_url"], failures)
+        for report in expected["reports"]:
+            detail = updater._fetch_detail(report["url"], client)
+            for field in ("report_id",) + report_fields:
+                _compare(f"scripts.magma_cache_updater._fetch_detail {report['file']} {field}", detail.get(field), report[field], failures)
+
+    return failures
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+def _time_it(fn, iterations: int) -> list[float]:
+    fn()  # warm-up
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _peak_alloc(fn) -> tuple[int, int]:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return peak, blocks
+
+
+def run_bench(iterations: int) -> None:
+    expected = _load_expected()
+    tingkat = expected["tingkat"]
+    cases = [(tingkat["file"], lambda b, page: b.find_report_url(page, tingkat["url"]))]
+    for report in expected["reports"]:
+        cases.append((report["file"], lambda b, page: b.parse_report(page)))
+
+    header = f"{'backend':<8} {'fixture':<32} {'median ms':>10} {'p95 ms':>8} {'pages/s':>9} {'MB/s':>7} {'peak KiB':>9} {'blocks':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, backend in BACKENDS.items():
+        for rel, call in cases:
+            page = _read(rel)
+            size_mb = len(page.encode("utf-8")) / 1_000_000
+            samples = _time_it(lambda: call(backend, page), iterations)
+            median = statistics.median(samples)
+            p95 = sorted(samples)[max(0, int(len(samples) * 0.95) - 1)]
+            peak, blocks = _peak_alloc(lambda: call(backend, page))
+            print(
+                f"{name:<8} {rel:<32} {median * 1000:>10.3f} {p95 * 1000:>8.3f} "
+                f"{1 / median:>9.0f} {size_mb / median:>7.1f} {peak / 1024:>9.1f} {blocks:>7}"
+            )
+
+    for report in expected["reports"]:
+        samples = _time_it(lambda: _extract_radius_km(report["rekomendasi"]), iterations)
+        median = statistics.median(samples)
+        print(f"{'-':<8} {'_extract_radius_km ' + report['report_id']:<32} {median * 1000:>10.3f} {'':>8} {1 / median:>9.0f}")
+
+
+def record() -> None:
+    routes = load_manifest(FIXTURES_DIR)
+    with httpx.Client(timeout=30, headers={"User-Agent": "sinabung-alert-mvp/1.0"}) as client:
+        for route in routes.values():
+            resp = client.get(route["url"])
+            resp.raise_for_status()
+            route["path"].write_bytes(resp.content)
+            print(f"recorded {route['url']} -> {route['path'].relative_to(FIXTURES_DIR)} ({len(resp.content)} bytes)")
+    print("Perbarui scripts/fixtures/expected.json kalau isi halaman berubah.")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--check", action="store_true", help="hanya regresi")
+    parser.add_argument("--record", action="store_true", help="rekam ulang fixture dari upstream")
+    args = parser.parse_args()
+
+    if args.record:
+        record()
+        return 0
+
+    failures = run_checks()
+    if failures:
+        print(f"REGRESSION: {len(failures)} mismatch")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print(f"Regression OK ({', '.join(BACKENDS)} + app fetch path + magma_cache_updater)")
+
+    if not args.check:
+        print()
+        run_bench(args.iterations)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,82 @@
+"""
+Cek invariant update_json() di bawah penulis bersamaan: N thread menaikkan satu
+counter AppKV lewat update_json(); hasil akhir harus tepat threads x updates dan
+tidak boleh ada KVConflictError. Memakai database SQLite sementara kecuali
+DATABASE_URL diset. Exit code 1 kalau invariant dilanggar.
+
+  python scripts/check_kv_update_json.py                    # default: 16 thread x 50 update
+  python scripts/check_kv_update_json.py --threads 32 --updates 25
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+# Harus diset sebelum modul app di-import.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.mkdtemp()) / 'check.db'}")
+
+from app.db import init_db  # noqa: E402
+from app.storage import KVConflictError, read_json, update_json, write_json  # noqa: E402
+
+KEY = "check_kv_update_json"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--updates", type=int, default=50, help="update_json per thread")
+    args = parser.parse_args()
+
+    init_db()
+    write_json(KEY, {"count": 0})
+    conflicts = []
+    errors = []
+    start = threading.Barrier(args.threads)
+
+    def _increment(value):
+        return {"count": value["count"] + 1}
+
+    def _worker() -> None:
+        start.wait()
+        for _ in range(args.updates):
+            try:
+                update_json(KEY, _increment, {"count": 0})
+            except KVConflictError as e:
+                conflicts.append(e)
+            except Exception as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=_worker) for _ in range(args.threads)]
+    t0 = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - t0
+
+    expected = args.threads * args.updates
+    count = read_json(KEY, {"count": 0})["count"]
+    print(f"update_json: {args.threads} thread x {args.updates} = {expected} update dalam {elapsed:.2f}s")
+    print(f"  counter akhir : {count}")
+    print(f"  KVConflictError: {len(conflicts)}")
+    if errors:
+        print(f"  error lain    : {len(errors)} ({type(errors[0]).__name__}: {errors[0]})")
+
+    ok = count == expected - len(conflicts) and not conflicts and not errors
+    print("OK" if ok else "GAGAL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -40,10 +40,17 @@ def _extract_radius_km(rekomendasi: list[str]) -> list[str]:
     return uniq
 
 
-def _get_latest_report_url(tingkat_url: str) -> str:
-    with httpx.Client(timeout=30) as client:
-        r = client.get(tingkat_url, headers={"User-Agent": "sinabung-alert-mvp/1.0"})
+def _get(url: str, client: httpx.Client | None = None) -> httpx.Response:
+    if client is not None:
+        r = client.get(url, headers={"User-Agent": "sinabung-alert-mvp/1.0"})
         r.raise_for_status()
+        return r
+    with httpx.Client(timeout=30) as own_client:
+        return _get(url, own_client)
+
+
+def _get_latest_report_url(tingkat_url: str, client: httpx.Client | None = None) -> str:
+    r = _get(tingkat_url, client)
 
     soup = BeautifulSoup(r.text, "html.parser")
     candidates = soup.find_all(string=re.compile(r"\bSinabung\b", re.IGNORECASE))
@@ -59,10 +66,8 @@ def _get_latest_report_url(tingkat_url: str) -> str:
     raise RuntimeError("Link laporan Sinabung tidak ditemukan di halaman tingkat aktivitas.")
 
 
-def _fetch_detail(report_url: str) -> dict:
-    with httpx.Client(timeout=30) as client:
-        r = client.get(report_url, headers={"User-Agent": "sinabung-alert-mvp/1.0"})
-        r.raise_for_status()
+def _fetch_detail(report_url: str, client: httpx.Client | None = None) -> dict:
+    r = _get(report_url, client)
 
     soup = BeautifulSoup(r.text, "html.parser")
     text = soup.get_text("\n", strip=True)
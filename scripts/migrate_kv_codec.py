@@ -0,0 +1,65 @@
+"""
+Tulis ulang semua baris AppKV.value_json dengan codec aktif (KV_CODEC, default JSON
+ringkas). Isi nilai tidak berubah, jadi version/updated_at dibiarkan.
+
+  python scripts/migrate_kv_codec.py --dry-run     # hitung ukuran saja
+  python scripts/migrate_kv_codec.py --codec msgpack
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from sqlmodel import Session, select
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from app import kv_codec  # noqa: E402
+from app.db import engine, init_db  # noqa: E402
+from app.models import AppKV  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="hitung ukuran saja, tanpa menulis")
+    parser.add_argument("--codec", choices=sorted(kv_codec.CODECS), default=kv_codec.KV_CODEC)
+    args = parser.parse_args()
+
+    init_db()
+
+    rows = 0
+    changed = 0
+    bytes_before = 0
+    bytes_after = 0
+
+    with Session(engine) as session:
+        keys = session.exec(select(AppKV.key)).all()
+        for key in keys:
+            item = session.get(AppKV, key)
+            if item is None:
+                continue
+            old = item.value_json
+            new = kv_codec.encode(kv_codec.decode(old), codec=args.codec)
+            rows += 1
+            bytes_before += len(old.encode("utf-8"))
+            bytes_after += len(new.encode("utf-8"))
+            if new != old:
+                changed += 1
+                if not args.dry_run:
+                    # Isi nilai tidak berubah, jadi version/updated_at dibiarkan.
+                    item.value_json = new
+                    session.add(item)
+                    session.commit()
+            session.expunge(item)
+
+    print("Migrasi codec AppKV" + (" (dry-run)" if args.dry_run else "") + f" -> {args.codec}")
+    print(f"Baris   : {rows} (berubah {changed})")
+    print(f"Ukuran  : {bytes_before} -> {bytes_after} bytes")
+
+
+if __name__ == "__main__":
+    main()
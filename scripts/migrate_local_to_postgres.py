@@ -3,6 +3,7 @@ from __future__ import annotations
 import json
 import os
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
 
 from sqlmodel import Session, SQLModel, create_engine, select
@@ -11,6 +12,8 @@ BASE_DIR = Path(__file__).resolve().parents[1]
 if str(BASE_DIR) not in sys.path:
     sys.path.insert(0, str(BASE_DIR))
 
+from app import kv_codec
+from app.changelog import record_change, record_kv_change
 from app.models import AppKV, Posko, Video
 
 DATA_DIR = BASE_DIR / "data"
@@ -26,16 +29,22 @@ def _load_json(path: Path):
 
 
 def _upsert_kv(session: Session, key: str, value) -> None:
+    # Sama seperti storage.write_json, tapi lewat session DB target. updated_at ikut
+    # diperbarui supaya cache KV di worker yang sedang jalan melihat perubahan ini.
     item = session.get(AppKV, key)
-    payload = json.dumps(value, ensure_ascii=False, indent=2)
+    payload = kv_codec.encode(value)
+    now = datetime.now(timezone.utc)
     if item is None:
-        item = AppKV(key=key, value_json=payload)
+        item = AppKV(key=key, value_json=payload, updated_at=now)
     else:
         item.value_json = payload
+        item.updated_at = now
+        item.version = (item.version or 0) + 1
     session.add(item)
+    record_kv_change(session.connection(), key)
 
 
-def _migrate_sql_table(source_session: Session, target_session: Session, model) -> int:
+def _migrate_sql_table(source_session: Session, target_session: Session, model, entity: str) -> int:
     rows = source_session.exec(select(model)).all()
     count = 0
     for row in rows:
@@ -47,6 +56,8 @@ def _migrate_sql_table(source_session: Session, target_session: Session, model)
             for field_name, value in payload.items():
                 setattr(existing, field_name, value)
             target_session.add(existing)
+        # Klien /sync yang sudah punya cursor di DB target ikut menerima data hasil migrasi.
+        record_change(target_session.connection(), entity, row.id)
         count += 1
     return count
 
@@ -66,8 +77,8 @@ def main() -> None:
     }
 
     with Session(source_engine) as source_session, Session(target_engine) as target_session:
-        migrated_counts["posko"] = _migrate_sql_table(source_session, target_session, Posko)
-        migrated_counts["video"] = _migrate_sql_table(source_session, target_session, Video)
+        migrated_counts["posko"] = _migrate_sql_table(source_session, target_session, Posko, "posko")
+        migrated_counts["video"] = _migrate_sql_table(source_session, target_session, Video, "videos")
 
         for json_file in sorted(DATA_DIR.glob("*.json")):
             value = _load_json(json_file)
@@ -83,6 +94,11 @@ def main() -> None:
                 _upsert_kv(target_session, "scheduler_state", value)
                 migrated_counts["kv"] += 1
 
+        # Naikkan versi koleksi supaya ETag /evacuation/posts & /education/videos berubah.
+        migrated_at = datetime.now(timezone.utc).isoformat()
+        _upsert_kv(target_session, "resource_version:posko", {"changed_at": migrated_at})
+        _upsert_kv(target_session, "resource_version:videos", {"changed_at": migrated_at})
+
         target_session.commit()
 
     print("Migrasi selesai.")